@@ -5,6 +5,14 @@ from fastapi.staticfiles import StaticFiles
 import os
 
 from .api import setup_routes
+from .services.admission_service import admission_controller
+from .services.drain_service import drain_service
+from .services.message_service import message_service
+from .services.api_service import api_service
+from .services.session_service import session_service
+from .services.state_backend import state_backend
+from .services.transcript_service import transcript_persister
+from .services.attachment_store import attachment_store
 from .utils.config_utils import get_config, save_example_env_file
 
 def create_app() -> FastAPI:
@@ -59,6 +67,25 @@ def create_app() -> FastAPI:
         Actions to perform on application startup.
         """
         print("Starting NeonChat API...")
+        
+        # Open the pooled Claude API client and warm up a connection
+        await api_service.startup()
+        
+        # Connect the shared session state, then start WebSocket heartbeats and idle reaping
+        await state_backend.start()
+        session_service.startup()
+        
+        # Write chat transcripts behind the conversation
+        await transcript_persister.start()
+        
+        # Index stored attachments for the attachment store's size limit
+        attachment_store.startup()
+        
+        # Sample event loop lag for admission control
+        admission_controller.startup()
+        
+        # Drain connections before the server acts on SIGTERM
+        drain_service.install_signal_handler()
     
     @app.on_event("shutdown")
     async def shutdown_event():
@@ -68,5 +95,11 @@ def create_app() -> FastAPI:
         print("Shutting down NeonChat API...")
         
         # Clean up any resources (e.g., close database connections)
+        await admission_controller.shutdown()
+        await api_service.shutdown()
+        await session_service.shutdown()
+        await transcript_persister.close()
+        await state_backend.close()
+        message_service.close()
     
     return app
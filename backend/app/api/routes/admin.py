@@ -0,0 +1,81 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from typing import Optional, Dict, Any
+import secrets
+
+from ...services.admission_service import admission_controller
+from ...services.api_service import api_service
+from ...services.attachment_store import attachment_store
+from ...services.drain_service import drain_service
+from ...services.scheduler_service import llm_scheduler
+from ...services.session_service import session_service
+from ...services.transcript_service import transcript_persister
+from ...services.usage_service import usage_service
+from ..ws.outbound_queue import outbound_metrics
+from .auth import get_current_active_user
+
+router = APIRouter(prefix="/api/admin", tags=["admin"])
+
+async def require_operator(x_operator_token: Optional[str] = Header(None)) -> None:
+    """Allow only callers sending DRAIN_OPERATOR_TOKEN; nobody when it is not set"""
+    if not drain_service.operator_token:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Draining over the API is disabled; set DRAIN_OPERATOR_TOKEN"
+        )
+    if x_operator_token is None or not secrets.compare_digest(x_operator_token.encode(), drain_service.operator_token.encode()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid operator token")
+
+@router.get("/usage")
+async def get_usage_report(
+    client_id: Optional[str] = Query(None, description="Only report on this client"),
+    recent: int = Query(0, ge=0, le=500, description="Number of recent raw turn records to include"),
+    current_user: Dict[str, Any] = Depends(get_current_active_user)
+) -> Dict[str, Any]:
+    """Token usage and latency percentiles of recent chat turns, globally and per client"""
+    return usage_service.get_report(client_id=client_id, recent=recent)
+
+@router.post("/drain", dependencies=[Depends(require_operator)])
+async def start_drain() -> Dict[str, Any]:
+    """Drain this worker before a restart: stop taking work, finish responses, move clients off"""
+    drain_service.start()
+    return drain_service.get_status()
+
+@router.get("/drain")
+async def get_drain_status() -> Dict[str, Any]:
+    """Drain state of this worker; "drained" once every client has been moved off"""
+    return drain_service.get_status()
+
+@router.get("/cache/report")
+async def prompt_cache_report(current_user: Dict[str, Any] = Depends(get_current_active_user)) -> Dict[str, Any]:
+    """Prompt cache usage and hit ratio per client"""
+    return api_service.get_cache_report()
+
+@router.get("/scheduler/metrics")
+async def scheduler_metrics(current_user: Dict[str, Any] = Depends(get_current_active_user)) -> Dict[str, Any]:
+    """Outbound LLM scheduler queue depth and wait times"""
+    return llm_scheduler.get_metrics()
+
+@router.get("/streams/metrics")
+async def stream_metrics(current_user: Dict[str, Any] = Depends(get_current_active_user)) -> Dict[str, Any]:
+    """Completed and cancelled Claude stream counters"""
+    return api_service.get_stream_metrics()
+
+@router.get("/admission/metrics")
+async def admission_metrics(current_user: Dict[str, Any] = Depends(get_current_active_user)) -> Dict[str, Any]:
+    """Admission limits, current load and connections and turns shed under overload"""
+    return admission_controller.get_metrics()
+
+@router.get("/ws/metrics")
+async def websocket_metrics(current_user: Dict[str, Any] = Depends(get_current_active_user)) -> Dict[str, Any]:
+    """Outbound queue, heartbeat and retained history gauges for WebSocket sessions"""
+    return {**outbound_metrics.get_metrics(), "sessions": session_service.get_metrics()}
+
+@router.get("/transcripts/metrics")
+async def transcript_metrics(current_user: Dict[str, Any] = Depends(get_current_active_user)) -> Dict[str, Any]:
+    """Buffered, written and journalled chat transcript counters"""
+    return transcript_persister.get_stats()
+
+@router.get("/attachments/metrics")
+async def attachment_metrics(current_user: Dict[str, Any] = Depends(get_current_active_user)) -> Dict[str, Any]:
+    """Size of the attachment store and its deduplication and eviction counters"""
+    return attachment_store.get_stats()
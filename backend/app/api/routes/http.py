@@ -6,6 +6,7 @@ from typing import Dict, Any
 from .auth import router as auth_router
 from .journal import router as journal_router
 from .metrics import router as metrics_router
+from .admin import router as admin_router
 
 # Create the router
 router = APIRouter()
@@ -14,6 +15,7 @@ router = APIRouter()
 router.include_router(auth_router)
 router.include_router(journal_router)
 router.include_router(metrics_router)
+router.include_router(admin_router)
 
 # Get application paths
 BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
@@ -1,75 +1,331 @@
 # app/api/routes/ws.py
 from fastapi import WebSocket, WebSocketDisconnect
+import asyncio
 import uuid
-from typing import Dict, Any
+from collections import deque
+from typing import Dict, Any, Deque, Optional, Awaitable, NamedTuple, Tuple
 from datetime import datetime
 
+from ...services.admission_service import admission_controller, BUSY_CLOSE_CODE
 from ...services.message_service import message_service
+from ...services.session_service import session_service, Session, DRAIN_CLOSE_CODE
+from ...utils.config_utils import get_config
 from ..ws import text_handler, image_handler, file_handler
+from ..ws.outbound_queue import OutboundQueue, RequestChannel
+from ..ws.codec import InvalidFrame, negotiate_codec, decode_message
+from ..ws.upload_handler import UploadManager, UPLOAD_MESSAGE_TYPES
 
-# Dictionary to store active WebSocket connections
-active_connections = {}
+# Message types that start a request handled by _route_message
+REQUEST_MESSAGE_TYPES = ('text', 'image', 'file', 'generate_image')
+
+class _Request(NamedTuple):
+    """A handler task running in a session."""
+    task: asyncio.Task
+    tagged: bool  # The client chose the request id and can demultiplex frames
+
+async def _receive_frames(websocket: WebSocket, inbox: asyncio.Queue, max_bytes: int) -> None:
+    """
+    Read frames from the client into the connection inbox.
+    
+    Runs for the life of the connection so a disconnect or "stop" frame is
+    seen immediately, even while a handler is still streaming a response.
+    
+    Args:
+        websocket: The WebSocket connection
+        inbox: Queue receiving frames; None marks a disconnect
+        max_bytes: Largest inbound frame accepted
+    """
+    try:
+        while True:
+            try:
+                frame = decode_message(await websocket.receive(), max_bytes)
+            except InvalidFrame as e:
+                # Skipped without parsing; the client is told and the connection stays open
+                frame = e
+            await inbox.put(frame)
+    except WebSocketDisconnect:
+        await inbox.put(None)
+    except Exception as e:
+        await inbox.put(e)
+
+def _check_frame(frame: Any) -> Dict[str, Any]:
+    if frame is None:
+        raise WebSocketDisconnect()
+    if isinstance(frame, Exception):
+        raise frame
+    return frame
+
+def _route_message(channel: RequestChannel, client_id: str, data: Dict[str, Any]) -> Optional[Awaitable[None]]:
+    """
+    Pick the handler for a message based on its type.
+    
+    Handlers send through the request's channel, which has the same
+    send_json() interface as the WebSocket and tags frames with the request id.
+    
+    Returns:
+        The handler coroutine, or None for an unknown message type
+    """
+    message_type = data.get('type')
+    
+    if message_type == 'text':
+        return text_handler.handle_text_message(channel, client_id, data)
+    elif message_type == 'image':
+        return image_handler.handle_image_message(channel, client_id, data)
+    elif message_type == 'file':
+        return file_handler.handle_file_message(channel, client_id, data)
+    elif message_type == 'generate_image':
+        return image_handler.handle_image_generation(channel, client_id, data)
+    return None
+
+def _start_requests(session: Session, pending: Deque[Dict[str, Any]], limit: int) -> None:
+    """
+    Start pending requests while the session is under its concurrency limit.
+    
+    Requests carrying a client-chosen request_id run concurrently. Untagged
+    requests come from clients that cannot demultiplex responses, so they
+    keep running one at a time, in order. Request frames go out through the
+    session, which numbers them and keeps them for replay after a reconnect.
+    """
+    running = session.requests
+    serial_busy = any(not request.tagged for request in running.values())
+    waiting: Deque[Dict[str, Any]] = deque()
+    
+    while pending:
+        data = pending.popleft()
+        tagged = bool(data.get('request_id'))
+        if len(running) >= limit or (not tagged and serial_busy):
+            waiting.append(data)
+            continue
+        
+        request_id = str(data['request_id']) if tagged else uuid.uuid4().hex[:12]
+        channel = RequestChannel(session, request_id)
+        task = asyncio.ensure_future(_route_message(channel, session.client_id, data))
+        admission_controller.track_turn(task)
+        running[request_id] = _Request(task, tagged)
+        serial_busy = serial_busy or not tagged
+    
+    pending.extend(waiting)
+
+async def _finish_request(session: Session, request_id: str, task: asyncio.Task) -> None:
+    """Report how a finished request ended; a disconnect ends the connection."""
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error is None:
+        return
+    if isinstance(error, WebSocketDisconnect):
+        raise error
+    
+    print(f"WS request {request_id} failed: {str(error)}")
+    await session.send_json({
+        'role': 'system',
+        'content': f"Error: {str(error)}",
+        'type': 'error',
+        'request_id': request_id
+    })
+
+def _release_upload(data: Dict[str, Any]) -> None:
+    """Close the spooled file of a committed upload that will not be handled."""
+    upload = data.get('upload')
+    if upload is not None:
+        upload.close()
+
+async def _handle_frame(session: Session, data: Dict[str, Any], pending: Deque[Dict[str, Any]]) -> None:
+    """Queue a request, stop running requests, or report an unknown message type."""
+    message_type = data.get('type')
+    request_id = data.get('request_id')
+    
+    if message_type == 'stop':
+        await session_service.stop_requests(session, request_id)
+    elif message_type in REQUEST_MESSAGE_TYPES:
+        if request_id and request_id in session.requests:
+            _release_upload(data)
+            await session.send_json({
+                'role': 'system',
+                'content': f"Request {request_id} is already running",
+                'type': 'error',
+                'request_id': request_id
+            })
+            return
+        
+        # Over a load limit the request is turned away now rather than queued
+        reason = admission_controller.check_turn(len(pending))
+        if reason is not None:
+            _release_upload(data)
+            await session.send_json(admission_controller.busy_frame(
+                reason, **({'request_id': request_id} if request_id else {})
+            ))
+        else:
+            pending.append(data)
+    else:
+        # Unknown message type
+        await session.send_json({
+            'role': 'system',
+            'content': f"Unknown message type: {message_type}",
+            'type': 'error',
+            **({'request_id': request_id} if request_id else {})
+        })
+
+async def _shed_upload(outbound: OutboundQueue, data: Dict[str, Any]) -> bool:
+    """Turn away an upload that would start while the server is overloaded."""
+    reason = admission_controller.check_upload()
+    if reason is None:
+        return False
+    fields = {key: data[key] for key in ('upload_id', 'request_id') if data.get(key)}
+    await outbound.send_json(admission_controller.busy_frame(reason, **fields))
+    return True
+
+async def _reject_connection(websocket: WebSocket, codec: Any, reason: str) -> None:
+    """Tell a client it was turned away and close with "try again later" (or "restarting")."""
+    code = DRAIN_CLOSE_CODE if reason == 'draining' else BUSY_CLOSE_CODE
+    try:
+        await codec.send(websocket, admission_controller.busy_frame(reason))
+        await asyncio.wait_for(websocket.close(code=code), 5)
+    except Exception:
+        pass
+
+def _resume_params(websocket: WebSocket) -> Tuple[Optional[str], Optional[int]]:
+    """Read the session token and last received sequence number from the query string."""
+    token = websocket.query_params.get('session') or None
+    try:
+        last_seq = int(websocket.query_params.get('last_seq', 0))
+    except ValueError:
+        last_seq = 0
+    return token, max(0, last_seq)
 
 async def websocket_endpoint(websocket: WebSocket):
     """
     Handle WebSocket connections and route messages to appropriate handlers.
     
+    The receive loop never waits on a handler: each request runs in its own
+    task, so stop requests and new messages are seen while a response is
+    still streaming.
+    
+    A client reconnecting with ?session=<token>&last_seq=<n> resumes its
+    session: same client id and history, requests that kept running while it
+    was away, and the request frames numbered after n from the replay buffer.
+    
+    Under overload, connections and requests are turned away with a "busy"
+    frame that says when to retry (see the admission controller).
+    
     Args:
         websocket: The WebSocket connection
     """
-    await websocket.accept()
-    client_id = str(uuid.uuid4())
-    active_connections[client_id] = websocket
-    print(f"WS connected: {client_id}")
+    codec, subprotocol = negotiate_codec(websocket)
+    await websocket.accept(subprotocol=subprotocol)
+    token, last_seq = _resume_params(websocket)
+    reason = admission_controller.check_connection(resuming=token is not None)
+    if reason is not None:
+        # Shed before any session state is created
+        await _reject_connection(websocket, codec, reason)
+        return
+    
+    session, resumed = await session_service.open(token)
+    client_id = session.client_id
+    print(f"WS {'resumed' if resumed else 'connected'}: {client_id}")
+    
+    inbox: asyncio.Queue = asyncio.Queue()
+    pending: Deque[Dict[str, Any]] = deque()
+    running = session.requests
+    ws_config = get_config()["websocket"]
+    limit = max(1, ws_config["max_concurrent_requests"])
+    reader = asyncio.create_task(_receive_frames(websocket, inbox, ws_config["max_frame_bytes"]))
+    
+    # Frames go out through a bounded queue so a slow client cannot stall handlers
+    outbound = OutboundQueue(websocket, client_id, codec=codec)
+    outbound.start()
+    uploads = UploadManager(client_id)
+    state = None
     
     try:
-        # Send client ID to the client
-        await websocket.send_json({'role': 'system', 'content': client_id, 'type': 'client_id'})
+        # Send client ID and resume token to the client
+        await outbound.send_json({
+            'role': 'system',
+            'content': client_id,
+            'type': 'client_id',
+            'session_token': session.token,
+            'resumed': resumed
+        })
+        
+        # Heartbeats, idle reaping and session retention are handled by the session service;
+        # a resumed session replays the frames the client missed
+        state, _ = await session_service.connect(session, outbound, inbox, last_seq if resumed else None)
+        state.active_requests = len(running)
         
         while True:
-            # Receive JSON data from the client
-            data = await websocket.receive_json()
-            message_type = data.get('type')
+            # Wait for the next frame from the client or a request to finish
+            getter = asyncio.ensure_future(inbox.get())
+            tasks = {request.task for request in running.values()}
+            done, _ = await asyncio.wait({getter, *tasks}, return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done:
+                getter.cancel()
             
-            # Route the message to the appropriate handler based on type
-            if message_type == 'text':
-                await text_handler.handle_text_message(websocket, client_id, data)
-                
-            elif message_type == 'image':
-                await image_handler.handle_image_message(websocket, client_id, data)
-                
-            elif message_type == 'file':
-                await file_handler.handle_file_message(websocket, client_id, data)
-                
-            elif message_type == 'generate_image':
-                await image_handler.handle_image_generation(websocket, client_id, data)
-                
-            else:
-                # Unknown message type
-                await websocket.send_json({
+            for request_id, request in list(running.items()):
+                # pop: a connection being taken over may share the session's requests briefly
+                if request.task.done() and running.pop(request_id, None) is not None:
+                    await _finish_request(session, request_id, request.task)
+            
+            if getter in done and isinstance(getter.result(), InvalidFrame):
+                state.touch()
+                await outbound.send_json({
                     'role': 'system',
-                    'content': f"Unknown message type: {message_type}",
+                    'content': f"Invalid frame: {str(getter.result())}",
                     'type': 'error'
                 })
+            
+            elif getter in done:
+                data = _check_frame(getter.result())
+                message_type = data.get('type')
+                
+                if message_type == 'pong':
+                    # Reply to the server heartbeat
+                    state.pong()
+                elif message_type == 'ping':
+                    # Client-side heartbeat
+                    state.touch()
+                    await outbound.send_json({'role': 'system', 'type': 'pong', 'ts': data.get('ts')})
+                else:
+                    state.touch(activity=True)
+                    if message_type == 'upload_start' and await _shed_upload(outbound, data):
+                        data = None
+                    elif message_type in UPLOAD_MESSAGE_TYPES:
+                        # Start, chunk and abort are handled inline; a commit becomes a request
+                        data = await uploads.handle_frame(outbound, data)
+                    if data is not None:
+                        await _handle_frame(session, data, pending)
+            
+            _start_requests(session, pending, limit)
+            state.active_requests = len(running) + len(pending)
     
     except WebSocketDisconnect:
         # Handle client disconnection
         print(f"WS disconnected: {client_id}")
-        if client_id in active_connections:
-            del active_connections[client_id]
     
     except Exception as e:
         # Handle other exceptions
         print(f"WS error for {client_id}: {str(e)}")
         try:
-            await websocket.send_json({
+            await outbound.send_json({
                 'role': 'system',
                 'content': f"Error: {str(e)}",
                 'type': 'error'
             })
         except:
             pass
+    
+    finally:
+        # Running requests stay with the session until it is resumed or released
+        if state is not None:
+            await session_service.disconnect(state)
+        reader.cancel()
+        for data in pending:
+            _release_upload(data)
+        uploads.close()
+        await outbound.close(get_config()["outbound"]["drain_timeout"])
         
-        # Clean up connection if still active
-        if client_id in active_connections:
-            del active_connections[client_id]
+        if state is not None and state.close_code is not None:
+            # Closed by the server: half-open, idle or resumed elsewhere
+            try:
+                await asyncio.wait_for(websocket.close(code=state.close_code), 5)
+            except Exception:
+                pass
@@ -0,0 +1,119 @@
+# app/api/ws/codec.py
+from fastapi import WebSocket, WebSocketDisconnect
+from typing import Dict, Any, Optional, Tuple
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+class InvalidFrame(ValueError):
+    """An inbound frame that was too large or could not be decoded."""
+
+class JsonCodec:
+    """JSON text frames, encoded with orjson when it is installed."""
+
+    name = "json"
+    subprotocol = "neonchat.json"
+
+    def encode(self, data: Dict[str, Any]) -> str:
+        if orjson is not None:
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+    async def send(self, websocket: WebSocket, data: Dict[str, Any]) -> None:
+        await websocket.send_text(self.encode(data))
+
+class MsgpackCodec:
+    """MessagePack binary frames."""
+
+    name = "msgpack"
+    subprotocol = "neonchat.msgpack"
+
+    def encode(self, data: Dict[str, Any]) -> bytes:
+        return msgpack.packb(data, use_bin_type=True)
+
+    async def send(self, websocket: WebSocket, data: Dict[str, Any]) -> None:
+        await websocket.send_bytes(self.encode(data))
+
+CODECS = {codec.name: codec for codec in (JsonCodec(), MsgpackCodec())}
+SUBPROTOCOLS = {codec.subprotocol: codec for codec in CODECS.values()}
+
+def negotiate_codec(websocket: WebSocket) -> Tuple[Any, Optional[str]]:
+    """
+    Pick the codec for a connection during the handshake.
+
+    Clients ask for a codec with the Sec-WebSocket-Protocol header
+    (neonchat.msgpack / neonchat.json) or a ?codec= query parameter.
+    Anything else, or msgpack without the msgpack package, gets JSON.
+
+    Args:
+        websocket: The WebSocket connection, not yet accepted
+
+    Returns:
+        Tuple of (codec, subprotocol to accept or None)
+    """
+    subprotocol = None
+    codec = None
+    for offered in websocket.scope.get("subprotocols") or []:
+        if offered in SUBPROTOCOLS:
+            codec, subprotocol = SUBPROTOCOLS[offered], offered
+            break
+    if codec is None:
+        codec = CODECS.get(websocket.query_params.get("codec", "json").lower(), CODECS["json"])
+
+    if codec.name == "msgpack" and msgpack is None:
+        print("WARNING: msgpack module not found. Falling back to JSON WebSocket frames.")
+        codec = CODECS["json"]
+        subprotocol = codec.subprotocol if subprotocol else None
+    return codec, subprotocol
+
+def decode_message(message: Dict[str, Any], max_bytes: int) -> Dict[str, Any]:
+    """
+    Decode a raw ASGI WebSocket message into a frame.
+
+    Text frames are JSON and binary frames are MessagePack, whichever codec
+    the connection negotiated for outbound frames. The size limit is checked
+    before anything is parsed (characters for text frames, bytes otherwise).
+
+    Args:
+        message: Message from websocket.receive()
+        max_bytes: Largest frame accepted
+
+    Returns:
+        The decoded frame
+
+    Raises:
+        WebSocketDisconnect: If the message is a disconnect
+        InvalidFrame: If the frame is too large or malformed
+    """
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+
+    text = message.get("text")
+    raw = message.get("bytes") if text is None else None
+    size = len(text) if text is not None else len(raw or b"")
+    if size > max_bytes:
+        raise InvalidFrame(f"Frame of {size} bytes exceeds the {max_bytes} byte limit")
+
+    try:
+        if text is not None:
+            frame = orjson.loads(text) if orjson is not None else json.loads(text)
+        elif msgpack is not None:
+            frame = msgpack.unpackb(raw, raw=False)
+        else:
+            raise InvalidFrame("Binary frames need the msgpack package")
+    except InvalidFrame:
+        raise
+    except Exception as e:
+        raise InvalidFrame(f"Malformed frame: {str(e)}")
+
+    if not isinstance(frame, dict):
+        raise InvalidFrame("Frames must be objects")
+    return frame
@@ -4,6 +4,8 @@ from typing import Dict, Any
 
 from ...services.message_service import message_service
 from ...services.api_service import api_service
+from ...services.context_service import context_service
+from ...services.attachment_store import attachment_store
 from ...utils.file_utils import process_file_content
 
 async def handle_file_message(websocket: WebSocket, client_id: str, data: Dict[str, Any]):
@@ -13,8 +15,15 @@ async def handle_file_message(websocket: WebSocket, client_id: str, data: Dict[s
     Args:
         websocket: The WebSocket connection
         client_id: The client's unique identifier
-        data: The message data containing the file content
+        data: The message data containing the file content, either as a
+            base64 data URL or, for chunked uploads, an UploadedFile in 'upload'
     """
+    # Chunked uploads keep only their metadata in the history
+    upload = data.get('upload')
+    # The attachment hash is only ever set here, from the upload or the stored attachment:
+    # a hash sent by the client could name another user's attachment
+    data = {key: value for key, value in data.items() if key != 'sha256'}
+    
     # Create user message with file
     user_message = {
         'role': 'user',
@@ -26,22 +35,41 @@ async def handle_file_message(websocket: WebSocket, client_id: str, data: Dict[s
         'timestamp': data.get('timestamp')
     }
     
-    # Add caption if provided
-    if 'caption' in data:
-        user_message['caption'] = data['caption']
-    
-    # Add message to history
-    message_service.add_message(client_id, user_message)
-    
-    # Get message history
-    message_history = message_service.get_message_history(client_id)
-    
-    # Process with Claude API
-    response = await api_service.execute_claude_call(message_history[:-1], data)
-    
-    # Add assistant message to history
-    if response.get("type") != "error":
-        message_service.add_message(client_id, response)
+    try:
+        # The file goes to the attachment store; the history keeps its hash, not a data URL
+        attachment = attachment_store.put_request(data)
+        if attachment is not None:
+            data['sha256'] = user_message['sha256'] = attachment.sha256
+            if upload is None:
+                user_message['content'] = f"[File: {user_message['filename']}]"
+                user_message['filesize'] = attachment.size
+                data['content'] = ''
+        elif upload is not None:
+            user_message['sha256'] = upload.sha256
+        
+        # Add caption if provided
+        if 'caption' in data:
+            user_message['caption'] = data['caption']
+        
+        # Add message to history
+        message_service.add_message(client_id, user_message)
+        
+        # Get message history
+        message_history = message_service.get_message_history(client_id)
+        
+        # Keep the prompt within the configured token budget
+        history_for_claude, context_stats = context_service.fit_history(message_history[:-1], data)
+        
+        # Process with Claude API
+        response = await api_service.execute_claude_call(history_for_claude, data, client_id)
+        
+        # Add assistant message to history
+        if response.get("type") != "error":
+            message_service.add_message(client_id, response)
+        
+        # Send response to client
+        await websocket.send_json({**response, "context": context_stats})
     
-    # Send response to client
-    await websocket.send_json(response)
\ No newline at end of file
+    finally:
+        if upload is not None:
+            upload.close()
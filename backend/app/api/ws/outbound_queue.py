@@ -0,0 +1,284 @@
+# app/api/ws/outbound_queue.py
+from fastapi import WebSocket, WebSocketDisconnect
+from typing import Dict, Any, Deque, Optional
+from collections import deque
+import asyncio
+import time
+import weakref
+
+from ...utils.config_utils import get_config
+from ...utils.stats_utils import percentiles
+from .codec import JsonCodec
+
+SLOW_CONSUMER_POLICIES = ("coalesce", "drop", "disconnect")
+
+# Close code sent to clients that cannot keep up ("try again later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+class OutboundQueue:
+    """
+    Bounded per-connection send queue drained by a dedicated writer task.
+
+    Handlers call send_json() as they would on the WebSocket, but frames are
+    only queued, so a client on a slow network no longer stalls the producer
+    (and with it the upstream Claude stream). When the queue is full the
+    slow-consumer policy decides what happens to streamed text_chunk frames:
+
+    - coalesce: merge the chunk into the last queued text_chunk frame
+    - drop: discard the chunk; the final frame still carries the full text
+    - disconnect: close the connection with code 1013
+
+    Other frames wait for room in the queue.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        client_id: str,
+        max_frames: Optional[int] = None,
+        policy: Optional[str] = None,
+        codec: Optional[Any] = None
+    ):
+        """
+        Args:
+            websocket: The WebSocket connection
+            client_id: The client's unique identifier
+            max_frames: Queue bound, defaults to WS_OUTBOUND_QUEUE_SIZE
+            policy: Slow-consumer policy, defaults to WS_SLOW_CONSUMER_POLICY
+            codec: Frame codec negotiated for the connection, defaults to JSON
+        """
+        config = get_config()["outbound"]
+        policy = policy or config["policy"]
+        if policy not in SLOW_CONSUMER_POLICIES:
+            print(f"WARNING: Unknown slow-consumer policy '{policy}', using 'coalesce'")
+            policy = "coalesce"
+
+        self.websocket = websocket
+        self.client_id = client_id
+        self.codec = codec or JsonCodec()
+        self.max_frames = max(1, max_frames or config["max_frames"])
+        self.policy = policy
+        self.send_timeout: float = config["send_timeout"]
+
+        self.closed = False
+        self.close_code: Optional[int] = None
+        self.stats = {
+            "frames_queued": 0,
+            "frames_sent": 0,
+            "coalesced": 0,
+            "dropped": 0,
+            "max_depth": 0,
+            "blocked_seconds": 0.0,
+            "send_seconds": 0.0
+        }
+
+        self._frames: Deque[Dict[str, Any]] = deque()
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._writer: Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        return len(self._frames)
+
+    def start(self) -> None:
+        """Start the writer task and register the queue for metrics."""
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._drain())
+            outbound_metrics.register(self)
+
+    async def send_json(self, data: Dict[str, Any]) -> None:
+        """
+        Queue a frame for the client.
+
+        Args:
+            data: The JSON frame
+
+        Raises:
+            WebSocketDisconnect: If the connection is closed or was closed as a slow consumer
+        """
+        if self.closed:
+            raise WebSocketDisconnect(self.close_code or 1006)
+
+        if len(self._frames) >= self.max_frames:
+            if data.get("type") == "text_chunk":
+                if self.policy == "coalesce" and self._merge_into_tail(data):
+                    self.stats["coalesced"] += 1
+                    return
+                if self.policy == "drop":
+                    self.stats["dropped"] += 1
+                    return
+            if self.policy == "disconnect":
+                await self._close_slow_consumer()
+                raise WebSocketDisconnect(SLOW_CONSUMER_CLOSE_CODE)
+            await self._wait_for_space()
+
+        self._frames.append(data)
+        self.stats["frames_queued"] += 1
+        self.stats["max_depth"] = max(self.stats["max_depth"], len(self._frames))
+        self._idle.clear()
+        self._ready.set()
+
+    async def close(self, drain_timeout: float = 0.0) -> None:
+        """
+        Stop the writer task, optionally giving queued frames time to go out.
+
+        Args:
+            drain_timeout: Seconds to wait for the queue to empty first
+        """
+        if drain_timeout > 0 and not self.closed and self._writer is not None:
+            try:
+                await asyncio.wait_for(self._idle.wait(), drain_timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        self.closed = True
+        self._space.set()
+        self._ready.set()
+        if self._writer is not None:
+            self._writer.cancel()
+            await asyncio.gather(self._writer, return_exceptions=True)
+            self._writer = None
+            outbound_metrics.retire(self)
+
+    def _merge_into_tail(self, data: Dict[str, Any]) -> bool:
+        if not self._frames:
+            return False
+        tail = self._frames[-1]
+        if tail.get("type") != "text_chunk":
+            return False
+        # Only merge chunks that belong to the same response; the merged frame
+        # carries the newer sequence number, as it covers both chunks
+        if any(tail.get(key) != value for key, value in data.items() if key not in ("content", "seq")):
+            return False
+        self._frames[-1] = {**tail, **data, "content": tail.get("content", "") + data.get("content", "")}
+        return True
+
+    async def _wait_for_space(self) -> None:
+        started = time.perf_counter()
+        while len(self._frames) >= self.max_frames and not self.closed:
+            self._space.clear()
+            await self._space.wait()
+        self.stats["blocked_seconds"] += time.perf_counter() - started
+        if self.closed:
+            raise WebSocketDisconnect(self.close_code or 1006)
+
+    async def _close_slow_consumer(self) -> None:
+        if self.closed:
+            return
+        print(f"WS slow consumer, closing: {self.client_id} (queue depth {len(self._frames)})")
+        self.closed = True
+        self.close_code = SLOW_CONSUMER_CLOSE_CODE
+        self._frames.clear()
+        self._space.set()
+        self._idle.set()
+        outbound_metrics.totals["slow_consumer_disconnects"] += 1
+        try:
+            await self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
+        except Exception:
+            pass
+
+    async def _drain(self) -> None:
+        try:
+            while not self.closed:
+                if not self._frames:
+                    self._idle.set()
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+
+                frame = self._frames.popleft()
+                self._space.set()
+
+                started = time.perf_counter()
+                try:
+                    await asyncio.wait_for(self.codec.send(self.websocket, frame), self.send_timeout)
+                except asyncio.TimeoutError:
+                    # The client has stopped reading altogether
+                    await self._close_slow_consumer()
+                    return
+                self.stats["send_seconds"] += time.perf_counter() - started
+                self.stats["frames_sent"] += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The connection is gone; the reader task reports the disconnect
+            self.closed = True
+            self._frames.clear()
+            self._space.set()
+            self._idle.set()
+
+class RequestChannel:
+    """
+    View of a session's outbound stream for one request.
+
+    Every frame sent through the channel is tagged with the request id, so a
+    client running several requests on one connection can tell their
+    interleaved responses apart.
+    """
+
+    def __init__(self, outbound: Any, request_id: str):
+        """
+        Args:
+            outbound: The session (or outbound queue) frames are sent through
+            request_id: The request the frames belong to
+        """
+        self.outbound = outbound
+        self.request_id = request_id
+
+    async def send_json(self, data: Dict[str, Any]) -> None:
+        await self.outbound.send_json({**data, "request_id": self.request_id})
+
+class OutboundMetrics:
+    """Gauges and counters across all connection send queues."""
+
+    def __init__(self):
+        self.queues: "weakref.WeakSet[OutboundQueue]" = weakref.WeakSet()
+        self.totals = {
+            "connections_closed": 0,
+            "frames_sent": 0,
+            "coalesced": 0,
+            "dropped": 0,
+            "blocked_seconds": 0.0,
+            "send_seconds": 0.0,
+            "slow_consumer_disconnects": 0
+        }
+
+    def register(self, queue: OutboundQueue) -> None:
+        self.queues.add(queue)
+
+    def retire(self, queue: OutboundQueue) -> None:
+        """Fold a closed queue's counters into the totals."""
+        if queue in self.queues:
+            self.queues.discard(queue)
+            self.totals["connections_closed"] += 1
+            for key in ("frames_sent", "coalesced", "dropped", "blocked_seconds", "send_seconds"):
+                self.totals[key] += queue.stats[key]
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Get queue depth gauges and cumulative counters.
+
+        Returns:
+            Dictionary of outbound queue metrics
+        """
+        queues = list(self.queues)
+        totals = dict(self.totals)
+        for queue in queues:
+            for key in ("frames_sent", "coalesced", "dropped", "blocked_seconds", "send_seconds"):
+                totals[key] += queue.stats[key]
+        totals["blocked_seconds"] = round(totals["blocked_seconds"], 3)
+        totals["send_seconds"] = round(totals["send_seconds"], 3)
+
+        return {
+            "connections": len(queues),
+            "queue_depth": percentiles(queue.depth for queue in queues),
+            "queued_frames": sum(queue.depth for queue in queues),
+            "blocked_producers": sum(1 for queue in queues if queue.depth >= queue.max_frames),
+            **totals
+        }
+
+# Create a global metrics instance
+outbound_metrics = OutboundMetrics()
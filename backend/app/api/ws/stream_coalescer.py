@@ -0,0 +1,104 @@
+# app/api/ws/stream_coalescer.py
+from fastapi import WebSocket
+from typing import Dict, Any, List, Optional
+import asyncio
+import time
+
+from ...utils.config_utils import get_config
+
+class StreamCoalescer:
+    """
+    Batch streamed text deltas into fewer WebSocket frames.
+
+    The first delta after a quiet period is sent straight away, so time to
+    first token is unchanged. Later deltas are held until the flush interval
+    has passed or enough bytes are pending, then sent as one text_chunk frame.
+    A flush interval of 0 sends every delta as its own frame.
+    """
+
+    def __init__(self, websocket: WebSocket, flush_interval_ms: Optional[float] = None):
+        """
+        Args:
+            websocket: The WebSocket connection
+            flush_interval_ms: Client-requested flush interval, clamped to the configured maximum
+        """
+        config = get_config()["streaming"]
+        if flush_interval_ms is None:
+            flush_interval_ms = config["flush_interval_ms"]
+        flush_interval_ms = min(max(float(flush_interval_ms), 0.0), config["max_flush_interval_ms"])
+
+        self.websocket = websocket
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_bytes: int = config["flush_max_bytes"]
+
+        self.frames_sent = 0
+        self._pending: List[str] = []
+        self._pending_bytes = 0
+        self._last_flush = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def add(self, text: str) -> None:
+        """
+        Queue a text delta, flushing if the window or byte threshold is reached.
+
+        Args:
+            text: The delta text
+        """
+        self._pending.append(text)
+        self._pending_bytes += len(text)
+
+        now = time.monotonic()
+        if self._pending_bytes >= self.max_bytes or now - self._last_flush >= self.flush_interval:
+            await self.flush()
+        elif self._timer is None:
+            # Make sure held text goes out even if the upstream pauses. A timer
+            # handle is much cheaper than a task and is usually cancelled by
+            # the next delta before it fires.
+            delay = self.flush_interval - (now - self._last_flush)
+            self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    async def flush(self) -> None:
+        """Send any pending text as a single text_chunk frame."""
+        self._cancel_timer()
+        async with self._lock:
+            if not self._pending:
+                return
+            content = "".join(self._pending)
+            self._pending = []
+            self._pending_bytes = 0
+            self._last_flush = time.monotonic()
+
+            await self.websocket.send_json({
+                "role": "assistant",
+                "content": content,
+                "type": "text_chunk",
+                "done": False
+            })
+            self.frames_sent += 1
+
+    def close(self) -> None:
+        """Stop the flush timer without sending pending text."""
+        self._cancel_timer()
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        if self._pending and self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_idle())
+
+    async def _flush_idle(self) -> None:
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Error flushing streamed text: {str(e)}")
+        finally:
+            self._flush_task = None
+
+    def _cancel_timer(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = None
@@ -1,10 +1,13 @@
 # app/api/ws/text_handler.py
 from fastapi import WebSocket
 from typing import Dict, Any
+import asyncio
 from datetime import datetime
 
 from ...services.message_service import message_service
 from ...services.api_service import api_service
+from ...services.context_service import context_service
+from .stream_coalescer import StreamCoalescer
 
 async def handle_text_message(websocket: WebSocket, client_id: str, data: Dict[str, Any]):
     """
@@ -13,7 +16,8 @@ async def handle_text_message(websocket: WebSocket, client_id: str, data: Dict[s
     Args:
         websocket: The WebSocket connection
         client_id: The client's unique identifier
-        data: The message data
+        data: The message data. May include flush_interval_ms to choose how
+            often streamed text is batched into frames (0 = every delta).
     """
     # Create user message
     user_message_content = data['content']
@@ -32,44 +36,70 @@ async def handle_text_message(websocket: WebSocket, client_id: str, data: Dict[s
     history_for_claude = []
     if len(full_message_history) > 1:
         history_for_claude = full_message_history[:-1]
+    
+    # Keep the prompt within the configured token budget
+    history_for_claude, context_stats = context_service.fit_history(
+        history_for_claude,
+        current_user_input_structured
+    )
 
     # Process with Claude API using streaming
-    full_response_content = ""
-    first_chunk = True
-    
-    async for chunk in api_service.execute_claude_call_streaming(
+    response_parts = []
+    coalescer = StreamCoalescer(websocket, data.get('flush_interval_ms'))
+    stream = api_service.execute_claude_call_streaming(
         history_for_claude, 
-        current_user_input_structured 
-    ):
-        if chunk.get("type") == "text_chunk":
-            # Send streaming chunk to frontend
-            full_response_content += chunk.get("content", "")
-            await websocket.send_json({
-                "role": "assistant",
-                "content": chunk.get("content", ""),
-                "type": "text_chunk",
-                "done": False
-            })
-            
-        elif chunk.get("done") or chunk.get("type") == "error":
-            # Send final message and add to history
-            final_response = {
-                "role": "assistant",
-                "content": full_response_content if chunk.get("type") != "error" else chunk.get("content"),
-                "model": chunk.get("model", "claude-3-7-sonnet-20250219"),
-                "type": "text" if chunk.get("type") != "error" else "error",
-                "done": True
-            }
-            
-            # Add complete response to message history
-            if chunk.get("type") != "error" and full_response_content:
-                message_service.add_message(client_id, {
+        current_user_input_structured,
+        client_id
+    )
+    
+    try:
+        async for chunk in stream:
+            if chunk.get("type") == "text_chunk":
+                # Send streaming chunk to frontend, batched by the coalescer
+                response_parts.append(chunk.get("content", ""))
+                await coalescer.add(chunk.get("content", ""))
+                
+            elif chunk.get("done") or chunk.get("type") == "error":
+                # Flush held text before the final frame
+                await coalescer.flush()
+                full_response_content = "".join(response_parts)
+                
+                # Send final message and add to history
+                final_response = {
                     "role": "assistant",
-                    "content": full_response_content,
+                    "content": full_response_content if chunk.get("type") != "error" else chunk.get("content"),
                     "model": chunk.get("model", "claude-3-7-sonnet-20250219"),
-                    "type": "text"
-                })
-            
-            # Send final completion signal
-            await websocket.send_json(final_response)
-            break
\ No newline at end of file
+                    "type": "text" if chunk.get("type") != "error" else "error",
+                    "done": True,
+                    "context": context_stats
+                }
+                
+                # Add complete response to message history
+                if chunk.get("type") != "error" and full_response_content:
+                    message_service.add_message(client_id, {
+                        "role": "assistant",
+                        "content": full_response_content,
+                        "model": chunk.get("model", "claude-3-7-sonnet-20250219"),
+                        "type": "text"
+                    })
+                
+                # Send final completion signal
+                await websocket.send_json(final_response)
+                break
+    
+    except asyncio.CancelledError:
+        # Stopped by the client or disconnected: keep what was generated so far
+        if response_parts:
+            message_service.add_message(client_id, {
+                "role": "assistant",
+                "content": "".join(response_parts),
+                "model": "claude-3-7-sonnet-20250219",
+                "type": "text",
+                "stopped": True
+            })
+        raise
+    
+    finally:
+        # Closing the stream after the break frees its scheduler slot now, not when it is collected
+        await stream.aclose()
+        coalescer.close()
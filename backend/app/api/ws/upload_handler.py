@@ -0,0 +1,205 @@
+# app/api/ws/upload_handler.py
+from fastapi import WebSocket
+from typing import Dict, Any, Optional, BinaryIO
+import base64
+import binascii
+import hashlib
+import tempfile
+import uuid
+
+from ...utils.config_utils import get_config
+
+# Frames of the chunked upload sub-protocol
+UPLOAD_MESSAGE_TYPES = ('upload_start', 'upload_chunk', 'upload_commit', 'upload_abort')
+
+class UploadError(ValueError):
+    """A chunked upload was rejected."""
+
+class UploadedFile:
+    """
+    A committed upload, held in a spooled temporary file.
+
+    Small uploads stay in memory; larger ones roll over to disk, so the
+    attachment is never held as a base64 string.
+    """
+
+    def __init__(self, upload_id: str, filename: str, filetype: str, file: BinaryIO, size: int, sha256: str):
+        self.upload_id = upload_id
+        self.filename = filename
+        self.filetype = filetype
+        self.file = file
+        self.size = size
+        self.sha256 = sha256
+
+    def read(self) -> bytes:
+        """Read the whole upload from the start."""
+        self.file.seek(0)
+        return self.file.read()
+
+    def close(self) -> None:
+        """Release the temporary file."""
+        self.file.close()
+
+    def describe(self) -> Dict[str, Any]:
+        """Attachment metadata kept in the message history instead of the data."""
+        return {
+            'filename': self.filename,
+            'filetype': self.filetype,
+            'filesize': self.size,
+            'sha256': self.sha256
+        }
+
+class _Upload:
+    """An upload still receiving chunks."""
+
+    def __init__(self, upload_id: str, data: Dict[str, Any], spool_bytes: int, max_bytes: int):
+        try:
+            declared = int(data.get('size') or 0)
+        except (TypeError, ValueError):
+            raise UploadError("Upload size must be a number of bytes")
+        if declared > max_bytes:
+            raise UploadError(f"Upload of {declared} bytes exceeds the {max_bytes} byte limit")
+
+        self.upload_id = upload_id
+        self.kind = data.get('kind') or ('image' if str(data.get('filetype', '')).startswith('image/') else 'file')
+        if self.kind not in ('image', 'file'):
+            raise UploadError(f"Unsupported upload kind: {self.kind}")
+        self.filename = data.get('filename', 'unnamed_file')
+        self.filetype = data.get('filetype', 'application/octet-stream')
+        self.declared_size = declared
+        self.expected_sha256 = data.get('sha256')
+        self.max_bytes = max_bytes
+        self.received = 0
+        self.hasher = hashlib.sha256()
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+
+    def write(self, chunk: bytes, offset: Optional[int]) -> None:
+        if offset is not None and offset != self.received:
+            raise UploadError(f"Chunk at offset {offset}, expected {self.received}")
+        limit = self.declared_size or self.max_bytes
+        if self.received + len(chunk) > limit:
+            raise UploadError(f"Upload exceeds {'its declared size' if self.declared_size else 'the size limit'} of {limit} bytes")
+
+        self.file.write(chunk)
+        self.hasher.update(chunk)
+        self.received += len(chunk)
+
+    def finish(self) -> UploadedFile:
+        if self.declared_size and self.received != self.declared_size:
+            raise UploadError(f"Upload incomplete: {self.received} of {self.declared_size} bytes")
+        digest = self.hasher.hexdigest()
+        if self.expected_sha256 and self.expected_sha256.lower() != digest:
+            raise UploadError("Upload checksum mismatch")
+
+        self.file.seek(0)
+        return UploadedFile(self.upload_id, self.filename, self.filetype, self.file, self.received, digest)
+
+class UploadManager:
+    """
+    Chunked uploads of one WebSocket connection.
+
+    The client sends upload_start with the file's metadata, then any number
+    of upload_chunk frames (raw bytes with the msgpack codec, base64 with
+    JSON), then upload_commit with the message text. Chunks stream into a
+    spooled temporary file with a running SHA-256 and a size cap. The commit
+    becomes a normal file or image request whose 'upload' field holds the
+    UploadedFile.
+    """
+
+    def __init__(self, client_id: str):
+        config = get_config()["uploads"]
+        self.client_id = client_id
+        self.max_bytes: int = config["max_bytes"]
+        self.spool_bytes: int = config["spool_bytes"]
+        self.chunk_bytes: int = config["chunk_bytes"]
+        self.max_concurrent: int = config["max_concurrent"]
+        self.uploads: Dict[str, _Upload] = {}
+
+    async def handle_frame(self, websocket: WebSocket, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Handle an upload sub-protocol frame.
+
+        Args:
+            websocket: The connection (or its outbound queue) for acks and errors
+            data: The frame
+
+        Returns:
+            The request to run for upload_commit, otherwise None
+        """
+        message_type = data.get('type')
+        upload_id = str(data.get('upload_id') or '')
+        try:
+            if message_type == 'upload_start':
+                upload_id = upload_id or uuid.uuid4().hex[:12]
+                self._start(upload_id, data)
+                await websocket.send_json({
+                    'role': 'system',
+                    'type': 'upload_ready',
+                    'upload_id': upload_id,
+                    'chunk_bytes': self.chunk_bytes,
+                    'max_bytes': self.max_bytes
+                })
+            elif message_type == 'upload_chunk':
+                self._get(upload_id).write(self._chunk_bytes(data.get('data')), data.get('offset'))
+            elif message_type == 'upload_commit':
+                upload = self._get(upload_id)
+                uploaded = upload.finish()
+                del self.uploads[upload_id]
+                return self._request(data, upload.kind, uploaded)
+            elif message_type == 'upload_abort':
+                self._discard(upload_id)
+        except UploadError as e:
+            if message_type != 'upload_start':
+                self._discard(upload_id)
+            await websocket.send_json({
+                'role': 'system',
+                'content': f"Upload failed: {str(e)}",
+                'type': 'error',
+                'upload_id': upload_id,
+                **({'request_id': data['request_id']} if data.get('request_id') else {})
+            })
+        return None
+
+    def close(self) -> None:
+        """Discard uploads that were never committed."""
+        for upload_id in list(self.uploads):
+            self._discard(upload_id)
+
+    def _start(self, upload_id: str, data: Dict[str, Any]) -> None:
+        if upload_id in self.uploads:
+            raise UploadError(f"Upload {upload_id} already started")
+        if len(self.uploads) >= self.max_concurrent:
+            raise UploadError(f"At most {self.max_concurrent} uploads can be in progress")
+        self.uploads[upload_id] = _Upload(upload_id, data, self.spool_bytes, self.max_bytes)
+
+    def _get(self, upload_id: str) -> _Upload:
+        upload = self.uploads.get(upload_id)
+        if upload is None:
+            raise UploadError(f"Unknown upload {upload_id}")
+        return upload
+
+    def _discard(self, upload_id: str) -> None:
+        upload = self.uploads.pop(upload_id, None)
+        if upload is not None:
+            upload.file.close()
+
+    def _chunk_bytes(self, chunk: Any) -> bytes:
+        if isinstance(chunk, bytes):
+            return chunk
+        if isinstance(chunk, bytearray):
+            return bytes(chunk)
+        if isinstance(chunk, str):
+            try:
+                return base64.b64decode(chunk, validate=True)
+            except (binascii.Error, ValueError):
+                raise UploadError("Chunk data is not valid base64")
+        raise UploadError("Chunk has no data")
+
+    def _request(self, data: Dict[str, Any], kind: str, uploaded: UploadedFile) -> Dict[str, Any]:
+        return {
+            **{key: value for key, value in data.items() if key not in ('upload_id', 'data')},
+            'type': kind,
+            'content': data.get('content', ''),
+            'upload': uploaded,
+            **uploaded.describe()
+        }
@@ -1,3 +1,4 @@
 # app/models/__init__.py
-from .message import Message, MessageHistory, MessageType
-from .session import Session
\ No newline at end of file
+from .message import Message, MessageHistory, MessageType, MessageRecord, HistoryView
+from .session import Session
+from .usage import TurnUsage
@@ -1,8 +1,12 @@
 # app/models/message.py
 from pydantic import BaseModel, Field
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Iterator, Tuple, Union
+from collections.abc import Mapping, MutableMapping, Sequence
 from datetime import datetime
 from enum import Enum
+from itertools import chain, islice
+import sys
+import time
 
 class MessageType(str, Enum):
     TEXT = "text"
@@ -34,4 +38,217 @@ class Message(BaseModel):
 class MessageHistory(BaseModel):
     """Model representing a conversation history."""
     client_id: str
-    messages: List[Message] = []
\ No newline at end of file
+    messages: List[Message] = []
+
+
+class MessageRecord(MutableMapping):
+    """
+    Compact form of a history message.
+
+    The common fields live in slots, with role, type and model interned so
+    every message shares one copy of each, and the timestamp kept as a Unix
+    time rather than an ISO string. Rare fields (file metadata, captions,
+    flags) go in a dict created only for messages that have them.
+
+    Records behave as the message dicts they replace: reading "timestamp"
+    gives the ISO string, and absent fields are absent keys.
+    """
+
+    __slots__ = ("role", "content", "type", "timestamp", "model", "token_count", "extra")
+
+    # Slot fields in key order; None in a slot means the key is absent
+    FIELDS = ("role", "content", "type", "timestamp", "model", "token_count")
+    INTERNED = frozenset(("role", "type", "model"))
+
+    def __init__(self, role: Optional[str] = None, content: Any = None, type: Optional[str] = None,
+                 timestamp: Optional[float] = None, **fields: Any):
+        self.role = sys.intern(role) if role is not None else None
+        self.content = content
+        self.type = sys.intern(type) if type is not None else None
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self.model = None
+        self.token_count = None
+        self.extra: Optional[Dict[str, Any]] = None
+        for key, value in fields.items():
+            self[key] = value
+
+    @classmethod
+    def from_dict(cls, message: Mapping) -> "MessageRecord":
+        """
+        Convert a message dict, e.g. one decoded from storage.
+
+        Args:
+            message: The message; a record is returned as is
+
+        Returns:
+            The record
+        """
+        if isinstance(message, MessageRecord):
+            return message
+        record = cls.__new__(cls)
+        record.role = record.content = record.type = record.timestamp = None
+        record.model = record.token_count = record.extra = None
+        for key, value in message.items():
+            record[key] = value
+        if record.timestamp is None:
+            record.timestamp = time.time()
+        return record
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Get the message as a plain dict, as it is serialized."""
+        return {key: self[key] for key in self}
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            if value is None:
+                return default
+            return datetime.fromtimestamp(value).isoformat() if key == "timestamp" else value
+        return default if self.extra is None else self.extra.get(key, default)
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            if value is None:
+                raise KeyError(key)
+            return datetime.fromtimestamp(value).isoformat() if key == "timestamp" else value
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key in self.FIELDS:
+            if key == "timestamp":
+                value = _to_unix_time(value)
+            elif key in self.INTERNED and isinstance(value, str):
+                value = sys.intern(value)
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if key in self.FIELDS:
+            if getattr(self, key) is None:
+                raise KeyError(key)
+            setattr(self, key, None)
+        elif self.extra is None:
+            raise KeyError(key)
+        else:
+            del self.extra[key]
+
+    def __contains__(self, key: object) -> bool:
+        if key in self.FIELDS:
+            return getattr(self, key) is not None
+        return self.extra is not None and key in self.extra
+
+    def __iter__(self) -> Iterator[str]:
+        for key in self.FIELDS:
+            if getattr(self, key) is not None:
+                yield key
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self) -> int:
+        return sum(getattr(self, key) is not None for key in self.FIELDS) + len(self.extra or ())
+
+    def __repr__(self) -> str:
+        return f"MessageRecord({self.to_dict()!r})"
+
+def _to_unix_time(value: Any) -> Optional[float]:
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, datetime):
+        return value.timestamp()
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        return time.time()
+
+class HistoryView(Sequence):
+    """
+    Read-only view of a range of a history list, without copying it.
+
+    Slicing a view gives another view, so `history[:-1]` costs nothing
+    however long the history. The range is fixed when the view is made:
+    messages appended to the history later are not part of it. The list
+    must only ever be appended to while views of it exist. A view can
+    carry head messages that are not in the list, such as the note that
+    stands in for trimmed turns; they come before the range.
+    """
+
+    __slots__ = ("_messages", "_start", "_stop", "_head")
+
+    def __init__(self, messages: List[Any], start: int = 0, stop: Optional[int] = None, head: Tuple[Any, ...] = ()):
+        self._messages = messages
+        self._start = start
+        self._stop = len(messages) if stop is None else stop
+        self._head = head
+
+    @property
+    def head(self) -> Tuple[Any, ...]:
+        """Messages placed before the viewed range."""
+        return self._head
+
+    def with_head(self, *messages: Any) -> "HistoryView":
+        """
+        View the same range with messages placed before it.
+
+        Args:
+            *messages: The head messages
+
+        Returns:
+            A new view
+        """
+        return HistoryView(self._messages, self._start, self._stop, messages)
+
+    def __len__(self) -> int:
+        return len(self._head) + self._stop - self._start
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        if self._head:
+            return list(self)[index]
+        positions = range(self._start, self._stop)[index]
+        if isinstance(index, int):
+            return self._messages[positions]
+        if positions.step == 1:
+            return HistoryView(self._messages, positions.start, positions.stop)
+        return [self._messages[position] for position in positions]
+
+    def __iter__(self) -> Iterator[Any]:
+        return chain(self._head, islice(self._messages, self._start, self._stop))
+
+    def range_of(self, messages: List[Any]) -> Optional[Tuple[int, int]]:
+        """
+        Check whether this view is a range of a given history list.
+
+        Args:
+            messages: The history list
+
+        Returns:
+            (start, stop) of the viewed range in `messages`, head messages
+            aside, or None if the view is of another list
+        """
+        if self._messages is messages:
+            return self._start, self._stop
+        return None
+
+    def __repr__(self) -> str:
+        return f"HistoryView({list(self)!r})"
+
+def json_default(value: Any) -> Any:
+    """
+    Serialize history types for json/orjson `default=`; anything else becomes a string.
+
+    Args:
+        value: An object the encoder does not know
+
+    Returns:
+        A JSON-compatible value
+    """
+    if isinstance(value, MessageRecord):
+        return value.to_dict()
+    if isinstance(value, HistoryView):
+        return list(value)
+    return str(value)
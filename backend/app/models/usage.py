@@ -0,0 +1,18 @@
+# app/models/usage.py
+from pydantic import BaseModel
+from typing import Optional
+
+class TurnUsage(BaseModel):
+    """Token usage and latency of a single chat turn against the LLM."""
+    client_id: str
+    model: str
+    status: str  # "completed", "error" or "cancelled"
+    started_at: float  # Unix timestamp
+    ttft_ms: Optional[float] = None
+    total_ms: float
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_input_tokens: int = 0
+    cache_creation_input_tokens: int = 0
+    tokens_per_second: Optional[float] = None
+    stop_reason: Optional[str] = None
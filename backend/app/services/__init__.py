@@ -1,3 +1,10 @@
 # app/services/__init__.py
 from .message_service import message_service
-from .api_service import api_service
\ No newline at end of file
+from .api_service import api_service
+from .context_service import context_service
+from .session_service import session_service
+from .state_backend import state_backend
+from .admission_service import admission_controller
+from .drain_service import drain_service
+from .transcript_service import transcript_persister
+from .attachment_store import attachment_store
\ No newline at end of file
@@ -0,0 +1,202 @@
+# app/services/admission_service.py
+from typing import Dict, Any, Optional
+import asyncio
+import random
+import time
+
+from .scheduler_service import llm_scheduler
+from .session_service import session_service
+from ..utils.config_utils import get_config
+
+# Close code telling a rejected client to try again later (RFC 6455 "Try Again Later")
+BUSY_CLOSE_CODE = 1013
+
+# How often the event loop lag is sampled, in seconds
+LAG_SAMPLE_INTERVAL = 0.1
+
+class AdmissionController:
+    """
+    Admission control for WebSocket connections and chat turns.
+
+    Work is admitted only while the worker is below its limits: open
+    connections, turns in flight, callers queued for an upstream slot and
+    event loop lag. Anything over a limit is rejected at once with a "busy"
+    frame carrying a retry delay, so overload sheds excess work instead of
+    slowing every user down.
+    """
+
+    def __init__(self):
+        config = get_config()["admission"]
+        self.enabled: bool = config["enabled"]
+        self.max_connections: int = config["max_connections"]
+        self.max_turns: int = config["max_turns"]
+        self.max_queue_depth: int = config["max_queue_depth"]
+        self.max_pending: int = config["max_pending"]
+        self.max_loop_lag: float = config["max_loop_lag_ms"] / 1000
+        self.retry_after: float = config["retry_after"]
+
+        # Set while the worker drains for a restart: everything new is turned away
+        self.draining = False
+        self.turns_in_flight = 0
+        # Recent loop lag in seconds: follows spikes at once and decays while the loop is on time
+        self.loop_lag = 0.0
+        self.admitted: Dict[str, int] = {"connections": 0, "turns": 0, "uploads": 0}
+        self.shed: Dict[str, int] = {"connections": 0, "turns": 0, "uploads": 0}
+        self.shed_reasons: Dict[str, int] = {}
+        self._monitor: Optional[asyncio.Task] = None
+
+    def startup(self) -> None:
+        """Start sampling event loop lag."""
+        if self._monitor is None and self.enabled and self.max_loop_lag > 0:
+            self._monitor = asyncio.create_task(self._monitor_loop())
+
+    async def shutdown(self) -> None:
+        """Stop sampling event loop lag."""
+        if self._monitor is not None:
+            self._monitor.cancel()
+            await asyncio.gather(self._monitor, return_exceptions=True)
+            self._monitor = None
+
+    def check_connection(self, resuming: bool) -> Optional[str]:
+        """
+        Decide whether to accept a new WebSocket connection.
+
+        A client resuming a session brings no new work, so it is only held
+        to the connection limit.
+
+        Args:
+            resuming: The client presented a session token
+
+        Returns:
+            The reason for rejecting it, or None to accept it
+        """
+        reason = "draining" if self.draining else None
+        if self.enabled and reason is None:
+            if self.max_connections and len(session_service.connections) >= self.max_connections:
+                reason = "connections"
+            elif not resuming:
+                reason = self._overload()
+        return self._count("connections", reason)
+
+    def check_turn(self, pending: int) -> Optional[str]:
+        """
+        Decide whether to accept a chat turn from a request message.
+
+        Args:
+            pending: Requests already waiting on the client's connection
+
+        Returns:
+            The reason for rejecting it, or None to accept it
+        """
+        reason = "draining" if self.draining else None
+        if self.enabled and reason is None:
+            if self.max_pending and pending >= self.max_pending:
+                reason = "pending"
+            elif self.max_turns and self.turns_in_flight >= self.max_turns:
+                reason = "turns"
+            else:
+                reason = self._overload()
+        return self._count("turns", reason)
+
+    def check_upload(self) -> Optional[str]:
+        """
+        Decide whether to accept the start of an upload that will become a turn.
+
+        Returns:
+            The reason for rejecting it, or None to accept it
+        """
+        reason = "draining" if self.draining else None
+        if self.enabled and reason is None:
+            if self.max_turns and self.turns_in_flight >= self.max_turns:
+                reason = "turns"
+            else:
+                reason = self._overload()
+        return self._count("uploads", reason)
+
+    def track_turn(self, task: asyncio.Future) -> None:
+        """
+        Count a started turn as in flight until its task finishes.
+
+        Args:
+            task: The handler task running the turn
+        """
+        self.turns_in_flight += 1
+        task.add_done_callback(self._turn_done)
+
+    def busy_frame(self, reason: str, **fields: Any) -> Dict[str, Any]:
+        """
+        Build the frame telling a client its work was rejected.
+
+        The retry delay is jittered so rejected clients do not all come back
+        at the same moment.
+
+        Args:
+            reason: Which limit was reached
+            **fields: Extra fields, e.g. the request_id or upload_id
+
+        Returns:
+            The busy frame
+        """
+        retry_after = round(self.retry_after * random.uniform(1.0, 2.0), 1)
+        return {
+            'role': 'system',
+            'type': 'busy',
+            'content': f"The server is busy, please retry in {retry_after:g} seconds",
+            'reason': reason,
+            'retry_after': retry_after,
+            **fields
+        }
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Get admission limits, current load and shed counts.
+
+        Returns:
+            Dictionary of limits, gauges and cumulative counters
+        """
+        return {
+            "enabled": self.enabled,
+            "draining": self.draining,
+            "limits": {
+                "max_connections": self.max_connections,
+                "max_turns": self.max_turns,
+                "max_queue_depth": self.max_queue_depth,
+                "max_pending": self.max_pending,
+                "max_loop_lag_ms": self.max_loop_lag * 1000
+            },
+            "connections": len(session_service.connections),
+            "turns_in_flight": self.turns_in_flight,
+            "queue_depth": llm_scheduler.queue_depth,
+            "loop_lag_ms": round(self.loop_lag * 1000, 2),
+            "admitted": dict(self.admitted),
+            "shed": dict(self.shed),
+            "shed_reasons": dict(self.shed_reasons)
+        }
+
+    def _overload(self) -> Optional[str]:
+        if self.max_queue_depth and llm_scheduler.queue_depth >= self.max_queue_depth:
+            return "queue_depth"
+        if self.max_loop_lag and self.loop_lag >= self.max_loop_lag:
+            return "loop_lag"
+        return None
+
+    def _count(self, kind: str, reason: Optional[str]) -> Optional[str]:
+        if reason is None:
+            self.admitted[kind] += 1
+        else:
+            self.shed[kind] += 1
+            self.shed_reasons[reason] = self.shed_reasons.get(reason, 0) + 1
+        return reason
+
+    def _turn_done(self, task: asyncio.Future) -> None:
+        self.turns_in_flight -= 1
+
+    async def _monitor_loop(self) -> None:
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(LAG_SAMPLE_INTERVAL)
+            lag = max(0.0, time.monotonic() - started - LAG_SAMPLE_INTERVAL)
+            self.loop_lag = max(lag, self.loop_lag * 0.8)
+
+# Create a global controller instance
+admission_controller = AdmissionController()
@@ -1,20 +1,230 @@
 # app/services/api_service.py
-from typing import Dict, List, Any, Optional, Union, AsyncIterator
-import json
+from typing import Dict, Any, Optional, Union, AsyncIterator, Mapping, Sequence
+from contextlib import asynccontextmanager
+import asyncio
+import base64
+import time
 import httpx
-from ..utils.config_utils import get_api_key
-from ..utils.file_utils import process_file_content
+from ..utils.config_utils import get_api_key, get_config
+from ..utils.file_utils import process_file_content, process_file_upload
+from ..utils.sse_utils import SSEDecoder
+from .scheduler_service import llm_scheduler, RETRYABLE_STATUS_CODES
+from .context_service import context_service
+from .message_service import message_service
+from .attachment_store import attachment_store
+from .usage_service import usage_service
+
+# Prompt-cache marker for the Anthropic Messages API
+EPHEMERAL_CACHE_CONTROL = {"type": "ephemeral"}
+
+async def _with_end_marker(chunks: AsyncIterator[bytes]) -> AsyncIterator[Optional[bytes]]:
+    """Pass body chunks through, then None once the body has ended."""
+    async for chunk in chunks:
+        yield chunk
+    yield None
 
 class ApiService:
     """Service for handling API calls to Claude models."""
     
     def __init__(self):
         self.anthropic_api_key = get_api_key("anthropic")
+        config = get_config()
+        self.base_url = config["anthropic"]["base_url"]
+        self.http_config = config["http_client"]
+        
+        # Shared connection pool, owned by the app lifecycle (see startup/shutdown)
+        self.client: Optional[httpx.AsyncClient] = None
+        
+        # Prompt caching of the stable conversation prefix
+        self.prompt_cache_enabled = config["prompt_cache"]["enabled"]
+        self.cache_stats: Dict[str, Dict[str, int]] = {}
+        
+        # Completed and cancelled stream counters
+        self.stream_stats: Dict[str, int] = {
+            "completed_streams": 0,
+            "completed_output_tokens": 0,
+            "cancelled_streams": 0,
+            "connections_released": 0,
+            "output_tokens_saved": 0
+        }
+    
+    def _build_client(self) -> httpx.AsyncClient:
+        """
+        Build an AsyncClient configured from the http_client settings.
+        
+        Returns:
+            A new, unopened httpx.AsyncClient
+        """
+        http2 = self.http_config["http2"]
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                print("WARNING: h2 package not installed. Falling back to HTTP/1.1 for the Claude API.")
+                http2 = False
+        
+        limits = httpx.Limits(
+            max_connections=self.http_config["max_connections"],
+            max_keepalive_connections=self.http_config["max_keepalive_connections"],
+            keepalive_expiry=self.http_config["keepalive_expiry"]
+        )
+        timeout = httpx.Timeout(
+            self.http_config["read_timeout"],
+            connect=self.http_config["connect_timeout"]
+        )
+        return httpx.AsyncClient(base_url=self.base_url, http2=http2, limits=limits, timeout=timeout)
+    
+    async def startup(self) -> None:
+        """
+        Open the shared HTTP client and warm up a connection to the API.
+        """
+        if self.client is None:
+            self.client = self._build_client()
+        
+        if self.http_config["warmup"]:
+            await self.warm_up()
+    
+    async def warm_up(self) -> None:
+        """
+        Establish a pooled connection (DNS, TCP, TLS) ahead of the first chat turn.
+        """
+        if self.client is None:
+            return
+        
+        try:
+            # Any response is fine, we only want the connection in the pool
+            await self.client.head("/")
+        except httpx.HTTPError as e:
+            print(f"WARNING: Claude API connection warm-up failed: {str(e)}")
+    
+    async def shutdown(self) -> None:
+        """
+        Close the shared HTTP client and release pooled connections.
+        """
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+    
+    @asynccontextmanager
+    async def _client_session(self) -> AsyncIterator[httpx.AsyncClient]:
+        """
+        Yield the shared client, or a short-lived one if the service was not started.
+        """
+        if self.client is not None:
+            yield self.client
+        else:
+            async with self._build_client() as client:
+                yield client
+    
+    def _with_cache_control(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        content = message["content"]
+        if isinstance(content, list):
+            blocks = [dict(block) for block in content]
+        else:
+            blocks = [{"type": "text", "text": content}]
+        
+        if blocks:
+            blocks[-1]["cache_control"] = EPHEMERAL_CACHE_CONTROL
+        return {**message, "content": blocks}
+    
+    def _mark_cache_breakpoints(self, payload: Dict[str, Any]) -> None:
+        """
+        Mark the stable prefix of a request with prompt-cache breakpoints.
+        
+        Everything before the new user message is unchanged since the last
+        turn. The breakpoint goes on the end of that prefix, so the next turn
+        can read it. A second breakpoint goes where the previous turn's prefix
+        ended, so this turn reads what the last one wrote.
+        
+        Args:
+            payload: The Messages API payload, updated in place
+        """
+        self._mark_system_prompt(payload)
+        
+        messages = payload["messages"]
+        prefix_end = len(messages) - 2
+        for index in (prefix_end, prefix_end - 2):
+            if index >= 0 and messages[index].get("content"):
+                messages[index] = self._with_cache_control(messages[index])
+    
+    def _mark_system_prompt(self, payload: Dict[str, Any]) -> None:
+        """Mark the end of the system prompt, if any, with a prompt-cache breakpoint."""
+        if payload.get("system"):
+            payload["system"] = [{
+                "type": "text",
+                "text": payload["system"],
+                "cache_control": EPHEMERAL_CACHE_CONTROL
+            }]
+    
+    def _record_cache_usage(self, client_id: Optional[str], usage: Dict[str, Any]) -> None:
+        stats = self.cache_stats.setdefault(client_id or "anonymous", {
+            "requests": 0,
+            "input_tokens": 0,
+            "cache_read_input_tokens": 0,
+            "cache_creation_input_tokens": 0
+        })
+        stats["requests"] += 1
+        stats["input_tokens"] += usage.get("input_tokens") or 0
+        stats["cache_read_input_tokens"] += usage.get("cache_read_input_tokens") or 0
+        stats["cache_creation_input_tokens"] += usage.get("cache_creation_input_tokens") or 0
+    
+    def get_cache_report(self) -> Dict[str, Any]:
+        """
+        Report prompt-cache usage and hit ratio per client.
+        
+        The hit ratio is the share of prompt tokens that were read from cache.
+        
+        Returns:
+            Dictionary with per-client and total cache statistics
+        """
+        def with_ratio(stats: Dict[str, int]) -> Dict[str, Any]:
+            prompt_tokens = (stats["input_tokens"] + stats["cache_read_input_tokens"]
+                             + stats["cache_creation_input_tokens"])
+            hit_ratio = stats["cache_read_input_tokens"] / prompt_tokens if prompt_tokens else 0.0
+            return {**stats, "hit_ratio": round(hit_ratio, 4)}
+        
+        totals = {"requests": 0, "input_tokens": 0, "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0}
+        for stats in self.cache_stats.values():
+            for key in totals:
+                totals[key] += stats[key]
+        
+        return {
+            "enabled": self.prompt_cache_enabled,
+            "clients": {client_id: with_ratio(stats) for client_id, stats in self.cache_stats.items()},
+            "total": with_ratio(totals)
+        }
+    
+    def _record_stream_cancelled(self, streamed_chars: int) -> None:
+        stats = self.stream_stats
+        stats["cancelled_streams"] += 1
+        # Closing the response mid-body drops the connection (or resets the HTTP/2 stream)
+        stats["connections_released"] += 1
+        
+        # Estimate against the average length of completed replies
+        if stats["completed_streams"]:
+            expected_tokens = stats["completed_output_tokens"] / stats["completed_streams"]
+            streamed_tokens = streamed_chars / context_service.chars_per_token
+            stats["output_tokens_saved"] += max(int(expected_tokens - streamed_tokens), 0)
+    
+    def get_stream_metrics(self) -> Dict[str, Any]:
+        """
+        Get counters for completed and cancelled Claude streams.
+        
+        output_tokens_saved is an estimate: the average output of completed
+        replies minus what a cancelled stream had produced so far.
+        
+        Returns:
+            Dictionary of stream counters
+        """
+        return dict(self.stream_stats)
     
     async def execute_claude_call_streaming(
         self, 
-        message_history: List[Dict[str, Any]], 
-        user_input: Union[str, Dict[str, Any]]
+        message_history: Sequence[Mapping[str, Any]], 
+        user_input: Union[str, Mapping[str, Any]],
+        client_id: Optional[str] = None,
+        temperature: float = 0.7,
+        max_tokens: int = 4096
     ) -> AsyncIterator[Dict[str, Any]]:
         """
         Execute a streaming API call to Anthropic Claude 3.7 Sonnet.
@@ -22,6 +232,9 @@ class ApiService:
         Args:
             message_history: Previous conversation history
             user_input: User input (text or structured data)
+            client_id: The client's unique identifier, used for usage stats
+            temperature: Sampling temperature
+            max_tokens: Maximum number of tokens to generate
             
         Yields:
             Streaming response chunks
@@ -36,25 +249,51 @@ class ApiService:
             return
         
         try:
+            # Turn latency is measured from here, including any scheduler wait
+            started = time.perf_counter()
+            
             # Use Claude 3.7 Sonnet model
             model_id = "claude-3-7-sonnet-20250219"
 
-            # Prepare messages in Anthropic format
+            # Prepare messages in Anthropic format. A history the message service
+            # holds encoded is spliced into the request body as it is
             messages = []
-            for msg in message_history:
-                if msg.get('role') in ['user', 'assistant'] and 'content' in msg:
-                    messages.append({
-                        "role": msg.get('role'),
-                        "content": msg.get('content')
-                    })
+            system_parts = []
+            encoded_history = message_service.encode_history(
+                client_id, message_history,
+                self._with_cache_control if self.prompt_cache_enabled else None
+            )
+            if encoded_history is not None:
+                # The note standing in for trimmed turns rides ahead of the view
+                system_parts = [msg.get('content') for msg in message_history.head if msg.get('content')]
+            else:
+                for msg in message_history:
+                    if msg.get('role') == 'system' and msg.get('content'):
+                        # Pinned system context goes in the top-level system prompt
+                        system_parts.append(msg.get('content'))
+                    elif msg.get('role') in ['user', 'assistant'] and 'content' in msg:
+                        messages.append({
+                            "role": msg.get('role'),
+                            "content": msg.get('content')
+                        })
             
             # Add current user message
             if isinstance(user_input, str):
                 messages.append({"role": "user", "content": user_input})
-            elif isinstance(user_input, dict):
+            elif isinstance(user_input, Mapping):
+                upload = user_input.get('upload')
+                # Attachments the handler stored are read from the store, memory-mapped
+                sha256 = user_input.get('sha256')
+                stored = bool(sha256) and attachment_store.contains(sha256)
                 if user_input.get('type') == 'file':
-                    # Process file content
-                    success, text = process_file_content(user_input.get('content'), user_input.get('filetype', 'text/plain'))
+                    # Process file content, from the attachment store, a chunked upload or a data URL
+                    if stored:
+                        with attachment_store.open(sha256) as view:
+                            success, text = process_file_content(view, user_input.get('filetype', 'text/plain'))
+                    elif upload is not None:
+                        success, text = process_file_upload(upload.file, upload.filetype)
+                    else:
+                        success, text = process_file_content(user_input.get('content'), user_input.get('filetype', 'text/plain'))
                     if success:
                         file_message = f"File content: {text}"
                         if 'caption' in user_input:
@@ -68,6 +307,27 @@ class ApiService:
                             "done": True
                         }
                         return
+                elif user_input.get('type') == 'image' and (stored or upload is not None):
+                    # Stored and uploaded images are sent as an image block; base64 is only built here
+                    text = user_input.get('content') or "Describe this image."
+                    if user_input.get('caption'):
+                        text = f"{user_input['caption']}\n\n{text}"
+                    if stored:
+                        with attachment_store.open(sha256) as view:
+                            image_data = base64.b64encode(view).decode("ascii")
+                    else:
+                        image_data = base64.b64encode(upload.read()).decode("ascii")
+                    messages.append({"role": "user", "content": [
+                        {
+                            "type": "image",
+                            "source": {
+                                "type": "base64",
+                                "media_type": upload.filetype if upload is not None else user_input.get('filetype'),
+                                "data": image_data
+                            }
+                        },
+                        {"type": "text", "text": text}
+                    ]})
                 else:
                     # Handle other message types
                     content = user_input.get('content', '')
@@ -79,10 +339,22 @@ class ApiService:
             payload = {
                 "model": model_id,
                 "messages": messages,
-                "max_tokens": 4096,
-                "temperature": 0.7,
+                "max_tokens": max_tokens,
+                "temperature": temperature,
                 "stream": True  # Enable streaming
             }
+            if system_parts:
+                payload["system"] = "\n\n".join(system_parts)
+            
+            if encoded_history is not None:
+                # History breakpoints were placed by encode_history
+                if self.prompt_cache_enabled:
+                    self._mark_system_prompt(payload)
+                request = {"content": message_service.splice_request(payload, encoded_history)}
+            else:
+                if self.prompt_cache_enabled:
+                    self._mark_cache_breakpoints(payload)
+                request = {"json": payload}
             
             # Call Anthropic API with streaming
             headers = {
@@ -91,68 +363,43 @@ class ApiService:
                 "content-type": "application/json"
             }
             
-            async with httpx.AsyncClient() as client:
-                async with client.stream(
-                    "POST",
-                    "https://api.anthropic.com/v1/messages",
-                    json=payload,
-                    headers=headers,
-                    timeout=60.0
-                ) as response:
-                    
-                    if response.status_code != 200:
-                        yield {
-                            "role": "assistant", 
-                            "content": f"Sorry, an error occurred with the Claude API: {response.status_code}",
-                            "type": "error",
-                            "done": True
-                        }
-                        return
-                    
-                    # Process streaming response
-                    async for line in response.aiter_lines():
-                        if line.startswith('data: '):
-                            data = line[6:]  # Remove 'data: ' prefix
-                            
-                            if data == '[DONE]':
-                                yield {
-                                    "role": "assistant",
-                                    "content": "",
-                                    "model": model_id,
-                                    "type": "text",
-                                    "done": True
-                                }
-                                return
+            for attempt in range(llm_scheduler.max_retries + 1):
+                retry_delay = None
+                
+                # Wait for a fair share of the global in-flight limit
+                async with llm_scheduler.slot(client_id):
+                    async with self._client_session() as client:
+                        async with client.stream(
+                            "POST",
+                            "/v1/messages",
+                            headers=headers,
+                            **request
+                        ) as response:
                             
-                            try:
-                                chunk = json.loads(data)
+                            if response.status_code != 200:
+                                # Read the error body so the connection can return to the pool
+                                await response.aread()
+                                if response.status_code in RETRYABLE_STATUS_CODES:
+                                    llm_scheduler.record_throttled()
                                 
-                                # Handle different event types
-                                if chunk.get('type') == 'content_block_delta':
-                                    delta = chunk.get('delta', {})
-                                    if delta.get('type') == 'text_delta':
-                                        text = delta.get('text', '')
-                                        if text:
-                                            yield {
-                                                "role": "assistant",
-                                                "content": text,
-                                                "model": model_id,
-                                                "type": "text_chunk",
-                                                "done": False
-                                            }
-                                
-                                elif chunk.get('type') == 'message_stop':
-                                    yield {
-                                        "role": "assistant",
-                                        "content": "",
-                                        "model": model_id,
-                                        "type": "text",
-                                        "done": True
-                                    }
+                                if response.status_code in RETRYABLE_STATUS_CODES and attempt < llm_scheduler.max_retries:
+                                    retry_delay = llm_scheduler.retry_delay(attempt, response.headers.get("retry-after"))
+                                else:
+                                    yield self._error_chunk(response.status_code)
                                     return
-                                    
-                            except json.JSONDecodeError:
-                                continue  # Skip malformed JSON
+                            else:
+                                stream = self._process_stream(response, model_id, client_id, started)
+                                try:
+                                    async for chunk in stream:
+                                        yield chunk
+                                finally:
+                                    # Runs the stream's cancellation accounting if we were closed early
+                                    await stream.aclose()
+                                return
+                
+                # Back off outside the slot so other users can go ahead
+                print(f"WARNING: Claude API throttled, retrying in {retry_delay:.2f}s (attempt {attempt + 1})")
+                await asyncio.sleep(retry_delay)
                 
         except Exception as e:
             print(f"ERROR: Claude streaming API call failed: {str(e)}")
@@ -163,10 +410,145 @@ class ApiService:
                 "done": True
             }
 
+    def _error_chunk(self, status_code: int) -> Dict[str, Any]:
+        if status_code in RETRYABLE_STATUS_CODES:
+            content = "Claude is busy right now. Please try again in a moment."
+        else:
+            content = f"Sorry, an error occurred with the Claude API: {status_code}"
+        
+        return {
+            "role": "assistant",
+            "content": content,
+            "type": "error",
+            "status_code": status_code,
+            "done": True
+        }
+    
+    async def _process_stream(
+        self,
+        response: httpx.Response,
+        model_id: str,
+        client_id: Optional[str],
+        started: float
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Turn a Messages API event stream into response chunks.
+        
+        Token usage and latency of the turn are recorded when the stream
+        completes, fails or is cancelled.
+        
+        Args:
+            response: The streaming HTTP response
+            model_id: The model the request was made with
+            client_id: The client's unique identifier, used for usage stats
+            started: perf_counter() when the call started
+            
+        Yields:
+            Streaming response chunks
+        """
+        decoder = SSEDecoder()
+        usage: Dict[str, Any] = {}
+        stop_reason = None
+        stream_done = False
+        completed = False
+        streamed_chars = 0
+        first_token = None
+        
+        try:
+            async for raw in _with_end_marker(response.aiter_bytes()):
+                # Keep reading to the end of the body after the stop event,
+                # otherwise the pooled connection is discarded instead of reused
+                if stream_done:
+                    continue
+                
+                # At the end of the body, an event without its closing blank line still counts
+                for event in (decoder.feed(raw) if raw is not None else decoder.flush()):
+                    data = event.data
+                    
+                    # Handle different event types
+                    if event.event == 'content_block_delta':
+                        delta = data.get('delta', {})
+                        if delta.get('type') == 'text_delta':
+                            text = delta.get('text', '')
+                            if text:
+                                if first_token is None:
+                                    first_token = time.perf_counter()
+                                streamed_chars += len(text)
+                                yield {
+                                    "role": "assistant",
+                                    "content": text,
+                                    "model": model_id,
+                                    "type": "text_chunk",
+                                    "done": False
+                                }
+                    
+                    elif event.event == 'message_start':
+                        usage.update(data.get('message', {}).get('usage', {}))
+                        self._record_cache_usage(client_id, usage)
+                    
+                    elif event.event == 'message_delta':
+                        stop_reason = data.get('delta', {}).get('stop_reason') or stop_reason
+                        usage.update(data.get('usage') or {})
+                    
+                    elif event.event == 'error':
+                        error = data.get('error', {}) if isinstance(data, dict) else {}
+                        completed = True
+                        usage_service.record_turn(
+                            client_id, model_id, "error", started, first_token,
+                            time.perf_counter(), usage, stop_reason
+                        )
+                        yield {
+                            "role": "assistant",
+                            "content": f"Sorry, an error occurred with the Claude API: {error.get('message', 'stream error')}",
+                            "type": "error",
+                            "error_type": error.get('type'),
+                            "done": True
+                        }
+                        return
+                    
+                    elif event.event in ('message_stop', 'done'):
+                        stream_done = True
+                        break
+                    
+                    # 'ping', 'content_block_start' and 'content_block_stop' carry nothing we need
+            
+            completed = True
+            self.stream_stats["completed_streams"] += 1
+            self.stream_stats["completed_output_tokens"] += usage.get("output_tokens") or 0
+            usage_service.record_turn(
+                client_id, model_id, "completed", started, first_token,
+                time.perf_counter(), usage, stop_reason
+            )
+            yield {
+                "role": "assistant",
+                "content": "",
+                "model": model_id,
+                "type": "text",
+                "stop_reason": stop_reason,
+                "usage": usage,
+                "done": True
+            }
+        
+        except (asyncio.CancelledError, GeneratorExit):
+            # The client stopped or disconnected mid-stream
+            if not completed:
+                self._record_stream_cancelled(streamed_chars)
+                # No final usage event arrives, so estimate what was generated
+                streamed_tokens = int(streamed_chars / context_service.chars_per_token)
+                usage_service.record_turn(
+                    client_id, model_id, "cancelled", started, first_token, time.perf_counter(),
+                    {**usage, "output_tokens": max(usage.get("output_tokens") or 0, streamed_tokens)},
+                    stop_reason
+                )
+            raise
+    
     async def execute_claude_call(
         self, 
-        message_history: List[Dict[str, Any]], 
-        user_input: Union[str, Dict[str, Any]]
+        message_history: Sequence[Mapping[str, Any]], 
+        user_input: Union[str, Mapping[str, Any]],
+        client_id: Optional[str] = None,
+        temperature: float = 0.7,
+        max_tokens: int = 4096
     ) -> Dict[str, Any]:
         """
         Execute a non-streaming API call to Anthropic Claude 3.7 Sonnet.
@@ -174,11 +556,19 @@ class ApiService:
         """
         # Collect all streaming chunks into a single response
         full_content = ""
-        async for chunk in self.execute_claude_call_streaming(message_history, user_input):
-            if chunk.get("type") == "text_chunk":
-                full_content += chunk.get("content", "")
-            elif chunk.get("done"):
-                break
+        stream = self.execute_claude_call_streaming(
+            message_history, user_input, client_id,
+            temperature=temperature, max_tokens=max_tokens
+        )
+        try:
+            async for chunk in stream:
+                if chunk.get("type") == "text_chunk":
+                    full_content += chunk.get("content", "")
+                elif chunk.get("done"):
+                    break
+        finally:
+            # Leaving the generator paused would hold its scheduler slot until it is collected
+            await stream.aclose()
         
         return {
             "role": "assistant",
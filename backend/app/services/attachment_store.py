@@ -0,0 +1,338 @@
+# app/services/attachment_store.py
+from typing import Dict, Any, Optional, BinaryIO, Iterator, Tuple, Union
+from collections import OrderedDict
+from contextlib import contextmanager
+import base64
+import binascii
+import hashlib
+import mmap
+import os
+import tempfile
+import time
+
+from ..utils.config_utils import get_config
+
+class AttachmentRef:
+    """A stored attachment: its content hash, media type and size."""
+
+    __slots__ = ("sha256", "filetype", "size")
+
+    def __init__(self, sha256: str, filetype: str, size: int):
+        self.sha256 = sha256
+        self.filetype = filetype
+        self.size = size
+
+    def describe(self) -> Dict[str, Any]:
+        """Attachment metadata kept in the message history instead of the data."""
+        return {'filetype': self.filetype, 'filesize': self.size, 'sha256': self.sha256}
+
+def parse_data_url(url: Any) -> Optional[Tuple[str, str]]:
+    """
+    Split a base64 data URL into its media type and base64 payload.
+
+    Args:
+        url: A message's content
+
+    Returns:
+        (media type, base64 data), or None if it is not a base64 data URL
+    """
+    if not isinstance(url, str) or not url.startswith('data:'):
+        return None
+    header, separator, data = url.partition(',')
+    if not separator or not header.endswith(';base64'):
+        return None
+    return header[5:-7].split(';')[0] or 'application/octet-stream', data
+
+class AttachmentStore:
+    """
+    Content-addressed store for chat images and files on local disk.
+
+    Each attachment is written once, to a file named by the SHA-256 of its
+    bytes, so the same upload from any client or turn is stored once and
+    history messages only hold the hash. Reads map the file into memory
+    rather than decoding a string again.
+
+    Histories hold references: the message service acquires one for every
+    message that has an attachment and releases it when the history is
+    cleared or dropped. Past ATTACHMENT_MAX_BYTES, attachments nobody
+    references are deleted, least recently used first. Reference counts are
+    per process; with several workers sharing the directory, an attachment
+    used by any of them within ATTACHMENT_EVICT_AFTER seconds is kept.
+    """
+
+    def __init__(self):
+        config = get_config()["attachments"]
+        self.enabled: bool = config["enabled"]
+        self.directory: str = config["dir"]
+        self.max_bytes: int = config["max_bytes"]
+        self.evict_after: float = config["evict_after"]
+
+        # Stored attachments and their sizes, least recently used first
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._refs: Dict[str, int] = {}
+        self.total_bytes = 0
+        self.stats = {"stored": 0, "deduplicated": 0, "bytes_saved": 0, "reads": 0, "misses": 0, "evictions": 0}
+
+    def startup(self) -> None:
+        """Index the attachments already on disk, so they count toward the size limit."""
+        if self.enabled:
+            self._scan()
+
+    def put(self, data: Union[bytes, bytearray, memoryview], filetype: str) -> Optional[AttachmentRef]:
+        """
+        Store an attachment's bytes, unless the same bytes are already stored.
+
+        Args:
+            data: The attachment
+            filetype: Its MIME type
+
+        Returns:
+            A reference to the stored attachment, or None if the store is disabled or the write failed
+        """
+        if not self.enabled:
+            return None
+        sha256 = hashlib.sha256(data).hexdigest()
+        if self._known(sha256):
+            return self._deduplicated(sha256, filetype, len(data))
+        return self._write(sha256, filetype, len(data), lambda f: f.write(data))
+
+    def put_file(self, file: BinaryIO, filetype: str, sha256: str, size: int) -> Optional[AttachmentRef]:
+        """
+        Store an attachment from a file handle whose hash is already known, as for chunked uploads.
+
+        Args:
+            file: Binary file handle holding the attachment
+            filetype: Its MIME type
+            sha256: Hex SHA-256 of the file's bytes
+            size: The file's size in bytes
+
+        Returns:
+            A reference to the stored attachment, or None if the store is disabled or the write failed
+        """
+        if not self.enabled:
+            return None
+        if self._known(sha256):
+            return self._deduplicated(sha256, filetype, size)
+
+        def copy(f: BinaryIO) -> None:
+            file.seek(0)
+            while True:
+                chunk = file.read(1024 * 1024)
+                if not chunk:
+                    break
+                f.write(chunk)
+        return self._write(sha256, filetype, size, copy)
+
+    def put_data_url(self, url: str) -> Optional[AttachmentRef]:
+        """
+        Store the attachment of a base64 data URL.
+
+        Args:
+            url: The data URL
+
+        Returns:
+            A reference to the stored attachment, or None if it is not a valid
+            base64 data URL, the store is disabled or the write failed
+        """
+        parsed = parse_data_url(url) if self.enabled else None
+        if parsed is None:
+            return None
+        filetype, data = parsed
+        try:
+            return self.put(base64.b64decode(data), filetype)
+        except (binascii.Error, ValueError):
+            return None
+
+    def put_request(self, data: Dict[str, Any]) -> Optional[AttachmentRef]:
+        """
+        Store the attachment of an image or file request.
+
+        Args:
+            data: The request, with an UploadedFile in 'upload' or a data URL in 'content'
+
+        Returns:
+            A reference to the stored attachment, or None if it has none the store could keep
+        """
+        upload = data.get('upload')
+        if upload is not None:
+            return self.put_file(upload.file, upload.filetype, upload.sha256, upload.size)
+        return self.put_data_url(data.get('content'))
+
+    @contextmanager
+    def open(self, sha256: str) -> Iterator[Union[mmap.mmap, bytes]]:
+        """
+        Map a stored attachment into memory for reading.
+
+        The map is read-only and file-like (read, seek), and a buffer for
+        base64 and hashing. It is closed when the block exits.
+
+        Args:
+            sha256: The attachment's hash
+
+        Yields:
+            The attachment's bytes
+
+        Raises:
+            KeyError: If the attachment is not stored
+        """
+        try:
+            with open(self._path(sha256), 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        except (OSError, ValueError):
+            self.stats["misses"] += 1
+            raise KeyError(sha256)
+
+        self.stats["reads"] += 1
+        self._touch(sha256, size)
+        try:
+            yield mapped if mapped is not None else b""
+        finally:
+            if mapped is not None:
+                mapped.close()
+
+    def contains(self, sha256: str) -> bool:
+        """Check whether an attachment is stored."""
+        return self.enabled and self._known(sha256)
+
+    def acquire(self, sha256: str) -> None:
+        """
+        Add a reference to an attachment, so it is not evicted.
+
+        Args:
+            sha256: The attachment's hash
+        """
+        if self.enabled:
+            self._refs[sha256] = self._refs.get(sha256, 0) + 1
+
+    def release(self, sha256: str) -> None:
+        """
+        Drop a reference taken with acquire; unreferenced attachments may be evicted.
+
+        Args:
+            sha256: The attachment's hash
+        """
+        refs = self._refs.get(sha256, 0) - 1
+        if refs > 0:
+            self._refs[sha256] = refs
+        elif self._refs.pop(sha256, None) is not None:
+            self._evict()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get the size of the store and its deduplication and eviction counters.
+
+        Returns:
+            Dict of store statistics
+        """
+        return {
+            "enabled": self.enabled,
+            "attachments": len(self._entries),
+            "referenced": len(self._refs),
+            "total_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            **self.stats
+        }
+
+    def _path(self, sha256: str) -> str:
+        if len(sha256) != 64 or not all(c in "0123456789abcdef" for c in sha256):
+            raise ValueError(f"Invalid attachment hash: {sha256}")
+        return os.path.join(self.directory, sha256[:2], sha256)
+
+    def _known(self, sha256: str) -> bool:
+        if sha256 in self._entries:
+            return True
+        # Another worker sharing the directory may have stored it
+        try:
+            size = os.path.getsize(self._path(sha256))
+        except (OSError, ValueError):
+            return False
+        self._add(sha256, size)
+        return True
+
+    def _deduplicated(self, sha256: str, filetype: str, size: int) -> AttachmentRef:
+        self.stats["deduplicated"] += 1
+        self.stats["bytes_saved"] += size
+        self._touch(sha256, size)
+        return AttachmentRef(sha256, filetype, size)
+
+    def _write(self, sha256: str, filetype: str, size: int, write: Any) -> Optional[AttachmentRef]:
+        path = self._path(sha256)
+        temp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written under a temporary name and renamed, so readers never see a partial file
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"WARNING: Could not store attachment {sha256}: {str(e)}")
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+            return None
+
+        self.stats["stored"] += 1
+        self._add(sha256, size)
+        # Not yet referenced by any history, but about to be
+        self._evict(keep=sha256)
+        return AttachmentRef(sha256, filetype, size)
+
+    def _add(self, sha256: str, size: int) -> None:
+        if sha256 not in self._entries:
+            self.total_bytes += size
+        self._entries[sha256] = size
+        self._entries.move_to_end(sha256)
+
+    def _touch(self, sha256: str, size: int) -> None:
+        self._add(sha256, size)
+        try:
+            os.utime(self._path(sha256))
+        except OSError:
+            pass
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        if not self.max_bytes or self.total_bytes <= self.max_bytes:
+            return
+        now = time.time()
+        for sha256 in list(self._entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if sha256 in self._refs or sha256 == keep:
+                continue
+            path = self._path(sha256)
+            try:
+                if now - os.path.getmtime(path) < self.evict_after:
+                    continue
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            self.total_bytes -= self._entries.pop(sha256)
+            self.stats["evictions"] += 1
+
+    def _scan(self) -> None:
+        """Index the attachments already on disk, least recently used first; other files are skipped."""
+        found = []
+        try:
+            for shard in os.scandir(self.directory):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    stat = entry.stat()
+                    if len(entry.name) == 64 and all(c in "0123456789abcdef" for c in entry.name):
+                        found.append((stat.st_mtime, entry.name, stat.st_size))
+                    elif entry.name.startswith(".tmp-") and time.time() - stat.st_mtime > 3600:
+                        # Left behind by a worker that died mid-write
+                        os.remove(entry.path)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            print(f"WARNING: Could not index attachment store {self.directory}: {str(e)}")
+            return
+        for _, sha256, size in sorted(found):
+            self._add(sha256, size)
+
+# Create a global store instance
+attachment_store = AttachmentStore()
@@ -0,0 +1,152 @@
+# app/services/context_service.py
+from typing import Dict, List, Any, Tuple, Union, Mapping, Sequence
+import json
+
+from ..models.message import MessageRecord, HistoryView
+from ..utils.config_utils import get_config
+
+# Fixed per-message cost for role markers and message framing
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Stands in for dropped turns; the same text every turn, so the system prompt stays cacheable
+OMITTED_NOTE = "Earlier messages of this conversation were omitted to fit the context window."
+
+class ContextService:
+    """Service for keeping conversation history within a token budget."""
+
+    def __init__(self):
+        config = get_config()["context"]
+        self.token_budget: int = config["token_budget"]
+        self.chars_per_token: float = config["chars_per_token"]
+        self.trim_block: int = max(1, config["trim_block_messages"])
+
+    def _count_text_tokens(self, message: Union[str, Dict[str, Any]]) -> int:
+        if isinstance(message, str):
+            text = message
+        else:
+            content = message.get('content', '')
+            text = content if isinstance(content, str) else json.dumps(content)
+            if message.get('caption'):
+                text = f"{message['caption']}\n\n{text}"
+
+        return MESSAGE_OVERHEAD_TOKENS + int(len(text) / self.chars_per_token + 0.5)
+
+    def estimate_tokens(self, message: Union[str, Mapping[str, Any]]) -> int:
+        """
+        Estimate the prompt tokens used by a message.
+
+        The estimate is cached on history messages under 'token_count' so each
+        message is only measured once for the life of the conversation.
+
+        Args:
+            message: A history message or a raw user input string
+
+        Returns:
+            Estimated token count
+        """
+        if isinstance(message, str):
+            return self._count_text_tokens(message)
+
+        # Records are read through their slots: this runs for every message on every turn
+        cached = message.token_count if type(message) is MessageRecord else message.get('token_count')
+        if cached is None:
+            cached = self._count_text_tokens(message)
+            message['token_count'] = cached
+        return cached
+
+    def is_pinned(self, message: Mapping[str, Any]) -> bool:
+        """
+        Check whether a message must always stay in the context window.
+
+        Args:
+            message: A history message
+
+        Returns:
+            True for system messages and messages flagged as pinned
+        """
+        if type(message) is MessageRecord:
+            return message.role == 'system' or bool(message.extra and message.extra.get('pinned'))
+        return message.get('role') == 'system' or bool(message.get('pinned'))
+
+    def _omitted_note(self) -> Dict[str, Any]:
+        return {'role': 'system', 'content': OMITTED_NOTE, 'type': 'system'}
+
+    def fit_history(
+        self,
+        message_history: Sequence[Mapping[str, Any]],
+        user_input: Union[str, Mapping[str, Any]]
+    ) -> Tuple[Sequence[Mapping[str, Any]], Dict[str, int]]:
+        """
+        Trim a conversation history so the next prompt fits the token budget.
+
+        Oldest turns are dropped first and replaced by a single system note.
+        Turns are dropped in blocks of CONTEXT_TRIM_BLOCK_MESSAGES: the cut
+        only moves when the window no longer fits, so the prompt prefix and
+        the note stay the same, and prompt-cacheable, for many turns.
+        Pinned system context and the newest exchange are always kept. When
+        nothing needs dropping or moving, the history is returned as given,
+        so a history view is not copied; a view with only old turns to drop
+        comes back as a slice of it, carrying the note as its head.
+
+        Args:
+            message_history: Previous conversation history (excluding user_input)
+            user_input: The message about to be sent
+
+        Returns:
+            Tuple of (history to send, per-turn token stats)
+        """
+        input_tokens = self.estimate_tokens(user_input)
+        pinned = [msg for msg in message_history if self.is_pinned(msg)]
+        turns = [msg for msg in message_history if not self.is_pinned(msg)] if pinned else message_history
+
+        pinned_tokens = sum(self.estimate_tokens(msg) for msg in pinned)
+        turn_tokens = [self.estimate_tokens(msg) for msg in turns]
+        original_tokens = input_tokens + pinned_tokens + sum(turn_tokens)
+
+        available = self.token_budget - input_tokens - pinned_tokens
+        if original_tokens > self.token_budget:
+            # Leave room for the note that replaces the dropped turns
+            available -= self.estimate_tokens(self._omitted_note())
+        newest_exchange_start = max(len(turns) - 2, 0)
+
+        # Walk back from the newest turn until the budget is spent
+        keep_from = len(turns)
+        used = 0
+        for i in range(len(turns) - 1, -1, -1):
+            if used + turn_tokens[i] > available and i < newest_exchange_start:
+                break
+            used += turn_tokens[i]
+            keep_from = i
+
+        # Cut at the next block boundary, unless that would drop the newest exchange
+        if keep_from > 0:
+            block_cut = -(-keep_from // self.trim_block) * self.trim_block
+            if block_cut <= newest_exchange_start:
+                keep_from = block_cut
+
+        # Don't open the window on an assistant reply
+        while keep_from < newest_exchange_start and turns[keep_from].get('role') != 'user':
+            keep_from += 1
+        used = sum(turn_tokens[keep_from:])
+
+        notes = [self._omitted_note()] if keep_from > 0 else []
+        note_tokens = sum(self.estimate_tokens(note) for note in notes)
+        if not pinned and notes and isinstance(turns, HistoryView):
+            # Still a view of the client's history, so the encoded messages can be reused
+            fitted = turns[keep_from:].with_head(*notes)
+        elif pinned or notes:
+            fitted = [*pinned, *notes, *turns[keep_from:]]
+        else:
+            fitted = message_history
+
+        stats = {
+            "budget_tokens": self.token_budget,
+            "original_prompt_tokens": original_tokens,
+            "prompt_tokens": input_tokens + pinned_tokens + note_tokens + used,
+            "dropped_messages": keep_from,
+            "kept_messages": len(fitted)
+        }
+        return fitted, stats
+
+# Create a global service instance
+context_service = ContextService()
@@ -0,0 +1,124 @@
+# app/services/drain_service.py
+from typing import Dict, Any, Optional
+from types import FrameType
+import asyncio
+import signal
+import threading
+import time
+
+from .admission_service import admission_controller
+from .session_service import session_service
+from .transcript_service import transcript_persister
+from ..utils.config_utils import get_config
+
+class DrainService:
+    """
+    Graceful drain for zero-downtime restarts.
+
+    Draining stops this worker accepting connections and chat turns, lets
+    running responses finish within a deadline, persists every session and
+    transcript and tells each client, with a "reconnect" frame, to resume elsewhere.
+
+    A drain starts from the admin API, for callers holding the operator
+    token, or, when enabled, on SIGTERM: the server's own handler is chained
+    and only called once the drain is over, so the server does not close the
+    remaining connections before that. A second SIGTERM skips the rest of
+    the drain. Chaining needs uvicorn 0.29 or later, which installs its
+    handlers with signal.signal; earlier versions used the event loop's
+    handlers, which would replace this one.
+    """
+
+    def __init__(self):
+        config = get_config()["drain"]
+        self.on_signal: bool = config["on_signal"]
+        self.timeout: float = config["timeout"]
+        self.retry_after: float = config["retry_after"]
+        self.operator_token: str = config["operator_token"]
+
+        self.state = "serving"  # serving -> draining -> drained
+        self.started_at: Optional[float] = None
+        self.duration: Optional[float] = None
+        self.summary: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._previous_handler: Any = None
+        self._signalled = False
+
+    def install_signal_handler(self) -> None:
+        """Drain on SIGTERM before handing the signal to the server's own handler."""
+        if not self.on_signal or threading.current_thread() is not threading.main_thread():
+            return
+        self._loop = asyncio.get_running_loop()
+        if signal.SIGTERM in getattr(self._loop, "_signal_handlers", {}):
+            # A loop-level handler (uvicorn < 0.29) runs as well as ours and shuts down before the drain is over
+            print("WARNING: SIGTERM is handled by the event loop (uvicorn < 0.29); drain on signal needs uvicorn 0.29 or later.")
+            return
+        self._previous_handler = signal.getsignal(signal.SIGTERM)
+        signal.signal(signal.SIGTERM, self._handle_signal)
+
+    def start(self) -> asyncio.Task:
+        """
+        Start draining in the background, unless a drain is already under way.
+
+        Returns:
+            The drain task
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._drain())
+        return self._task
+
+    def get_status(self) -> Dict[str, Any]:
+        """
+        Get the drain state and, once drained, what was moved.
+
+        Returns:
+            Dictionary with the state, timings and drain summary
+        """
+        elapsed = self.duration
+        if elapsed is None and self.started_at is not None:
+            elapsed = time.monotonic() - self.started_at
+        return {
+            "state": self.state,
+            "timeout": self.timeout,
+            "elapsed_s": round(elapsed, 2) if elapsed is not None else None,
+            "connections": len(session_service.connections),
+            "turns_in_flight": admission_controller.turns_in_flight,
+            **self.summary
+        }
+
+    async def _drain(self) -> None:
+        print(f"Draining: no new connections or turns, waiting up to {self.timeout:g}s for responses to finish")
+        self.state = "draining"
+        self.started_at = time.monotonic()
+        admission_controller.draining = True
+        try:
+            self.summary = await session_service.drain(self.timeout, self.retry_after)
+            await transcript_persister.flush()
+        except Exception as e:
+            print(f"Error while draining: {str(e)}")
+        self.duration = time.monotonic() - self.started_at
+        self.state = "drained"
+        print(f"Drained in {self.duration:.1f}s: {self.summary}")
+
+    def _handle_signal(self, sig: int, frame: Optional[FrameType]) -> None:
+        if not self._signalled and self._loop is not None and not self._loop.is_closed():
+            # Signal handlers run between bytecodes; hand over to the event loop
+            self._signalled = True
+            self._loop.call_soon_threadsafe(self._drain_then_exit, sig)
+        else:
+            self._exit(sig, frame)
+
+    def _drain_then_exit(self, sig: int) -> None:
+        # Joins a drain already started from the admin API
+        self.start().add_done_callback(lambda task: self._exit(sig, None))
+
+    def _exit(self, sig: int, frame: Optional[FrameType]) -> None:
+        previous = self._previous_handler
+        if callable(previous):
+            previous(sig, frame)
+        else:
+            signal.signal(sig, previous if previous is not None else signal.SIG_DFL)
+            signal.raise_signal(sig)
+
+# Create a global service instance
+drain_service = DrainService()
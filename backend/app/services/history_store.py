@@ -0,0 +1,131 @@
+# app/services/history_store.py
+from typing import Dict, Any, List, Optional, Tuple
+import json
+import os
+import sqlite3
+import tempfile
+
+from ..models.message import json_default
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def encode_message(message: Any) -> bytes:
+    """
+    Serialize a history message; its length is also the size charged to memory budgets.
+
+    Args:
+        message: The message, a dict or MessageRecord
+
+    Returns:
+        The JSON encoding
+    """
+    if orjson is not None:
+        return orjson.dumps(message, default=json_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(message, default=json_default, separators=(",", ":")).encode("utf-8")
+
+def decode_message(raw: bytes) -> Dict[str, Any]:
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+class SqliteHistoryStore:
+    """
+    Local on-disk store for message histories evicted from memory.
+
+    Each message is a row keyed by client and position in the history, so
+    an evicted history can be extended in memory and spilled again without
+    rewriting what is already on disk. It extends the worker's own memory
+    rather than being a durable store: every process uses a file of its own,
+    removed on close, and writes are not synced to disk.
+    """
+
+    def __init__(self, directory: str = ""):
+        """
+        Args:
+            directory: Where to create the database file; empty for the system temporary directory
+        """
+        self.directory = directory or None
+        self.path: Optional[str] = None
+        self._db: Optional[sqlite3.Connection] = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        # Opened on first use, so workers that never spill never touch the disk
+        if self._db is None:
+            fd, self.path = tempfile.mkstemp(prefix="neonchat-history-", suffix=".sqlite", dir=self.directory)
+            os.close(fd)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=OFF")
+            self._db.execute(
+                "CREATE TABLE messages ("
+                "client_id TEXT NOT NULL, position INTEGER NOT NULL, body BLOB NOT NULL, "
+                "PRIMARY KEY (client_id, position)) WITHOUT ROWID"
+            )
+        return self._db
+
+    def append(self, client_id: str, start: int, messages: List[Dict[str, Any]]) -> None:
+        """
+        Write messages at consecutive positions of a client's history.
+
+        Args:
+            client_id: The client's unique identifier
+            start: Position of the first message
+            messages: The messages, oldest first
+        """
+        rows = [(client_id, start + offset, encode_message(message)) for offset, message in enumerate(messages)]
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?)", rows)
+
+    def load(self, client_id: str, start: int = 0) -> Tuple[List[Dict[str, Any]], List[int]]:
+        """
+        Read a client's stored messages from a position on.
+
+        Args:
+            client_id: The client's unique identifier
+            start: First position to read
+
+        Returns:
+            The messages in history order, and their encoded sizes
+        """
+        rows = self.db.execute(
+            "SELECT body FROM messages WHERE client_id = ? AND position >= ? ORDER BY position",
+            (client_id, start)
+        ).fetchall()
+        return [decode_message(body) for (body,) in rows], [len(body) for (body,) in rows]
+
+    def delete(self, client_id: str, start: int = 0) -> None:
+        """
+        Remove a client's stored messages from a position on.
+
+        Args:
+            client_id: The client's unique identifier
+            start: First position to remove
+        """
+        with self.db:
+            self.db.execute("DELETE FROM messages WHERE client_id = ? AND position >= ?", (client_id, start))
+
+    def size_on_disk(self) -> int:
+        if self.path is None:
+            return 0
+        size = 0
+        for suffix in ("", "-wal"):
+            try:
+                size += os.path.getsize(self.path + suffix)
+            except OSError:
+                pass
+        return size
+
+    def close(self) -> None:
+        """Close the database and remove its file."""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        if self.path is not None:
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.remove(self.path + suffix)
+                except OSError:
+                    pass
+            self.path = None
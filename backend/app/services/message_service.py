@@ -1,36 +1,121 @@
 # app/services/message_service.py
-from typing import Dict, List, Any, Optional
-from datetime import datetime
-import json
+from typing import Dict, List, Any, Optional, Callable, Deque, Mapping
+from array import array
+from collections import OrderedDict, deque
+from itertools import islice
+import time
 
-from ..models.message import Message, MessageHistory, MessageType
+from ..models.message import Message, MessageHistory, MessageType, MessageRecord, HistoryView
 from ..utils.config_utils import get_config
+from ..utils.stats_utils import percentiles
+from .history_store import SqliteHistoryStore, encode_message
+from .state_backend import state_backend
+from .transcript_service import transcript_persister
+from .attachment_store import attachment_store
+
+# Called with a message in Messages API format to add a prompt-cache breakpoint to it
+CacheMarker = Callable[[Dict[str, Any]], Dict[str, Any]]
+
+class _EncodedHistory:
+    """A history's messages in Messages API format, each encoded once and followed by a comma."""
+
+    __slots__ = ("body", "ends", "has_system")
+
+    def __init__(self):
+        self.body = bytearray()
+        # End of each history message's fragment in body; messages not sent have empty fragments
+        self.ends = array("L")
+        self.has_system = False
+
+class _Conversation:
+    """One client's history: the oldest `spilled` messages on disk, the rest in memory."""
+
+    __slots__ = ("messages", "sizes", "bytes", "spilled", "encoded", "attachments")
+
+    def __init__(self):
+        # Only ever appended to in place, so views handed out stay valid
+        self.messages: List[MessageRecord] = []
+        self.sizes = array("L")  # Encoded size of each message in memory
+        self.bytes = 0
+        self.spilled = 0
+        self.encoded: Optional[_EncodedHistory] = None
+        # Hashes of the stored attachments its messages reference, one per message
+        self.attachments: List[str] = []
 
 class MessageService:
-    """Service for handling message operations."""
+    """
+    Service for handling message operations.
+    
+    Histories of this worker's clients are kept in memory as MessageRecords
+    and mirrored to the state backend, which holds them for clients resuming
+    on another worker. Histories are handed out as views, not copies.
+    
+    Memory use is bounded: when the histories in memory exceed the global
+    budget, the least recently used ones are evicted to a local on-disk
+    store, and when one history exceeds the per-client budget its oldest
+    messages go there. Adding to an evicted history does not read it back;
+    getting it does, bringing as much as the client's budget allows back
+    into memory.
+    
+    Image and file messages hold only the hash of their attachment; each
+    one keeps a reference in the attachment store until the history is
+    cleared or dropped.
+    
+    Histories in memory also keep their messages encoded for the Messages
+    API, so a request is built by splicing bytes rather than serializing
+    the whole conversation each turn. The encoded form counts against the
+    global budget and is dropped when the history is evicted or spilled.
+    """
     
     def __init__(self):
-        self.message_histories: Dict[str, List[Dict[str, Any]]] = {}
         self.config = get_config()
+        history_config = self.config["history"]
+        self.memory_budget: int = history_config["memory_budget_bytes"]
+        self.client_budget: int = history_config["client_budget_bytes"]
+        self.store = SqliteHistoryStore(history_config["spill_dir"])
+        
+        self.conversations: Dict[str, _Conversation] = {}
+        # Conversations with messages in memory, least recently used first
+        self._resident: "OrderedDict[str, _Conversation]" = OrderedDict()
+        self.resident_bytes = 0
+        self.encoded_bytes = 0
+        self.stats = {
+            "encoded_messages": 0,
+            "evictions": 0,
+            "partial_spills": 0,
+            "spilled_messages": 0,
+            "reloads": 0,
+            "reloaded_messages": 0
+        }
+        self._reload_times: Deque[float] = deque(maxlen=1000)
+        # Called after each added message; the session service relays them between workers
+        self.on_message_added: Optional[Callable[[str, Dict[str, Any]], None]] = None
     
-    def add_message(self, client_id: str, message: Dict[str, Any]) -> None:
+    def add_message(self, client_id: str, message: Mapping[str, Any], mirror: bool = True) -> None:
         """
         Add a message to a client's history.
         
         Args:
             client_id: The client's unique identifier
-            message: The message to add
+            message: The message to add, a record or a dict converted to one (timestamped now if it has no timestamp)
+            mirror: Also write it to the state backend and transcript; False for messages relayed from another worker
         """
-        if client_id not in self.message_histories:
-            self.message_histories[client_id] = []
+        conversation = self._use(client_id)
+        message = MessageRecord.from_dict(message)
+        self._reference(conversation, message)
         
-        # Ensure the message has a timestamp
-        if 'timestamp' not in message:
-            message['timestamp'] = datetime.now().isoformat()
+        self._append(conversation, [message], [len(encode_message(message))])
+        position = conversation.spilled + len(conversation.messages) - 1
+        self._enforce_budgets(client_id, conversation)
         
-        self.message_histories[client_id].append(message)
+        if mirror:
+            state_backend.append_message(client_id, message)
+            # Only the worker where a message originates writes it to the transcript
+            transcript_persister.record(client_id, position, message)
+            if self.on_message_added is not None:
+                self.on_message_added(client_id, message)
     
-    def get_message_history(self, client_id: str) -> List[Dict[str, Any]]:
+    def get_message_history(self, client_id: str) -> HistoryView:
         """
         Get a client's message history.
         
@@ -38,9 +123,15 @@ class MessageService:
             client_id: The client's unique identifier
             
         Returns:
-            The client's message history
+            A view of the client's message history as it is now; slicing it does not copy
         """
-        return self.message_histories.get(client_id, [])
+        conversation = self.conversations.get(client_id)
+        if conversation is None:
+            return HistoryView([])
+        self._use(client_id)
+        if not conversation.spilled:
+            return HistoryView(conversation.messages)
+        return HistoryView(self._reload(client_id, conversation))
     
     def clear_message_history(self, client_id: str) -> None:
         """
@@ -49,10 +140,274 @@ class MessageService:
         Args:
             client_id: The client's unique identifier
         """
-        if client_id in self.message_histories:
-            self.message_histories[client_id] = []
-    
-    def create_user_message(self, content: str, message_type: str = "text", **kwargs) -> Dict[str, Any]:
+        if self._forget(client_id):
+            self.conversations[client_id] = _Conversation()
+        state_backend.clear_messages(client_id)
+        transcript_persister.restart(client_id)
+
+    def restore_history(self, client_id: str, messages: Optional[List[Mapping[str, Any]]]) -> None:
+        """
+        Install a history loaded from the state backend, unless one is already held.
+
+        Args:
+            client_id: The client's unique identifier
+            messages: The loaded messages, or None if there were none
+        """
+        if messages and client_id not in self.conversations:
+            conversation = self._use(client_id)
+            records = [MessageRecord.from_dict(message) for message in messages]
+            for record in records:
+                self._reference(conversation, record)
+            self._append(conversation, records, [len(encode_message(record)) for record in records])
+            self._enforce_budgets(client_id, conversation)
+
+    def drop_history(self, client_id: str) -> bool:
+        """
+        Release this worker's copy of a client's message history.
+
+        Args:
+            client_id: The client's unique identifier
+
+        Returns:
+            True if there was a history to release
+        """
+        transcript_persister.forget(client_id)
+        return self._forget(client_id)
+
+    def encode_history(self, client_id: Optional[str], history: Any, mark: Optional[CacheMarker] = None) -> Optional[bytes]:
+        """
+        Get history messages in Messages API format, encoded once per message.
+
+        Messages are encoded the first time they are sent and kept with the
+        conversation, so only the newest messages are serialized each turn.
+
+        Args:
+            client_id: The client's unique identifier
+            history: A view of the client's history from get_message_history, or a slice of it
+                such as fit_history keeps; its head messages are not included
+            mark: Adds a prompt-cache breakpoint; applied to the last and third-last messages sent
+
+        Returns:
+            The messages' JSON, each followed by a comma, or None if the history
+            cannot be served from the cache (not a view of the client's history
+            in memory, or it has system messages, which go in the system prompt)
+        """
+        conversation = self.conversations.get(client_id) if client_id else None
+        if conversation is None or conversation.spilled or not isinstance(history, HistoryView):
+            return None
+        span = history.range_of(conversation.messages)
+        if span is None:
+            return None
+        start, count = span
+        # Most recently used, so keeping to the budget below never evicts this conversation
+        self._use(client_id)
+
+        encoded = conversation.encoded
+        if encoded is None:
+            encoded = conversation.encoded = _EncodedHistory()
+        if len(encoded.ends) < count:
+            self._encode(client_id, conversation, encoded, count)
+        if encoded.has_system:
+            return None
+
+        ends = encoded.ends
+        begin = ends[start - 1] if start else 0
+        end = ends[count - 1] if count > start else begin
+        marked = []
+        if mark is not None:
+            # Same breakpoints as ApiService._mark_cache_breakpoints: the last and third-last messages sent
+            sent = []
+            index = count - 1
+            while index >= start and len(sent) < 3:
+                if ends[index] > (ends[index - 1] if index else 0):
+                    sent.append(index)
+                index -= 1
+            marked = sorted(sent[i] for i in (0, 2) if i < len(sent) and conversation.messages[sent[i]].content)
+
+        with memoryview(encoded.body) as body:
+            if not marked:
+                return bytes(body[begin:end])
+            pieces = []
+            position = begin
+            for index in marked:
+                message = conversation.messages[index]
+                pieces.append(body[position:ends[index - 1] if index else 0])
+                pieces.append(encode_message(mark({"role": message.role, "content": message.content})) + b",")
+                position = ends[index]
+            pieces.append(body[position:end])
+            return b"".join(pieces)
+
+    def splice_request(self, payload: Dict[str, Any], encoded_history: bytes) -> bytes:
+        """
+        Encode a Messages API request whose history was encoded by encode_history.
+
+        Args:
+            payload: The request, with only the messages after the history in "messages"
+            encoded_history: What encode_history returned
+
+        Returns:
+            The JSON request body
+        """
+        head = encode_message({key: value for key, value in payload.items() if key != "messages"})
+        tail = b",".join(encode_message(message) for message in payload["messages"])
+        if not tail:
+            encoded_history = encoded_history[:-1]
+        separator = b"," if len(head) > 2 else b""
+        return b"".join((head[:-1], separator, b'"messages":[', encoded_history, tail, b"]}"))
+
+    def get_history_stats(self) -> Dict[str, Any]:
+        """
+        Get the number and size of retained histories, and eviction activity.
+
+        Returns:
+            Dictionary with history and message counts, resident bytes,
+            eviction and reload counters and reload latency percentiles
+        """
+        spilled = [conversation.spilled for conversation in self.conversations.values() if conversation.spilled]
+        return {
+            "histories": len(self.conversations),
+            "messages": sum(len(conversation.messages) for conversation in self._resident.values()) + sum(spilled),
+            "resident_histories": len(self._resident),
+            "resident_bytes": self.resident_bytes,
+            "memory_budget_bytes": self.memory_budget,
+            "client_budget_bytes": self.client_budget,
+            "spilled_histories": len(spilled),
+            "encoded_bytes": self.encoded_bytes,
+            "disk_bytes": self.store.size_on_disk(),
+            **self.stats,
+            "reload_ms": percentiles(elapsed * 1000 for elapsed in self._reload_times)
+        }
+
+    def close(self) -> None:
+        """Remove the on-disk store of evicted histories."""
+        self.store.close()
+
+    def _use(self, client_id: str) -> _Conversation:
+        # Mark a conversation most recently used, creating it if needed
+        conversation = self.conversations.get(client_id)
+        if conversation is None:
+            conversation = self.conversations[client_id] = _Conversation()
+        self._resident[client_id] = conversation
+        self._resident.move_to_end(client_id)
+        return conversation
+
+    def _append(self, conversation: _Conversation, messages: List[MessageRecord], sizes: List[int]) -> None:
+        conversation.messages.extend(messages)
+        conversation.sizes.extend(sizes)
+        added = sum(sizes)
+        conversation.bytes += added
+        self.resident_bytes += added
+
+    def _enforce_budgets(self, client_id: str, conversation: _Conversation) -> None:
+        # The conversation in use keeps at least its newest message in memory
+        if self.client_budget and conversation.bytes > self.client_budget:
+            self._spill(client_id, conversation, conversation.bytes - self.client_budget)
+        if self.memory_budget:
+            while self.resident_bytes > self.memory_budget and len(self._resident) > 1:
+                cold_id, cold = next(iter(self._resident.items()))
+                self._evict(cold_id, cold)
+
+    def _spill(self, client_id: str, conversation: _Conversation, excess: int) -> None:
+        # Move the oldest messages to disk until `excess` bytes are freed
+        count = freed = 0
+        while count < len(conversation.messages) - 1 and freed < excess:
+            freed += conversation.sizes[count]
+            count += 1
+        if not count:
+            return
+        self.store.append(client_id, conversation.spilled, conversation.messages[:count])
+        # A new list rather than deleting in place, which would shift views of the old one
+        conversation.messages = conversation.messages[count:]
+        self._drop_encoded(conversation)
+        del conversation.sizes[:count]
+        conversation.spilled += count
+        conversation.bytes -= freed
+        self.resident_bytes -= freed
+        self.stats["partial_spills"] += 1
+        self.stats["spilled_messages"] += count
+
+    def _evict(self, client_id: str, conversation: _Conversation) -> None:
+        if conversation.messages:
+            self.store.append(client_id, conversation.spilled, conversation.messages)
+            self.stats["spilled_messages"] += len(conversation.messages)
+            conversation.spilled += len(conversation.messages)
+        self.resident_bytes -= conversation.bytes
+        self._drop_encoded(conversation)
+        conversation.messages = []
+        conversation.sizes = array("L")
+        conversation.bytes = 0
+        del self._resident[client_id]
+        self.stats["evictions"] += 1
+
+    def _reload(self, client_id: str, conversation: _Conversation) -> List[MessageRecord]:
+        started = time.perf_counter()
+        stored, sizes = self.store.load(client_id)
+        stored = [MessageRecord.from_dict(message) for message in stored]
+
+        # Bring back the newest stored messages that fit the client's budget
+        keep_from = len(stored)
+        room = self.client_budget - conversation.bytes if self.client_budget else float("inf")
+        while keep_from > 0 and sizes[keep_from - 1] <= room:
+            keep_from -= 1
+            room -= sizes[keep_from]
+        if keep_from < len(stored):
+            conversation.messages = stored[keep_from:] + conversation.messages
+            conversation.sizes[:0] = array("L", sizes[keep_from:])
+            moved = sum(sizes[keep_from:])
+            conversation.bytes += moved
+            self.resident_bytes += moved
+            conversation.spilled = keep_from
+            self.store.delete(client_id, keep_from)
+            self.stats["reloaded_messages"] += len(stored) - keep_from
+
+        self.stats["reloads"] += 1
+        self._reload_times.append(time.perf_counter() - started)
+        self._enforce_budgets(client_id, conversation)
+        return stored[:keep_from] + conversation.messages if keep_from else conversation.messages
+
+    def _encode(self, client_id: str, conversation: _Conversation, encoded: _EncodedHistory, count: int) -> None:
+        # Append fragments for messages up to `count`, as execute_claude_call_streaming formats history
+        before = len(encoded.body)
+        start = len(encoded.ends)
+        for message in islice(conversation.messages, start, count):
+            if message.role in ('user', 'assistant') and message.content is not None:
+                encoded.body += encode_message({"role": message.role, "content": message.content})
+                encoded.body += b","
+            elif message.role == 'system' and message.content:
+                encoded.has_system = True
+            encoded.ends.append(len(encoded.body))
+        added = len(encoded.body) - before
+        self.encoded_bytes += added
+        self.resident_bytes += added
+        self.stats["encoded_messages"] += count - start
+        self._enforce_budgets(client_id, conversation)
+
+    def _drop_encoded(self, conversation: _Conversation) -> None:
+        if conversation.encoded is not None:
+            self.encoded_bytes -= len(conversation.encoded.body)
+            self.resident_bytes -= len(conversation.encoded.body)
+            conversation.encoded = None
+
+    def _forget(self, client_id: str) -> bool:
+        conversation = self.conversations.pop(client_id, None)
+        if conversation is None:
+            return False
+        if self._resident.pop(client_id, None) is not None:
+            self.resident_bytes -= conversation.bytes
+            self._drop_encoded(conversation)
+        if conversation.spilled:
+            self.store.delete(client_id)
+        for sha256 in conversation.attachments:
+            attachment_store.release(sha256)
+        return True
+
+    def _reference(self, conversation: _Conversation, message: MessageRecord) -> None:
+        sha256 = message.get('sha256')
+        if sha256:
+            attachment_store.acquire(sha256)
+            conversation.attachments.append(sha256)
+
+    def create_user_message(self, content: str, message_type: str = "text", **kwargs) -> MessageRecord:
         """
         Create a user message object.
         
@@ -64,20 +419,9 @@ class MessageService:
         Returns:
             The message object
         """
-        message = {
-            'role': 'user',
-            'content': content,
-            'type': message_type,
-            'timestamp': datetime.now().isoformat()
-        }
-        
-        # Add any additional properties
-        for key, value in kwargs.items():
-            message[key] = value
-        
-        return message
+        return MessageRecord('user', content, message_type, **kwargs)
     
-    def create_assistant_message(self, content: str, message_type: str = "text", **kwargs) -> Dict[str, Any]:
+    def create_assistant_message(self, content: str, message_type: str = "text", **kwargs) -> MessageRecord:
         """
         Create an assistant message object.
         
@@ -89,20 +433,9 @@ class MessageService:
         Returns:
             The message object
         """
-        message = {
-            'role': 'assistant',
-            'content': content,
-            'type': message_type,
-            'timestamp': datetime.now().isoformat()
-        }
+        return MessageRecord('assistant', content, message_type, **kwargs)
         
-        # Add any additional properties
-        for key, value in kwargs.items():
-            message[key] = value
-        
-        return message
-        
-    def create_system_message(self, content: str) -> Dict[str, Any]:
+    def create_system_message(self, content: str) -> MessageRecord:
         """
         Create a system message object.
         
@@ -112,12 +445,7 @@ class MessageService:
         Returns:
             The message object
         """
-        return {
-            'role': 'system',
-            'content': content,
-            'type': 'system',
-            'timestamp': datetime.now().isoformat()
-        }
+        return MessageRecord('system', content, 'system')
 
 # Create a global service instance
-message_service = MessageService()
+message_service = MessageService()
\ No newline at end of file
@@ -0,0 +1,176 @@
+# app/services/scheduler_service.py
+from typing import Dict, Any, Deque, Optional, AsyncIterator
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import asyncio
+import random
+import time
+
+from ..utils.config_utils import get_config
+from ..utils.stats_utils import percentiles
+
+# Upstream status codes that mean "slow down and try again"
+RETRYABLE_STATUS_CODES = {429, 529}
+
+class LLMScheduler:
+    """
+    Scheduler for outbound LLM calls.
+
+    Caps the number of in-flight upstream requests and hands out free slots
+    round-robin across users, so one busy user cannot starve the others.
+    """
+
+    def __init__(self):
+        config = get_config()["scheduler"]
+        self.max_in_flight: int = config["max_in_flight"]
+        self.max_retries: int = config["max_retries"]
+        self.backoff_base: float = config["backoff_base"]
+        self.backoff_max: float = config["backoff_max"]
+
+        self.in_flight = 0
+        # user_id -> waiters, in round-robin order
+        self._queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+
+        # Metrics
+        self.max_queue_depth = 0
+        self.total_acquired = 0
+        self.throttled_responses = 0
+        self.retries = 0
+        self._wait_times: Deque[float] = deque(maxlen=1000)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def acquire(self, user_id: str) -> None:
+        """
+        Wait for an in-flight slot.
+
+        Args:
+            user_id: The user the request is made for
+        """
+        start = time.monotonic()
+        if self.in_flight < self.max_in_flight and not self._queues:
+            self.in_flight += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._queues.setdefault(user_id, deque()).append(future)
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # The slot was granted as we were cancelled, hand it on
+                    self.release()
+                else:
+                    self._discard_waiter(user_id, future)
+                raise
+
+        self.total_acquired += 1
+        self._wait_times.append(time.monotonic() - start)
+
+    def release(self) -> None:
+        """Free an in-flight slot and wake the next waiting user."""
+        self.in_flight -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user_id: Optional[str]) -> AsyncIterator[None]:
+        """
+        Hold an in-flight slot for the duration of the block.
+
+        Args:
+            user_id: The user the request is made for
+        """
+        await self.acquire(user_id or "anonymous")
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _dispatch(self) -> None:
+        while self.in_flight < self.max_in_flight and self._queues:
+            user_id, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+
+            # Move the user to the back of the rotation
+            del self._queues[user_id]
+            if queue:
+                self._queues[user_id] = queue
+
+            if future.done():
+                continue
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _discard_waiter(self, user_id: str, future: asyncio.Future) -> None:
+        queue = self._queues.get(user_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(future)
+        except ValueError:
+            pass
+        if not queue:
+            del self._queues[user_id]
+
+    def record_throttled(self) -> None:
+        """Count an upstream throttling response (429/529)."""
+        self.throttled_responses += 1
+
+    def retry_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """
+        Work out how long to wait before retrying a throttled request.
+
+        A retry-after header (seconds or HTTP date) is honoured when present.
+        Otherwise exponential backoff with full jitter is used.
+
+        Args:
+            attempt: Zero-based retry attempt
+            retry_after: The retry-after header value, if any
+
+        Returns:
+            Delay in seconds
+        """
+        self.retries += 1
+
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    retry_at = parsedate_to_datetime(retry_after)
+                    delay = (retry_at - datetime.now(timezone.utc)).total_seconds()
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                # Small jitter so throttled callers don't all return at once
+                return min(max(delay, 0.0), self.backoff_max) + random.uniform(0, self.backoff_base)
+
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Get scheduler queue and wait-time metrics.
+
+        Returns:
+            Dictionary of current gauges and cumulative counters
+        """
+        wait_ms = percentiles(wait * 1000 for wait in self._wait_times)
+
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "queued_users": len(self._queues),
+            "max_queue_depth": self.max_queue_depth,
+            "total_acquired": self.total_acquired,
+            "throttled_responses": self.throttled_responses,
+            "retries": self.retries,
+            "wait_ms": wait_ms
+        }
+
+# Create a global scheduler instance
+llm_scheduler = LLMScheduler()
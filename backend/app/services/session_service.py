@@ -0,0 +1,686 @@
+# app/services/session_service.py
+from fastapi import WebSocketDisconnect
+from collections import deque
+from typing import Dict, Any, Optional, Deque, Tuple, List, Callable
+import asyncio
+import functools
+import random
+import secrets
+import time
+import uuid
+
+from .message_service import message_service
+from .state_backend import state_backend
+from ..utils.config_utils import get_config
+from ..utils.stats_utils import percentiles
+
+# Close codes for connections ended by the server
+HALF_OPEN_CLOSE_CODE = 1011  # Heartbeat timed out
+IDLE_CLOSE_CODE = 1000
+TAKEN_OVER_CLOSE_CODE = 4000  # The session was resumed on another connection
+DRAIN_CLOSE_CODE = 1012  # Service restart: reconnect, to another worker if there is one
+
+class ConnectionState:
+    """Liveness bookkeeping for one live WebSocket connection."""
+
+    def __init__(self, client_id: str, outbound: Any, inbox: asyncio.Queue):
+        """
+        Args:
+            client_id: The client's unique identifier
+            outbound: The connection's outbound queue
+            inbox: The connection's inbound frame queue
+        """
+        now = time.monotonic()
+        self.client_id = client_id
+        self.outbound = outbound
+        self.inbox = inbox
+        self.connected_at = now
+        self.last_seen = now
+        self.last_activity = now
+        self.ping_sent: Optional[float] = None
+        self.rtt_ms: Optional[float] = None
+        self.active_requests = 0
+        self.close_code: Optional[int] = None
+
+    def touch(self, activity: bool = False) -> None:
+        """
+        Record an inbound frame; any frame proves the connection is alive.
+
+        Args:
+            activity: The frame was a user request rather than a heartbeat
+        """
+        now = time.monotonic()
+        self.last_seen = now
+        self.ping_sent = None
+        if activity:
+            self.last_activity = now
+
+    def pong(self) -> None:
+        """Record a heartbeat reply."""
+        if self.ping_sent is not None:
+            self.rtt_ms = round((time.monotonic() - self.ping_sent) * 1000, 2)
+        self.touch()
+
+    def close(self, code: int) -> None:
+        """Ask the connection loop to end; it closes the socket with this code."""
+        if self.close_code is None:
+            self.close_code = code
+            self.inbox.put_nowait(WebSocketDisconnect(code))
+
+class Session:
+    """
+    Per-client state that outlives a single WebSocket connection.
+
+    Request frames go out through send_json(), which numbers them with a
+    sequence number, keeps them in a short-lived replay buffer and forwards
+    them to the attached connection, if any. The request tasks belong to the
+    session, so a response keeps streaming into the buffer while the client
+    reconnects, and a resuming client is sent only the frames it missed.
+
+    When the client resumes on another worker, the session is handed over:
+    from then on its frames are relayed, unnumbered, to the worker that owns
+    the connection, which numbers them in its own copy of the session.
+    """
+
+    def __init__(self, client_id: str, token: Optional[str], replay_frames: int, replay_ttl: float):
+        """
+        Args:
+            client_id: The client's unique identifier
+            token: Secret the client presents to resume; None if sessions are not resumable
+            replay_frames: Most frames kept for replay
+            replay_ttl: Seconds a frame is kept for replay
+        """
+        self.client_id = client_id
+        self.token = token
+        self.seq = 0
+        self.replay: Deque[Tuple[int, float, Dict[str, Any]]] = deque()
+        self.replay_frames = replay_frames
+        self.replay_ttl = replay_ttl
+        self.requests: Dict[str, Any] = {}  # Request id -> running request with a 'task' attribute
+        self.connection: Optional[ConnectionState] = None
+        self.detached_at: Optional[float] = time.monotonic()  # Until a connection attaches
+        self.relay: Optional[Callable[[Dict[str, Any]], None]] = None  # Set once handed over
+        self.saved_at = 0.0
+        self._lock = asyncio.Lock()
+        # Numbered frames waiting for room in their connection's queue, oldest first
+        self._outbox: Deque[Tuple[ConnectionState, Dict[str, Any], asyncio.Future]] = deque()
+        self._pump: Optional[asyncio.Task] = None
+
+    async def send_json(self, data: Dict[str, Any]) -> None:
+        """
+        Number a request frame, keep it for replay and send it if a connection is attached.
+
+        Args:
+            data: The frame
+        """
+        # Frames reach the connection's queue in sequence order: straight away while
+        # it has room, as queueing then does not suspend, otherwise through the
+        # session's outbox. Waiting for room happens outside the lock, so a slow
+        # client does not hold up the session's other senders
+        async with self._lock:
+            if self.relay is not None:
+                self.relay(data)
+                return
+
+            self.seq += 1
+            frame = {**data, 'seq': self.seq}
+            if self.token is not None and self.replay_frames > 0:
+                now = time.monotonic()
+                self.replay.append((self.seq, now, frame))
+                self._trim(now)
+
+            connection = self.connection
+            if connection is None:
+                return
+            if not self._outbox and connection.outbound.depth < connection.outbound.max_frames:
+                try:
+                    await connection.outbound.send_json(frame)
+                except WebSocketDisconnect:
+                    # The connection is going away; a resuming client gets the frame from the buffer
+                    pass
+                return
+            queued = asyncio.get_running_loop().create_future()
+            self._outbox.append((connection, frame, queued))
+            if self._pump is None:
+                self._pump = asyncio.create_task(self._send_outbox())
+        # Shielded: a cancelled sender must not cancel a frame that is already numbered
+        await asyncio.shield(queued)
+
+    async def _send_outbox(self) -> None:
+        """Queue the outbox's frames in order, each once its connection's queue has room."""
+        try:
+            while self._outbox:
+                connection, frame, queued = self._outbox[0]
+                try:
+                    # A frame for a connection since replaced or detached is in the replay buffer
+                    if connection is self.connection:
+                        await connection.outbound.send_json(frame)
+                except WebSocketDisconnect:
+                    pass
+                except Exception as e:
+                    queued.set_exception(e)
+                self._outbox.popleft()
+                if not queued.done():
+                    queued.set_result(None)
+        finally:
+            self._pump = None
+            while self._outbox:
+                _, _, queued = self._outbox.popleft()
+                if not queued.done():
+                    queued.set_result(None)
+
+    async def attach(self, connection: ConnectionState, last_seq: Optional[int]) -> Dict[str, int]:
+        """
+        Attach a connection and send it the buffered frames after last_seq.
+
+        Args:
+            connection: The new connection
+            last_seq: Last sequence number the client received, or None for a new session
+
+        Returns:
+            Dictionary with the replayed frame count and, if frames were lost, the first replayed seq
+        """
+        async with self._lock:
+            self.connection = connection
+            self.detached_at = None
+            self.relay = None
+            if last_seq is None:
+                return {"replayed": 0}
+
+            # Numbering continues from what the client saw, whichever worker numbered it
+            self.seq = max(self.seq, last_seq)
+            missed, first = self._frames_after(last_seq)
+            result = {"replayed": len(missed)}
+            if last_seq + 1 < first:
+                result["gap_from"] = last_seq + 1
+                result["resumed_at"] = first
+                await connection.outbound.send_json({
+                    'role': 'system',
+                    'type': 'resync',
+                    'content': f"Frames {last_seq + 1} to {first - 1} are no longer available",
+                    'from_seq': first
+                })
+            for frame in missed:
+                await connection.outbound.send_json(frame)
+            return result
+
+    async def hand_over(self, relay: Callable[[Dict[str, Any]], None], last_seq: int) -> Optional[ConnectionState]:
+        """
+        Give the session to a connection on another worker.
+
+        The frames the client missed are relayed first, then the frames of
+        requests still running here.
+
+        Args:
+            relay: Sends a frame to the worker now owning the connection
+            last_seq: Last sequence number the client received
+
+        Returns:
+            The connection that was attached here, for the caller to close
+        """
+        async with self._lock:
+            previous = self.connection
+            self.connection = None
+            self.detached_at = None
+            if self.relay is None:
+                missed, first = self._frames_after(last_seq)
+                if last_seq + 1 < first:
+                    relay({
+                        'role': 'system',
+                        'type': 'resync',
+                        'content': f"Frames {last_seq + 1} to {first - 1} are no longer available"
+                    })
+                for frame in missed:
+                    relay({key: value for key, value in frame.items() if key != 'seq'})
+                self.replay.clear()
+            self.relay = relay
+            return previous
+
+    @property
+    def running(self) -> bool:
+        """Whether a request of the session is still running."""
+        return any(not request.task.done() for request in self.requests.values())
+
+    async def stop_requests(self, request_id: Optional[str]) -> None:
+        """
+        Cancel one running request, or all of them when no request id is given.
+
+        Cancelling a handler task propagates into the Claude stream generator,
+        which closes the upstream HTTP stream straight away.
+
+        Args:
+            request_id: The request to stop, or None for all
+        """
+        stopping = [request_id] if request_id else list(self.requests)
+        for rid in stopping:
+            request = self.requests.pop(rid, None)
+            if request is None:
+                continue
+            request.task.cancel()
+            await asyncio.gather(request.task, return_exceptions=True)
+            await self.send_json({
+                'role': 'assistant',
+                'content': '',
+                'type': 'stopped',
+                'done': True,
+                'request_id': rid
+            })
+
+    def _frames_after(self, last_seq: int) -> Tuple[List[Dict[str, Any]], int]:
+        # Buffered frames after last_seq, and the first seq still buffered
+        self._trim(time.monotonic())
+        missed = [frame for seq, _, frame in self.replay if seq > last_seq]
+        first = self.replay[0][0] if self.replay else self.seq + 1
+        return missed, first
+
+    def _trim(self, now: float) -> None:
+        while self.replay and (len(self.replay) > self.replay_frames or now - self.replay[0][1] > self.replay_ttl):
+            self.replay.popleft()
+
+class SessionService:
+    """
+    Service tracking live WebSocket connections and resumable sessions.
+
+    A single background sweep sends heartbeat pings to quiet connections,
+    closes half-open ones that stop answering, optionally closes idle ones,
+    and releases sessions (requests, replay buffer and message history)
+    whose client has been gone longer than the retention period.
+
+    Tokens and histories are kept in the state backend. With a shared
+    backend every worker subscribes to a channel per session it holds; a
+    worker resuming a session announces it there, and the previous worker
+    hands the session over and relays frames and history from requests
+    that are still running.
+    """
+
+    def __init__(self):
+        config = get_config()["websocket"]
+        self.ping_interval: float = config["ping_interval"]
+        self.ping_timeout: float = config["ping_timeout"]
+        self.idle_timeout: float = config["idle_timeout"]
+        self.history_retention: float = config["history_retention"]
+        self.replay_frames: int = config["replay_buffer_frames"]
+        self.replay_ttl: float = config["replay_ttl"]
+
+        self.backend = state_backend
+        self.worker_id = uuid.uuid4().hex[:8]
+        self.connections: Dict[str, ConnectionState] = {}
+        self.sessions: Dict[str, Session] = {}
+        self.stats = {
+            "connected": 0,
+            "disconnected": 0,
+            "resumed": 0,
+            "resume_failed": 0,
+            "adopted": 0,
+            "handed_over": 0,
+            "replay_gaps": 0,
+            "frames_replayed": 0,
+            "taken_over": 0,
+            "pings_sent": 0,
+            "half_open_closed": 0,
+            "idle_closed": 0,
+            "histories_released": 0
+        }
+        self._reaper: Optional[asyncio.Task] = None
+        message_service.on_message_added = self._relay_history
+
+    @property
+    def sweep_interval(self) -> float:
+        return max(0.5, min(self.ping_interval or 30, self.ping_timeout or 30) / 4)
+
+    def startup(self) -> None:
+        """Start the background sweep."""
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap_loop())
+
+    async def shutdown(self) -> None:
+        """Stop the background sweep and cancel requests still running in detached sessions."""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            await asyncio.gather(self._reaper, return_exceptions=True)
+            self._reaper = None
+
+        tasks = [request.task for session in self.sessions.values() for request in session.requests.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def open(self, token: Optional[str] = None) -> Tuple[Session, bool]:
+        """
+        Find the session for a resume token, or start a new one.
+
+        A token issued by another worker is resumed here: the history is
+        loaded from the state backend and the session is handed over once
+        the connection attaches.
+
+        Args:
+            token: The session token the client presented, if any
+
+        Returns:
+            The session and whether it was resumed
+        """
+        client_id = await self.backend.resolve_session(token) if token else None
+        if client_id is not None:
+            session = self.sessions.get(client_id)
+            if session is None:
+                session = await self._adopt(client_id, token)
+            elif session.relay is not None:
+                # Back from another worker; its history moved on there
+                message_service.drop_history(client_id)
+                message_service.restore_history(client_id, await self.backend.load_messages(client_id))
+            elif session.detached_at is not None:
+                # Restart the retention clock so the session is not released mid-handshake
+                session.detached_at = time.monotonic()
+            return session, True
+        if token:
+            self.stats["resume_failed"] += 1
+
+        client_id = str(uuid.uuid4())
+        new_token = secrets.token_urlsafe(24) if self.history_retention > 0 else None
+        session = Session(client_id, new_token, self.replay_frames, self.replay_ttl)
+        self.sessions[client_id] = session
+        await self._save(session)
+        await self._subscribe(session)
+        return session, False
+
+    async def connect(
+        self,
+        session: Session,
+        outbound: Any,
+        inbox: asyncio.Queue,
+        last_seq: Optional[int] = None
+    ) -> Tuple[ConnectionState, Dict[str, int]]:
+        """
+        Register a new connection and attach it to its session.
+
+        A connection still attached to the session, typically a half-open
+        one the heartbeat has not caught yet, is closed; with a shared
+        backend, so is one on another worker, which hands the session over.
+
+        Args:
+            session: The session from open()
+            outbound: The connection's outbound queue
+            inbox: The connection's inbound frame queue
+            last_seq: Last sequence number a resuming client received
+
+        Returns:
+            The connection's state and the replay summary from Session.attach()
+        """
+        previous = session.connection
+        if previous is not None:
+            print(f"WS session resumed elsewhere, closing old connection: {session.client_id}")
+            self.stats["taken_over"] += 1
+            previous.close(TAKEN_OVER_CLOSE_CODE)
+
+        state = ConnectionState(session.client_id, outbound, inbox)
+        self.connections[session.client_id] = state
+        self.stats["connected"] += 1
+        replay = await session.attach(state, last_seq)
+        if last_seq is not None:
+            self.stats["resumed"] += 1
+            self.stats["frames_replayed"] += replay["replayed"]
+            if "gap_from" in replay:
+                self.stats["replay_gaps"] += 1
+            if self.backend.shared:
+                self._publish(session.client_id, 'attach', last_seq=last_seq)
+        await self._save(session)
+        return state, replay
+
+    async def disconnect(self, state: ConnectionState) -> None:
+        """
+        Unregister a connection.
+
+        Its session, running requests included, is kept for the retention
+        period so the client can resume; without retention it is released.
+
+        Args:
+            state: The connection's state
+        """
+        if self.connections.get(state.client_id) is state:
+            del self.connections[state.client_id]
+        self.stats["disconnected"] += 1
+
+        session = self.sessions.get(state.client_id)
+        if session is None or session.connection is not state:
+            # Already taken over by a newer connection
+            return
+        session.connection = None
+        if session.token is not None:
+            session.detached_at = time.monotonic()
+            await self._save(session)
+        else:
+            await self._release(session)
+
+    async def stop_requests(self, session: Session, request_id: Optional[str]) -> None:
+        """
+        Stop requests of a session, including ones still running on a worker that handed it over.
+
+        Args:
+            session: The session
+            request_id: The request to stop, or None for all
+        """
+        await session.stop_requests(request_id)
+        if self.backend.shared:
+            self._publish(session.client_id, 'stop', request_id=request_id)
+
+    async def sweep(self) -> None:
+        """Run one heartbeat, idle and session retention pass."""
+        now = time.monotonic()
+        for state in list(self.connections.values()):
+            if state.close_code is not None:
+                continue
+            if state.ping_sent is not None and self.ping_timeout and now - state.ping_sent > self.ping_timeout:
+                print(f"WS heartbeat timed out, closing: {state.client_id}")
+                self.stats["half_open_closed"] += 1
+                state.close(HALF_OPEN_CLOSE_CODE)
+            elif self.idle_timeout and not state.active_requests and now - state.last_activity > self.idle_timeout:
+                print(f"WS idle, closing: {state.client_id}")
+                self.stats["idle_closed"] += 1
+                state.close(IDLE_CLOSE_CODE)
+            elif self.ping_interval and state.ping_sent is None and now - state.last_seen >= self.ping_interval:
+                await self._ping(state, now)
+
+        for session in list(self.sessions.values()):
+            if session.relay is not None:
+                # Handed over: kept only while its requests still run here
+                if all(request.task.done() for request in session.requests.values()):
+                    await self._release(session, forget=False)
+            elif session.detached_at is not None and now - session.detached_at >= self.history_retention:
+                await self._release(session)
+            elif session.connection is not None and now - session.saved_at >= self.history_retention / 2:
+                # Keep the token and mirrored history of a long-lived connection from expiring
+                await self._save(session)
+
+    async def drain(self, timeout: float, retry_after: float) -> Dict[str, int]:
+        """
+        Move every client off this worker without cutting off a response.
+
+        Connections with no request running are told to reconnect at once,
+        the others as soon as their requests finish. Requests still running
+        when the timeout runs out are stopped; their handlers keep the
+        partial response. Each session is persisted before its client is
+        told, so the worker it reconnects to can resume it.
+
+        Args:
+            timeout: Seconds to let running requests finish
+            retry_after: Seconds clients are told to wait before reconnecting
+
+        Returns:
+            Counts of connections moved, requests stopped and sessions persisted
+        """
+        deadline = time.monotonic() + timeout
+        summary = {"connections_moved": 0, "requests_stopped": 0, "sessions_persisted": 0}
+        while True:
+            expired = time.monotonic() >= deadline
+            for session in list(self.sessions.values()):
+                if expired and session.running:
+                    summary["requests_stopped"] += sum(1 for request in session.requests.values() if not request.task.done())
+                    await session.stop_requests(None)
+                state = session.connection
+                if state is not None and state.close_code is None and not session.running:
+                    await self._move(session, state, retry_after)
+                    summary["connections_moved"] += 1
+            if expired or not any(session.running for session in self.sessions.values()):
+                break
+            await asyncio.sleep(0.1)
+
+        # Connections that arrived without a session to move them by
+        for state in list(self.connections.values()):
+            state.close(DRAIN_CLOSE_CODE)
+
+        # Detached sessions: their clients may come back to another worker too
+        for session in list(self.sessions.values()):
+            if session.token is not None and session.relay is None:
+                await self._persist(session)
+                summary["sessions_persisted"] += 1
+        await self.backend.flush()
+        return summary
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Get connection and retained-state gauges.
+
+        Returns:
+            Dictionary of session metrics
+        """
+        states = list(self.connections.values())
+        detached = [session for session in self.sessions.values() if session.detached_at is not None]
+        return {
+            "worker": self.worker_id,
+            "live_connections": len(states),
+            "busy_connections": sum(1 for state in states if state.active_requests),
+            "awaiting_pong": sum(1 for state in states if state.ping_sent is not None),
+            "sessions": len(self.sessions),
+            "detached_sessions": len(detached),
+            "detached_requests": sum(
+                1 for session in detached for request in session.requests.values() if not request.task.done()
+            ),
+            "relayed_sessions": sum(1 for session in self.sessions.values() if session.relay is not None),
+            "replay_buffered_frames": sum(len(session.replay) for session in self.sessions.values()),
+            "heartbeat_rtt_ms": percentiles(state.rtt_ms for state in states if state.rtt_ms is not None),
+            "histories": message_service.get_history_stats(),
+            "state_backend": self.backend.get_stats(),
+            **self.stats
+        }
+
+    async def _ping(self, state: ConnectionState, now: float) -> None:
+        # A backed-up queue is already handled by the slow-consumer policy
+        if state.outbound.depth >= state.outbound.max_frames:
+            return
+        state.ping_sent = now
+        self.stats["pings_sent"] += 1
+        try:
+            await state.outbound.send_json({'role': 'system', 'type': 'ping', 'ts': time.time()})
+        except WebSocketDisconnect:
+            pass
+
+    async def _adopt(self, client_id: str, token: str) -> Session:
+        # A session resumed on this worker after living on another one
+        session = Session(client_id, token, self.replay_frames, self.replay_ttl)
+        self.sessions[client_id] = session
+        message_service.restore_history(client_id, await self.backend.load_messages(client_id))
+        await self._subscribe(session)
+        self.stats["adopted"] += 1
+        return session
+
+    async def _move(self, session: Session, state: ConnectionState, retry_after: float) -> None:
+        await self._persist(session)
+        if self.backend.shared:
+            await self.backend.flush()
+        try:
+            await state.outbound.send_json({
+                'role': 'system',
+                'type': 'reconnect',
+                'reason': 'draining',
+                'content': "This server is restarting, reconnecting",
+                'retry_after': round(retry_after * random.uniform(0.5, 1.5), 1),
+                'session_token': session.token
+            })
+        except WebSocketDisconnect:
+            pass
+        state.close(DRAIN_CLOSE_CODE)
+
+    async def _persist(self, session: Session) -> None:
+        if session.token is not None:
+            session.saved_at = time.monotonic()
+            await self.backend.persist_session(
+                session.token, session.client_id, self.history_retention,
+                message_service.get_message_history(session.client_id)
+            )
+
+    async def _save(self, session: Session) -> None:
+        if session.token is not None:
+            session.saved_at = time.monotonic()
+            await self.backend.save_session(session.token, session.client_id, self.history_retention)
+
+    async def _subscribe(self, session: Session) -> None:
+        if self.backend.shared:
+            await self.backend.subscribe(
+                f"session:{session.client_id}",
+                functools.partial(self._on_session_message, session.client_id)
+            )
+
+    def _publish(self, client_id: str, kind: str, **fields: Any) -> None:
+        self.backend.publish(f"session:{client_id}", {'kind': kind, 'origin': self.worker_id, **fields})
+
+    async def _on_session_message(self, client_id: str, message: Dict[str, Any]) -> None:
+        session = self.sessions.get(client_id)
+        if session is None or message.get('origin') == self.worker_id:
+            return
+        kind = message.get('kind')
+
+        if kind == 'attach':
+            # The client resumed on another worker
+            self.stats["handed_over"] += 1
+            previous = await session.hand_over(
+                lambda frame: self._publish(client_id, 'frame', frame=frame),
+                int(message.get('last_seq') or 0)
+            )
+            # The owner keeps the history from now on
+            message_service.drop_history(client_id)
+            if previous is not None:
+                print(f"WS session resumed on another worker, closing old connection: {client_id}")
+                self.stats["taken_over"] += 1
+                previous.close(TAKEN_OVER_CLOSE_CODE)
+        elif session.relay is None:
+            # Owner side: output of requests still running on the previous worker
+            if kind == 'frame':
+                await session.send_json(message['frame'])
+            elif kind == 'history':
+                message_service.add_message(client_id, message['message'], mirror=False)
+        elif kind == 'stop':
+            await session.stop_requests(message.get('request_id'))
+
+    def _relay_history(self, client_id: str, message: Dict[str, Any]) -> None:
+        # Messages saved by requests of a handed-over session belong in the owner's history too
+        session = self.sessions.get(client_id)
+        if session is not None and session.relay is not None:
+            self._publish(client_id, 'history', message=message)
+
+    async def _release(self, session: Session, forget: bool = True) -> None:
+        self.sessions.pop(session.client_id, None)
+        session.replay.clear()
+        if self.backend.shared:
+            await self.backend.unsubscribe(f"session:{session.client_id}")
+        if forget and session.token is not None:
+            await self.backend.drop_session(session.token, session.client_id)
+
+        # Handlers save partial responses when cancelled, so the history goes last
+        tasks = [request.task for request in session.requests.values()]
+        session.requests.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if message_service.drop_history(session.client_id):
+            self.stats["histories_released"] += 1
+
+    async def _reap_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"Error in WebSocket session sweep: {str(e)}")
+
+# Create a global service instance
+session_service = SessionService()
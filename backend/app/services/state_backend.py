@@ -0,0 +1,490 @@
+# app/services/state_backend.py
+from typing import Dict, Any, List, Optional, Callable, Awaitable, Deque, Set, Tuple
+from abc import ABC, abstractmethod
+from collections import deque
+import asyncio
+import json
+import os
+import time
+
+from ..models.message import json_default
+from ..utils.config_utils import get_config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import redis.asyncio as aioredis
+    from redis.exceptions import RedisError, ConnectionError as RedisConnectionError
+except ImportError:
+    aioredis = None
+    RedisError = RedisConnectionError = OSError
+
+# Called with each pub/sub message of a subscribed channel, in publish order
+MessageHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+# Most queued writes sent in one pipeline
+WRITE_BATCH_COMMANDS = 512
+
+def _dumps(data: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data, default=json_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, default=json_default, separators=(",", ":")).encode("utf-8")
+
+def _loads(raw: bytes) -> Any:
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+class _Subscription:
+    """Delivers one channel's messages to its handler, one at a time and in order."""
+
+    def __init__(self, channel: str, handler: MessageHandler):
+        self.channel = channel
+        self.handler = handler
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+
+    def put(self, message: Dict[str, Any]) -> None:
+        self.queue.put_nowait(message)
+
+    def close(self) -> None:
+        self.task.cancel()
+
+    async def _run(self) -> None:
+        while True:
+            message = await self.queue.get()
+            try:
+                await self.handler(message)
+            except Exception as e:
+                print(f"Error handling state backend message on {self.channel}: {str(e)}")
+
+class StateBackend(ABC):
+    """
+    Session state shared by the workers of a deployment.
+
+    The worker serving a client keeps its message history in MessageService.
+    A shared backend also mirrors the history and the session tokens, so a
+    client that reconnects to another worker (or node) resumes there, and
+    carries pub/sub messages between workers so frames produced on one
+    worker reach the connection on another.
+    """
+
+    name = "base"
+    shared = False  # Whether other workers see this state
+
+    async def start(self) -> None:
+        """Connect to the store."""
+
+    async def close(self) -> None:
+        """Cancel subscriptions and disconnect."""
+
+    def append_message(self, client_id: str, message: Dict[str, Any]) -> None:
+        """
+        Mirror a history message. Writes are queued in call order without waiting.
+
+        Args:
+            client_id: The client's unique identifier
+            message: The message added to the history
+        """
+
+    def clear_messages(self, client_id: str) -> None:
+        """Clear a mirrored history, without waiting."""
+
+    async def load_messages(self, client_id: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        Load a mirrored history.
+
+        Returns:
+            The messages, or None if the backend holds no history
+        """
+        return None
+
+    @abstractmethod
+    async def save_session(self, token: str, client_id: str, ttl: float) -> None:
+        """
+        Register a resume token and restart its expiry, and its history's.
+
+        Args:
+            token: The session token
+            client_id: The client the token resumes
+            ttl: Seconds the session survives without being saved again
+        """
+
+    @abstractmethod
+    async def resolve_session(self, token: str) -> Optional[str]:
+        """
+        Look up the client a resume token belongs to.
+
+        Returns:
+            The client id, or None for an unknown or expired token
+        """
+
+    @abstractmethod
+    async def drop_session(self, token: str, client_id: str) -> None:
+        """Forget a session's token and mirrored history."""
+
+    async def persist_session(self, token: str, client_id: str, ttl: float, messages: List[Dict[str, Any]]) -> None:
+        """
+        Keep what a session needs to be resumed by another process: its token and history.
+
+        Args:
+            token: The session token
+            client_id: The client the token resumes
+            ttl: Seconds the session stays resumable
+            messages: The session's message history
+        """
+        await self.save_session(token, client_id, ttl)
+
+    async def flush(self) -> None:
+        """Wait until writes made so far are stored."""
+
+    @abstractmethod
+    def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        """Send a message to the channel's subscribers on every worker, without waiting."""
+
+    @abstractmethod
+    async def subscribe(self, channel: str, handler: MessageHandler) -> None:
+        """Deliver the channel's messages to handler until unsubscribed."""
+
+    @abstractmethod
+    async def unsubscribe(self, channel: str) -> None:
+        """Stop delivering a channel's messages."""
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+class MemoryStateBackend(StateBackend):
+    """
+    Process-local state for a single worker.
+
+    Histories live only in MessageService, so there is nothing to mirror;
+    tokens are a dict and pub/sub stays inside the process. Expired
+    sessions are released by the session sweep, which drops their tokens.
+
+    With a snapshot path, sessions persisted while draining are written to
+    that file and read back by the next process, so clients can resume
+    across a restart.
+    """
+
+    name = "memory"
+    shared = False
+
+    def __init__(self, snapshot_path: str = ""):
+        """
+        Args:
+            snapshot_path: File for sessions persisted across a restart; empty to disable
+        """
+        self.snapshot_path = snapshot_path
+        self.tokens: Dict[str, str] = {}
+        self.subscriptions: Dict[str, _Subscription] = {}
+        # Persisted sessions to snapshot, and histories restored from a snapshot until loaded
+        self.persisted: Dict[str, Dict[str, Any]] = {}
+        self.histories: Dict[str, List[Dict[str, Any]]] = {}
+
+    async def start(self) -> None:
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                snapshot = _loads(f.read())
+            os.remove(self.snapshot_path)
+        except (OSError, ValueError) as e:
+            print(f"WARNING: Could not read session snapshot {self.snapshot_path}: {str(e)}")
+            return
+        now = time.time()
+        for token, entry in snapshot.get("sessions", {}).items():
+            if entry["expires_at"] > now:
+                self.tokens[token] = entry["client_id"]
+                self.histories[entry["client_id"]] = entry["messages"]
+        print(f"Restored {len(self.tokens)} resumable sessions from {self.snapshot_path}")
+
+    async def close(self) -> None:
+        for subscription in self.subscriptions.values():
+            subscription.close()
+        self.subscriptions.clear()
+
+    async def save_session(self, token: str, client_id: str, ttl: float) -> None:
+        self.tokens[token] = client_id
+
+    async def resolve_session(self, token: str) -> Optional[str]:
+        return self.tokens.get(token)
+
+    async def drop_session(self, token: str, client_id: str) -> None:
+        self.tokens.pop(token, None)
+        self.histories.pop(client_id, None)
+        self.persisted.pop(token, None)
+
+    async def load_messages(self, client_id: str) -> Optional[List[Dict[str, Any]]]:
+        return self.histories.pop(client_id, None)
+
+    async def persist_session(self, token: str, client_id: str, ttl: float, messages: List[Dict[str, Any]]) -> None:
+        self.tokens[token] = client_id
+        if self.snapshot_path:
+            self.persisted[token] = {"client_id": client_id, "expires_at": time.time() + ttl, "messages": messages}
+
+    async def flush(self) -> None:
+        if not self.snapshot_path or not self.persisted:
+            return
+        # Written aside and renamed, so a crash never leaves half a snapshot
+        temp_path = f"{self.snapshot_path}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(_dumps({"sessions": self.persisted}))
+            os.replace(temp_path, self.snapshot_path)
+        except OSError as e:
+            print(f"WARNING: Could not write session snapshot {self.snapshot_path}: {str(e)}")
+
+    def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        subscription = self.subscriptions.get(channel)
+        if subscription is not None:
+            subscription.put(message)
+
+    async def subscribe(self, channel: str, handler: MessageHandler) -> None:
+        self.subscriptions[channel] = _Subscription(channel, handler)
+
+    async def unsubscribe(self, channel: str) -> None:
+        subscription = self.subscriptions.pop(channel, None)
+        if subscription is not None:
+            subscription.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "tokens": len(self.tokens),
+            "subscriptions": len(self.subscriptions),
+            "persisted": len(self.persisted)
+        }
+
+class RedisStateBackend(StateBackend):
+    """
+    State kept in a Redis-protocol server, shared by every worker using it.
+
+    Histories are lists of JSON messages, tokens are plain keys, and both
+    expire when their session has been detached for the retention period.
+    History writes and publishes are queued without waiting and sent in
+    call order by one writer task, batched into pipelines; failures are
+    counted. Pub/sub runs on its own connection, which redis-py
+    re-establishes and re-subscribes after it drops.
+    """
+
+    name = "redis"
+    shared = True
+
+    def __init__(self, url: str, prefix: str = "neonchat"):
+        """
+        Args:
+            url: Server address, redis://[:password@]host[:port][/db]
+            prefix: Namespace for keys and channels
+        """
+        self.url = url
+        self.prefix = prefix
+        # RESP2, which every Redis-protocol server speaks; redis-py 8 would open with HELLO 3
+        self.redis = aioredis.Redis.from_url(url, protocol=2)
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self.subscriptions: Dict[str, _Subscription] = {}
+        self.connected = False
+        self.stats = {"writes": 0, "published": 0, "received": 0, "errors": 0, "reconnects": 0}
+        # Commands to send in order, and futures for flush() to resolve once the commands before them are sent
+        self._queue: Deque[Any] = deque()
+        self._queued = asyncio.Event()
+        # Channels to subscribe once the server is reachable again
+        self._unsubscribed: Set[str] = set()
+        self._writer: Optional[asyncio.Task] = None
+        self._reader: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        try:
+            await self.redis.ping()
+            self._succeeded()
+        except (RedisError, OSError) as e:
+            print(f"WARNING: State backend {self.url} unavailable ({str(e)}); retrying in the background.")
+        self._writer = asyncio.create_task(self._write_queued())
+
+    async def close(self) -> None:
+        for task in (self._writer, self._reader):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._writer = self._reader = None
+        for subscription in self.subscriptions.values():
+            subscription.close()
+        self.subscriptions.clear()
+        await self.pubsub.aclose()
+        await self.redis.aclose()
+
+    def append_message(self, client_id: str, message: Dict[str, Any]) -> None:
+        self._write("RPUSH", self._key("history", client_id), _dumps(message))
+
+    def clear_messages(self, client_id: str) -> None:
+        self._write("DEL", self._key("history", client_id))
+
+    async def load_messages(self, client_id: str) -> Optional[List[Dict[str, Any]]]:
+        try:
+            items = await self.redis.lrange(self._key("history", client_id), 0, -1)
+        except (RedisError, OSError) as e:
+            self._failed(e)
+            return None
+        return [_loads(item) for item in items] if items else None
+
+    async def save_session(self, token: str, client_id: str, ttl: float) -> None:
+        ttl_ms = max(1, int(ttl * 1000))
+        self._write("PEXPIRE", self._key("history", client_id), ttl_ms)
+        try:
+            # Waited for, so the token resolves on any worker once the client has it
+            await self.redis.set(self._key("token", token), client_id, px=ttl_ms)
+        except (RedisError, OSError) as e:
+            self._failed(e)
+
+    async def resolve_session(self, token: str) -> Optional[str]:
+        try:
+            client_id = await self.redis.get(self._key("token", token))
+        except (RedisError, OSError) as e:
+            self._failed(e)
+            return None
+        return client_id.decode("utf-8") if client_id else None
+
+    async def drop_session(self, token: str, client_id: str) -> None:
+        self._write("DEL", self._key("token", token), self._key("history", client_id))
+
+    async def flush(self) -> None:
+        if self._writer is None:
+            return
+        done = asyncio.get_running_loop().create_future()
+        self._queue.append(done)
+        self._queued.set()
+        await done
+
+    def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        self.stats["published"] += 1
+        self._write("PUBLISH", self._key("channel", channel), _dumps(message))
+
+    async def subscribe(self, channel: str, handler: MessageHandler) -> None:
+        name = self._key("channel", channel)
+        self.subscriptions[name] = _Subscription(name, handler)
+        try:
+            await self.pubsub.subscribe(name)
+        except (RedisError, OSError) as e:
+            # Subscribed by the reader once the server is back
+            self._failed(e)
+            self._unsubscribed.add(name)
+        if self._reader is None:
+            self._reader = asyncio.create_task(self._read_published())
+
+    async def unsubscribe(self, channel: str) -> None:
+        name = self._key("channel", channel)
+        subscription = self.subscriptions.pop(name, None)
+        if subscription is None:
+            return
+        subscription.close()
+        if name in self._unsubscribed:
+            self._unsubscribed.discard(name)
+            return
+        try:
+            await self.pubsub.unsubscribe(name)
+        except (RedisError, OSError) as e:
+            self._failed(e)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "connected": self.connected,
+            "subscriptions": len(self.subscriptions),
+            "queued_writes": len(self._queue),
+            **self.stats
+        }
+
+    def _key(self, kind: str, name: str) -> str:
+        return f"{self.prefix}:{kind}:{name}"
+
+    def _write(self, *args: Any) -> None:
+        self.stats["writes"] += 1
+        self._queue.append(args)
+        self._queued.set()
+
+    async def _write_queued(self) -> None:
+        while True:
+            await self._queued.wait()
+            self._queued.clear()
+            while self._queue:
+                commands = []
+                flushed = []
+                while self._queue and len(commands) < WRITE_BATCH_COMMANDS:
+                    item = self._queue.popleft()
+                    (flushed if isinstance(item, asyncio.Future) else commands).append(item)
+                if commands:
+                    await self._send(commands)
+                for done in flushed:
+                    if not done.done():
+                        done.set_result(None)
+
+    async def _send(self, commands: List[Tuple[Any, ...]]) -> None:
+        pipeline = self.redis.pipeline(transaction=False)
+        for args in commands:
+            pipeline.execute_command(*args)
+        try:
+            results = await pipeline.execute(raise_on_error=False)
+        except (RedisError, OSError) as e:
+            # The batch is lost; later writes go out on a new connection
+            self._failed(e)
+            return
+        self._succeeded()
+        for result in results:
+            if isinstance(result, Exception):
+                self._failed(result)
+
+    async def _read_published(self) -> None:
+        delay = 0.5
+        while True:
+            try:
+                if self._unsubscribed:
+                    names = list(self._unsubscribed)
+                    await self.pubsub.subscribe(*names)
+                    self._unsubscribed.difference_update(names)
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except (RedisError, OSError) as e:
+                self._failed(e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 10.0)
+                continue
+            delay = 0.5
+            self._succeeded()
+            if message is not None and message.get("type") == "message":
+                subscription = self.subscriptions.get(message["channel"].decode("utf-8"))
+                if subscription is not None:
+                    self.stats["received"] += 1
+                    subscription.put(_loads(message["data"]))
+
+    def _succeeded(self) -> None:
+        if not self.connected:
+            self.connected = True
+            self.stats["reconnects"] += 1
+
+    def _failed(self, error: Exception) -> None:
+        if isinstance(error, (OSError, RedisConnectionError)):
+            self.connected = False
+        self.stats["errors"] += 1
+        if self.stats["errors"] in (1, 10, 100) or self.stats["errors"] % 1000 == 0:
+            print(f"WARNING: State backend command failed ({self.stats['errors']} so far): {str(error)}")
+
+def create_state_backend(config: Optional[Dict[str, Any]] = None) -> StateBackend:
+    """
+    Build the state backend named by the configuration.
+
+    Args:
+        config: The "state" configuration section; read from the environment if omitted
+
+    Returns:
+        The backend, not yet started
+    """
+    config = config or get_config()["state"]
+    if config["backend"] == "redis":
+        if aioredis is not None:
+            return RedisStateBackend(config["redis_url"], config["key_prefix"])
+        print("WARNING: redis module not found. Install redis>=5.0.1 for STATE_BACKEND=redis; using process-local state.")
+    elif config["backend"] != "memory":
+        print(f"WARNING: Unknown STATE_BACKEND '{config['backend']}'. Using process-local state.")
+    return MemoryStateBackend(config.get("snapshot_path", ""))
+
+# Create a global backend instance
+state_backend = create_state_backend()
@@ -0,0 +1,466 @@
+# app/services/transcript_service.py
+from typing import Dict, Any, List, Optional, Deque
+from abc import ABC, abstractmethod
+from collections import deque
+from datetime import datetime, timezone
+import asyncio
+import glob
+import os
+import sqlite3
+import time
+
+from ..utils.config_utils import get_config
+from ..utils.stats_utils import percentiles
+from .history_store import encode_message, decode_message
+
+# A batch of consecutive messages of one transcript, as written to storage
+TranscriptRow = Dict[str, Any]
+
+class TranscriptBackend(ABC):
+    """
+    Storage for chat transcripts.
+
+    Transcripts are written as rows of consecutive messages keyed by
+    transcript and position of the first message, so writing a row again
+    after a failure replaces it instead of duplicating messages. Backend
+    calls are blocking and run in a worker thread.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def write(self, rows: List[TranscriptRow]) -> None:
+        """
+        Store rows, replacing any with the same transcript and position.
+
+        Args:
+            rows: Dicts with transcript_id, position, messages and created_at
+
+        Raises:
+            Exception: If the rows could not be stored
+        """
+
+    @abstractmethod
+    def load(self, transcript_id: str) -> List[Dict[str, Any]]:
+        """
+        Read a transcript's messages in order.
+
+        Args:
+            transcript_id: The transcript, the client's id for its first conversation
+
+        Returns:
+            The messages
+        """
+
+    def close(self) -> None:
+        """Release connections."""
+
+class LocalTranscriptBackend(TranscriptBackend):
+    """Transcripts in a local SQLite file, for a single node and for testing."""
+
+    name = "local"
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: The database file, created if missing
+        """
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Shared by the workers of a node; SQLite serialises their writes
+            self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS chat_transcripts ("
+                "transcript_id TEXT NOT NULL, position INTEGER NOT NULL, messages BLOB NOT NULL, "
+                "created_at REAL NOT NULL, PRIMARY KEY (transcript_id, position)) WITHOUT ROWID"
+            )
+        return self._db
+
+    def write(self, rows: List[TranscriptRow]) -> None:
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO chat_transcripts VALUES (?, ?, ?, ?)",
+                [(row["transcript_id"], row["position"], encode_message(row["messages"]), row["created_at"]) for row in rows]
+            )
+
+    def load(self, transcript_id: str) -> List[Dict[str, Any]]:
+        rows = self.db.execute(
+            "SELECT messages FROM chat_transcripts WHERE transcript_id = ? ORDER BY position",
+            (transcript_id,)
+        ).fetchall()
+        return [message for (messages,) in rows for message in decode_message(messages)]
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+class SupabaseTranscriptBackend(TranscriptBackend):
+    """
+    Transcripts in the chat_transcripts table of SUPABASE_SCHEMA.
+
+    Rows are upserted on (transcript_id, position); the key should be one
+    with write access to the table, as rows are written by the server
+    rather than on behalf of a signed-in user.
+    """
+
+    name = "supabase"
+
+    def __init__(self, client: Any):
+        """
+        Args:
+            client: A configured Supabase client
+        """
+        self.client = client
+
+    def write(self, rows: List[TranscriptRow]) -> None:
+        records = [{
+            "transcript_id": row["transcript_id"],
+            "position": row["position"],
+            "messages": [dict(message) for message in row["messages"]],
+            "created_at": datetime.fromtimestamp(row["created_at"], timezone.utc).isoformat()
+        } for row in rows]
+        self.client.table("chat_transcripts").upsert(records, on_conflict="transcript_id,position").execute()
+
+    def load(self, transcript_id: str) -> List[Dict[str, Any]]:
+        response = self.client.table("chat_transcripts")\
+            .select("messages")\
+            .eq("transcript_id", transcript_id)\
+            .order("position")\
+            .execute()
+        return [message for row in response.data for message in row["messages"]]
+
+class TranscriptJournal:
+    """
+    Bounded local journal of rows that could not be written to the backend.
+
+    Each process appends to a file of its own in the journal directory, so
+    workers never share one. Journals left by processes that are gone are
+    claimed by the next worker to start and replayed with its own.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        """
+        Args:
+            directory: Where journal files live
+            max_bytes: Size past which further rows are dropped
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.path = os.path.join(directory, f"journal-{os.getpid()}.jsonl")
+        self.bytes = 0
+        self.dropped = 0
+        self._claimed: List[str] = []
+
+    def claim_orphans(self) -> None:
+        """Take over journals of processes that are no longer running."""
+        os.makedirs(self.directory, exist_ok=True)
+        for path in glob.glob(os.path.join(self.directory, "journal-*.jsonl*")):
+            if path == self.path:
+                continue
+            pid = os.path.basename(path).split("-")[1].split(".")[0]
+            if pid.isdigit() and self._alive(int(pid)):
+                continue
+            claimed = f"{self.path}.{len(self._claimed)}.{os.path.basename(path)}"
+            try:
+                # Atomic, so two starting workers cannot both claim a journal
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            self._claimed.append(claimed)
+        for path in [self.path] + self._claimed:
+            if os.path.exists(path):
+                self.bytes += os.path.getsize(path)
+
+    def append(self, rows: List[TranscriptRow]) -> int:
+        """
+        Add rows to the journal while it has room.
+
+        Args:
+            rows: The rows
+
+        Returns:
+            How many rows were dropped for lack of room
+        """
+        lines = [encode_message(row) + b"\n" for row in rows]
+        kept = []
+        for line in lines:
+            if self.max_bytes and self.bytes + len(line) > self.max_bytes:
+                break
+            kept.append(line)
+            self.bytes += len(line)
+        if kept:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.path, "ab") as f:
+                f.writelines(kept)
+        dropped = len(lines) - len(kept)
+        self.dropped += dropped
+        return dropped
+
+    def pending(self) -> bool:
+        return self.bytes > 0
+
+    def replay(self, backend: TranscriptBackend, batch_rows: int) -> int:
+        """
+        Write journalled rows to the backend, removing each file once written.
+
+        Args:
+            backend: Where to write them
+            batch_rows: Rows per backend call
+
+        Returns:
+            How many rows were written
+
+        Raises:
+            Exception: If the backend failed; files not yet written are kept
+        """
+        written = 0
+        for path in self._claimed + [self.path]:
+            if not os.path.exists(path):
+                continue
+            with open(path, "rb") as f:
+                rows = [decode_message(line) for line in f if line.strip()]
+            for start in range(0, len(rows), batch_rows):
+                backend.write(rows[start:start + batch_rows])
+            size = os.path.getsize(path)
+            os.remove(path)
+            self.bytes = max(0, self.bytes - size)
+            written += len(rows)
+            if path in self._claimed:
+                self._claimed.remove(path)
+        return written
+
+    @staticmethod
+    def _alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+class TranscriptPersister:
+    """
+    Write-behind persistence of chat transcripts.
+
+    Messages added to a history are buffered and written to the transcript
+    backend in batches by a background task, when the buffer reaches the
+    batch size or the flush interval has passed, so chat turns never wait
+    on storage. Backend writes run in a worker thread. While the backend
+    is unavailable, batches go to a bounded local journal, replayed once
+    it is back; past the journal's size limit rows are dropped and counted.
+    """
+
+    def __init__(self):
+        config = get_config()["transcripts"]
+        self.batch_messages: int = config["batch_messages"]
+        self.flush_interval: float = config["flush_interval"]
+        self.max_buffer: int = config["max_buffer_messages"]
+        self.backend = create_transcript_backend(config)
+        self.journal = TranscriptJournal(config["journal_dir"], config["journal_max_bytes"])
+
+        # Buffered rows being extended, by transcript, and finished ones
+        self.buffer: Dict[str, TranscriptRow] = {}
+        self.sealed: List[TranscriptRow] = []
+        self.buffered = 0
+        # Transcripts restarted by a cleared history, by client
+        self.transcript_ids: Dict[str, str] = {}
+        self.stats = {
+            "recorded": 0,
+            "written_rows": 0,
+            "written_messages": 0,
+            "journaled_rows": 0,
+            "replayed_rows": 0,
+            "dropped_messages": 0,
+            "failures": 0
+        }
+        self._flush_times: Deque[float] = deque(maxlen=1000)
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._last_failure: Optional[float] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    async def start(self) -> None:
+        """Claim leftover journals and start the background flusher."""
+        if not self.enabled or self._task is not None:
+            return
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        await asyncio.get_running_loop().run_in_executor(None, self.journal.claim_orphans)
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Stop the flusher and write out everything buffered."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.enabled:
+            await self.flush()
+            await asyncio.get_running_loop().run_in_executor(None, self.backend.close)
+
+    def record(self, client_id: str, position: int, message: Dict[str, Any]) -> None:
+        """
+        Buffer a message for its client's transcript.
+
+        Args:
+            client_id: The client's unique identifier
+            position: The message's position in the client's history
+            message: The message
+        """
+        if not self.enabled:
+            return
+        transcript_id = self.transcript_ids.get(client_id, client_id)
+        row = self.buffer.get(transcript_id)
+        if row is None or row["position"] + len(row["messages"]) != position:
+            if row is not None:
+                # Not contiguous with what is buffered (e.g. a resumed session); keep both as rows
+                self.sealed.append(row)
+            row = self.buffer[transcript_id] = {"transcript_id": transcript_id, "position": position, "messages": []}
+        row["messages"].append(message)
+        self.buffered += 1
+        self.stats["recorded"] += 1
+        if self.max_buffer and self.buffered > self.max_buffer:
+            # Writes are not keeping up; shed the oldest buffered row
+            oldest = self.sealed.pop(0) if self.sealed else self.buffer.pop(next(iter(self.buffer)))
+            self.buffered -= len(oldest["messages"])
+            self.stats["dropped_messages"] += len(oldest["messages"])
+        if self._wake is not None and self.buffered >= self.batch_messages:
+            self._wake.set()
+
+    def restart(self, client_id: str) -> None:
+        """
+        Start a new transcript for a client whose history was cleared.
+
+        Args:
+            client_id: The client's unique identifier
+        """
+        if self.enabled:
+            self.transcript_ids[client_id] = f"{client_id}:{int(time.time() * 1000)}"
+
+    def forget(self, client_id: str) -> None:
+        """
+        Drop per-client state once the client's history is released; buffered messages are still written.
+
+        Args:
+            client_id: The client's unique identifier
+        """
+        self.transcript_ids.pop(client_id, None)
+
+    async def flush(self) -> None:
+        """Write everything buffered now, replaying the journal first if the backend is back."""
+        if not self.enabled:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            rows = self._take_rows()
+            if not rows and not self.journal.pending():
+                return
+            started = time.perf_counter()
+            written = await asyncio.get_running_loop().run_in_executor(None, self._write, rows)
+            if written:
+                self._flush_times.append(time.perf_counter() - started)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get buffer, journal and write counters.
+
+        Returns:
+            Dictionary of gauges and cumulative counters
+        """
+        return {
+            "backend": self.backend.name if self.enabled else None,
+            "buffered_messages": self.buffered,
+            "journal_bytes": self.journal.bytes,
+            "journal_dropped_rows": self.journal.dropped,
+            **self.stats,
+            "flush_ms": percentiles(elapsed * 1000 for elapsed in self._flush_times)
+        }
+
+    def _take_rows(self) -> List[TranscriptRow]:
+        rows = self.sealed + list(self.buffer.values())
+        now = time.time()
+        for row in rows:
+            row["created_at"] = now
+        self.buffer = {}
+        self.sealed = []
+        self.buffered = 0
+        return rows
+
+    def _write(self, rows: List[TranscriptRow]) -> bool:
+        # Runs in a worker thread; the lock keeps flushes one at a time
+        try:
+            if self.journal.pending():
+                self.stats["replayed_rows"] += self.journal.replay(self.backend, max(1, self.batch_messages))
+            if rows:
+                self.backend.write(rows)
+                self.stats["written_rows"] += len(rows)
+                self.stats["written_messages"] += sum(len(row["messages"]) for row in rows)
+            if self._last_failure is not None:
+                print(f"Transcript storage is back; journal replayed ({self.stats['replayed_rows']} rows so far)")
+                self._last_failure = None
+            return True
+        except Exception as e:
+            self.stats["failures"] += 1
+            if self._last_failure is None:
+                print(f"WARNING: Transcript storage unavailable ({str(e)}); journalling batches locally")
+            self._last_failure = time.monotonic()
+        if rows:
+            dropped = self.journal.append(rows)
+            self.stats["journaled_rows"] += len(rows) - dropped
+            if dropped:
+                self.stats["dropped_messages"] += sum(len(row["messages"]) for row in rows[-dropped:])
+        return False
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error flushing transcripts: {str(e)}")
+
+def create_transcript_backend(config: Optional[Dict[str, Any]] = None) -> Optional[TranscriptBackend]:
+    """
+    Build the transcript backend named by the configuration.
+
+    Args:
+        config: The "transcripts" configuration section; read from the environment if omitted
+
+    Returns:
+        The backend, or None if transcripts are not persisted
+    """
+    config = config or get_config()["transcripts"]
+    if config["backend"] == "local":
+        return LocalTranscriptBackend(config["local_path"])
+    if config["backend"] == "supabase":
+        from ..utils.supabase_client import supabase_client
+
+        if supabase_client is not None and supabase_client.is_configured():
+            return SupabaseTranscriptBackend(supabase_client.get_client())
+        print("WARNING: TRANSCRIPT_BACKEND is supabase but Supabase is not configured. Transcripts will not be saved.")
+        return None
+    if config["backend"] != "none":
+        print(f"WARNING: Unknown TRANSCRIPT_BACKEND '{config['backend']}'. Transcripts will not be saved.")
+    return None
+
+# Create a global persister instance
+transcript_persister = TranscriptPersister()
@@ -0,0 +1,117 @@
+# app/services/usage_service.py
+from typing import Dict, List, Any, Deque, Optional
+from collections import deque
+import time
+
+from ..models.usage import TurnUsage
+from ..utils.config_utils import get_config
+from ..utils.stats_utils import percentiles
+
+class UsageService:
+    """
+    Service recording token usage and latency of chat turns.
+
+    Records are kept in a bounded in-memory ring buffer, so the oldest turns
+    fall out as new ones arrive and memory use stays flat.
+    """
+
+    def __init__(self):
+        config = get_config()["usage"]
+        self.records: Deque[TurnUsage] = deque(maxlen=config["buffer_size"])
+
+    def record_turn(
+        self,
+        client_id: Optional[str],
+        model: str,
+        status: str,
+        started: float,
+        first_token: Optional[float],
+        finished: float,
+        usage: Dict[str, Any],
+        stop_reason: Optional[str] = None
+    ) -> TurnUsage:
+        """
+        Record a finished chat turn.
+
+        Args:
+            client_id: The client's unique identifier
+            model: The model used
+            status: "completed", "error" or "cancelled"
+            started: perf_counter() when the call started
+            first_token: perf_counter() at the first text chunk, if any
+            finished: perf_counter() when the stream ended
+            usage: Usage fields from message_start/message_delta events
+            stop_reason: Why generation stopped, if known
+
+        Returns:
+            The stored record
+        """
+        output_tokens = usage.get("output_tokens") or 0
+        tokens_per_second = None
+        if first_token is not None and finished > first_token and output_tokens:
+            tokens_per_second = round(output_tokens / (finished - first_token), 2)
+
+        record = TurnUsage(
+            client_id=client_id or "anonymous",
+            model=model,
+            status=status,
+            started_at=time.time() - (finished - started),
+            ttft_ms=round((first_token - started) * 1000, 2) if first_token is not None else None,
+            total_ms=round((finished - started) * 1000, 2),
+            input_tokens=usage.get("input_tokens") or 0,
+            output_tokens=output_tokens,
+            cache_read_input_tokens=usage.get("cache_read_input_tokens") or 0,
+            cache_creation_input_tokens=usage.get("cache_creation_input_tokens") or 0,
+            tokens_per_second=tokens_per_second,
+            stop_reason=stop_reason
+        )
+        self.records.append(record)
+        return record
+
+    def _summarize(self, records: List[TurnUsage]) -> Dict[str, Any]:
+        statuses: Dict[str, int] = {}
+        for record in records:
+            statuses[record.status] = statuses.get(record.status, 0) + 1
+
+        return {
+            "turns": len(records),
+            "statuses": statuses,
+            "input_tokens": sum(record.input_tokens for record in records),
+            "output_tokens": sum(record.output_tokens for record in records),
+            "ttft_ms": percentiles(r.ttft_ms for r in records if r.ttft_ms is not None),
+            "total_ms": percentiles(r.total_ms for r in records),
+            "tokens_per_second": percentiles(r.tokens_per_second for r in records if r.tokens_per_second is not None),
+            "input_tokens_per_turn": percentiles(r.input_tokens for r in records),
+            "output_tokens_per_turn": percentiles(r.output_tokens for r in records)
+        }
+
+    def get_report(self, client_id: Optional[str] = None, recent: int = 0) -> Dict[str, Any]:
+        """
+        Summarize recorded turns globally and per client.
+
+        Args:
+            client_id: Only report on this client
+            recent: Also return this many of the most recent raw records
+
+        Returns:
+            Dictionary with global and per-client percentiles
+        """
+        records = list(self.records)
+        if client_id:
+            records = [record for record in records if record.client_id == client_id]
+
+        by_client: Dict[str, List[TurnUsage]] = {}
+        for record in records:
+            by_client.setdefault(record.client_id, []).append(record)
+
+        report = {
+            "buffer_size": self.records.maxlen,
+            "global": self._summarize(records),
+            "clients": {cid: self._summarize(client_records) for cid, client_records in by_client.items()}
+        }
+        if recent:
+            report["recent"] = [record.dict() for record in records[-recent:]]
+        return report
+
+# Create a global service instance
+usage_service = UsageService()
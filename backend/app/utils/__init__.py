@@ -1,3 +1,4 @@
 # app/utils/__init__.py
 from .config_utils import get_api_key, get_config, save_example_env_file
-from .file_utils import extract_text_from_docx, process_file_content
\ No newline at end of file
+from .file_utils import extract_text_from_docx, process_file_content
+from .sse_utils import SSEDecoder, SSEEvent
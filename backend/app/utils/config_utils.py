@@ -7,6 +7,21 @@ from typing import Dict, Any, Optional
 # Load environment variables from .env file
 load_dotenv()
 
+# The backend directory, which relative data paths are resolved against
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def resolve_data_path(path: str) -> str:
+    """
+    Resolve a configured data path against the backend directory.
+    
+    Args:
+        path: An absolute path, or one relative to the backend directory
+        
+    Returns:
+        The absolute path, so it does not depend on the working directory
+    """
+    return os.path.join(BACKEND_DIR, path)
+
 def get_api_key(provider: str = "anthropic") -> Optional[str]:
     """
     Get API key for Anthropic Claude from environment variables.
@@ -39,6 +54,103 @@ def get_config() -> Dict[str, Any]:
         },
         "models": {
             "default": "claude-3-7-sonnet-20250219"
+        },
+        "anthropic": {
+            "base_url": os.environ.get("ANTHROPIC_BASE_URL", "https://api.anthropic.com")
+        },
+        "http_client": {
+            "http2": os.environ.get("HTTP_CLIENT_HTTP2", "True").lower() in ("true", "1", "t"),
+            "max_connections": int(os.environ.get("HTTP_CLIENT_MAX_CONNECTIONS", "100")),
+            "max_keepalive_connections": int(os.environ.get("HTTP_CLIENT_MAX_KEEPALIVE", "20")),
+            "keepalive_expiry": float(os.environ.get("HTTP_CLIENT_KEEPALIVE_EXPIRY", "30.0")),
+            "connect_timeout": float(os.environ.get("HTTP_CLIENT_CONNECT_TIMEOUT", "10.0")),
+            "read_timeout": float(os.environ.get("HTTP_CLIENT_READ_TIMEOUT", "60.0")),
+            "warmup": os.environ.get("HTTP_CLIENT_WARMUP", "True").lower() in ("true", "1", "t")
+        },
+        "context": {
+            "token_budget": int(os.environ.get("CONTEXT_TOKEN_BUDGET", "100000")),
+            "chars_per_token": float(os.environ.get("CONTEXT_CHARS_PER_TOKEN", "4.0")),
+            "trim_block_messages": int(os.environ.get("CONTEXT_TRIM_BLOCK_MESSAGES", "40"))
+        },
+        "prompt_cache": {
+            "enabled": os.environ.get("PROMPT_CACHE_ENABLED", "True").lower() in ("true", "1", "t")
+        },
+        "scheduler": {
+            "max_in_flight": int(os.environ.get("LLM_MAX_IN_FLIGHT", "16")),
+            "max_retries": int(os.environ.get("LLM_MAX_RETRIES", "3")),
+            "backoff_base": float(os.environ.get("LLM_BACKOFF_BASE", "0.5")),
+            "backoff_max": float(os.environ.get("LLM_BACKOFF_MAX", "20.0"))
+        },
+        "usage": {
+            "buffer_size": int(os.environ.get("USAGE_BUFFER_SIZE", "5000"))
+        },
+        "streaming": {
+            "flush_interval_ms": float(os.environ.get("STREAM_FLUSH_INTERVAL_MS", "30")),
+            "max_flush_interval_ms": float(os.environ.get("STREAM_MAX_FLUSH_INTERVAL_MS", "500")),
+            "flush_max_bytes": int(os.environ.get("STREAM_FLUSH_MAX_BYTES", "2048"))
+        },
+        "outbound": {
+            "max_frames": int(os.environ.get("WS_OUTBOUND_QUEUE_SIZE", "256")),
+            "policy": os.environ.get("WS_SLOW_CONSUMER_POLICY", "coalesce").lower(),
+            "send_timeout": float(os.environ.get("WS_SEND_TIMEOUT", "30")),
+            "drain_timeout": float(os.environ.get("WS_CLOSE_DRAIN_TIMEOUT", "2"))
+        },
+        "websocket": {
+            "max_concurrent_requests": int(os.environ.get("WS_MAX_CONCURRENT_REQUESTS", "4")),
+            "max_frame_bytes": int(os.environ.get("WS_MAX_FRAME_BYTES", str(10 * 1024 * 1024))),
+            "ping_interval": float(os.environ.get("WS_PING_INTERVAL", "20")),
+            "ping_timeout": float(os.environ.get("WS_PING_TIMEOUT", "20")),
+            "idle_timeout": float(os.environ.get("WS_IDLE_TIMEOUT", "0")),
+            "history_retention": float(os.environ.get("WS_HISTORY_RETENTION", "300")),
+            "replay_buffer_frames": int(os.environ.get("WS_REPLAY_BUFFER_FRAMES", "2048")),
+            "replay_ttl": float(os.environ.get("WS_REPLAY_TTL", "120"))
+        },
+        "uploads": {
+            "max_bytes": int(os.environ.get("UPLOAD_MAX_BYTES", str(64 * 1024 * 1024))),
+            "spool_bytes": int(os.environ.get("UPLOAD_SPOOL_BYTES", str(1024 * 1024))),
+            "chunk_bytes": int(os.environ.get("UPLOAD_CHUNK_BYTES", str(256 * 1024))),
+            "max_concurrent": int(os.environ.get("UPLOAD_MAX_CONCURRENT", "4"))
+        },
+        "state": {
+            "backend": os.environ.get("STATE_BACKEND", "memory").lower(),
+            "redis_url": os.environ.get("REDIS_URL", "redis://127.0.0.1:6379/0"),
+            "key_prefix": os.environ.get("STATE_KEY_PREFIX", "neonchat"),
+            "snapshot_path": os.environ.get("STATE_SNAPSHOT_PATH", "")
+        },
+        "admission": {
+            "enabled": os.environ.get("ADMISSION_ENABLED", "True").lower() in ("true", "1", "t"),
+            "max_connections": int(os.environ.get("ADMISSION_MAX_CONNECTIONS", "10000")),
+            "max_turns": int(os.environ.get("ADMISSION_MAX_TURNS", "256")),
+            "max_queue_depth": int(os.environ.get("ADMISSION_MAX_QUEUE_DEPTH", "64")),
+            "max_pending": int(os.environ.get("ADMISSION_MAX_PENDING", "8")),
+            "max_loop_lag_ms": float(os.environ.get("ADMISSION_MAX_LOOP_LAG_MS", "250")),
+            "retry_after": float(os.environ.get("ADMISSION_RETRY_AFTER", "2"))
+        },
+        "drain": {
+            "on_signal": os.environ.get("DRAIN_ON_SIGNAL", "True").lower() in ("true", "1", "t"),
+            "timeout": float(os.environ.get("DRAIN_TIMEOUT", "30")),
+            "retry_after": float(os.environ.get("DRAIN_RETRY_AFTER", "1")),
+            "operator_token": os.environ.get("DRAIN_OPERATOR_TOKEN", "")
+        },
+        "history": {
+            "memory_budget_bytes": int(os.environ.get("HISTORY_MEMORY_BUDGET_BYTES", str(256 * 1024 * 1024))),
+            "client_budget_bytes": int(os.environ.get("HISTORY_CLIENT_BUDGET_BYTES", str(8 * 1024 * 1024))),
+            "spill_dir": os.environ.get("HISTORY_SPILL_DIR", "")
+        },
+        "transcripts": {
+            "backend": os.environ.get("TRANSCRIPT_BACKEND", "local").lower(),
+            "local_path": resolve_data_path(os.environ.get("TRANSCRIPT_LOCAL_PATH", "data/transcripts.sqlite")),
+            "batch_messages": int(os.environ.get("TRANSCRIPT_BATCH_MESSAGES", "200")),
+            "flush_interval": float(os.environ.get("TRANSCRIPT_FLUSH_INTERVAL", "2")),
+            "max_buffer_messages": int(os.environ.get("TRANSCRIPT_MAX_BUFFER_MESSAGES", "50000")),
+            "journal_dir": resolve_data_path(os.environ.get("TRANSCRIPT_JOURNAL_DIR", "data/transcript-journal")),
+            "journal_max_bytes": int(os.environ.get("TRANSCRIPT_JOURNAL_MAX_BYTES", str(64 * 1024 * 1024)))
+        },
+        "attachments": {
+            "enabled": os.environ.get("ATTACHMENT_STORE_ENABLED", "True").lower() in ("true", "1", "t"),
+            "dir": resolve_data_path(os.environ.get("ATTACHMENT_STORE_DIR", "data/attachments")),
+            "max_bytes": int(os.environ.get("ATTACHMENT_MAX_BYTES", str(1024 * 1024 * 1024))),
+            "evict_after": float(os.environ.get("ATTACHMENT_EVICT_AFTER", "3600"))
         }
     }
     
@@ -58,6 +170,132 @@ ANTHROPIC_API_KEY=your_anthropic_api_key_here
 HOST=0.0.0.0
 PORT=8000
 DEBUG=False
+
+# Upstream HTTP client (shared, pooled connection to the Anthropic API)
+# Use http://127.0.0.1:8089 with `python -m benchmarks.stub_server` for offline testing
+ANTHROPIC_BASE_URL=https://api.anthropic.com
+HTTP_CLIENT_HTTP2=True
+HTTP_CLIENT_MAX_CONNECTIONS=100
+HTTP_CLIENT_MAX_KEEPALIVE=20
+HTTP_CLIENT_KEEPALIVE_EXPIRY=30.0
+HTTP_CLIENT_CONNECT_TIMEOUT=10.0
+HTTP_CLIENT_READ_TIMEOUT=60.0
+HTTP_CLIENT_WARMUP=True
+
+# Conversation context window (prompt token budget per chat turn). Old messages are dropped
+# in blocks of CONTEXT_TRIM_BLOCK_MESSAGES, so the prompt prefix stays cacheable between cuts
+CONTEXT_TOKEN_BUDGET=100000
+CONTEXT_CHARS_PER_TOKEN=4.0
+CONTEXT_TRIM_BLOCK_MESSAGES=40
+
+# Prompt caching of the stable conversation prefix
+PROMPT_CACHE_ENABLED=True
+
+# Outbound LLM scheduler (global concurrency cap and throttling backoff)
+LLM_MAX_IN_FLIGHT=16
+LLM_MAX_RETRIES=3
+LLM_BACKOFF_BASE=0.5
+LLM_BACKOFF_MAX=20.0
+
+# Per-turn token usage and latency records kept in memory
+USAGE_BUFFER_SIZE=5000
+
+# Batching of streamed text into WebSocket frames (clients may request their own interval)
+STREAM_FLUSH_INTERVAL_MS=30
+STREAM_MAX_FLUSH_INTERVAL_MS=500
+STREAM_FLUSH_MAX_BYTES=2048
+
+# Per-connection outbound queue; slow-consumer policy is coalesce, drop or disconnect
+WS_OUTBOUND_QUEUE_SIZE=256
+WS_SLOW_CONSUMER_POLICY=coalesce
+WS_SEND_TIMEOUT=30
+WS_CLOSE_DRAIN_TIMEOUT=2
+
+# Requests a single WebSocket connection may run at once (tagged with request_id)
+WS_MAX_CONCURRENT_REQUESTS=4
+# Largest inbound frame accepted (base64 uploads included); larger frames are rejected unparsed
+WS_MAX_FRAME_BYTES=10485760
+
+# Heartbeat: ping quiet connections every WS_PING_INTERVAL seconds and close them if no
+# reply arrives within WS_PING_TIMEOUT. WS_IDLE_TIMEOUT closes connections without user
+# messages for that long (0 = never). Histories of disconnected clients are released
+# after WS_HISTORY_RETENTION seconds.
+WS_PING_INTERVAL=20
+WS_PING_TIMEOUT=20
+WS_IDLE_TIMEOUT=0
+WS_HISTORY_RETENTION=300
+
+# Chunked WebSocket uploads: size cap, in-memory spool before rolling to disk,
+# advertised chunk size and uploads in progress per connection
+UPLOAD_MAX_BYTES=67108864
+UPLOAD_SPOOL_BYTES=1048576
+UPLOAD_CHUNK_BYTES=262144
+UPLOAD_MAX_CONCURRENT=4
+
+# Resumable sessions: a client reconnecting within WS_HISTORY_RETENTION seconds with its
+# session token gets the request frames it missed from a replay buffer holding the last
+# WS_REPLAY_BUFFER_FRAMES frames of at most WS_REPLAY_TTL seconds
+WS_REPLAY_BUFFER_FRAMES=2048
+WS_REPLAY_TTL=120
+
+# Session state shared by workers: memory (single worker) or redis (any Redis-protocol
+# server, through the redis package; needed for several uvicorn workers or nodes)
+STATE_BACKEND=memory
+REDIS_URL=redis://127.0.0.1:6379/0
+STATE_KEY_PREFIX=neonchat
+# With the memory backend, sessions persisted while draining are written to this file and
+# restored on the next start, so clients resume across a restart (empty disables)
+STATE_SNAPSHOT_PATH=
+
+# Admission control: reject new connections and chat turns with a "busy, retry after" frame
+# once a limit is reached (0 disables a limit). ADMISSION_MAX_TURNS counts turns in flight on
+# this worker, ADMISSION_MAX_QUEUE_DEPTH callers waiting for an upstream slot and
+# ADMISSION_MAX_PENDING requests queued on one connection
+ADMISSION_ENABLED=True
+ADMISSION_MAX_CONNECTIONS=10000
+ADMISSION_MAX_TURNS=256
+ADMISSION_MAX_QUEUE_DEPTH=64
+ADMISSION_MAX_PENDING=8
+ADMISSION_MAX_LOOP_LAG_MS=250
+ADMISSION_RETRY_AFTER=2
+
+# Graceful drain for restarts: on SIGTERM (or POST /api/admin/drain) stop accepting work, let
+# responses finish for up to DRAIN_TIMEOUT seconds, then tell clients to reconnect after about
+# DRAIN_RETRY_AFTER seconds. Keep DRAIN_TIMEOUT below the process manager's kill timeout.
+# POST /api/admin/drain needs DRAIN_OPERATOR_TOKEN in an X-Operator-Token header (empty disables it)
+DRAIN_ON_SIGNAL=True
+DRAIN_TIMEOUT=30
+DRAIN_RETRY_AFTER=1
+DRAIN_OPERATOR_TOKEN=
+
+# Message history memory: past HISTORY_MEMORY_BUDGET_BYTES the least recently used histories
+# are evicted to a local SQLite file in HISTORY_SPILL_DIR (empty for the system temp directory)
+# and read back on demand; a history over HISTORY_CLIENT_BUDGET_BYTES keeps only its newest
+# messages in memory (0 disables a budget)
+HISTORY_MEMORY_BUDGET_BYTES=268435456
+HISTORY_CLIENT_BUDGET_BYTES=8388608
+HISTORY_SPILL_DIR=
+
+# Chat transcripts are written behind the conversation in batches of TRANSCRIPT_BATCH_MESSAGES
+# messages or every TRANSCRIPT_FLUSH_INTERVAL seconds: none, local (SQLite file at
+# TRANSCRIPT_LOCAL_PATH) or supabase (the chat_transcripts table). While storage is down,
+# batches go to a local journal in TRANSCRIPT_JOURNAL_DIR of at most TRANSCRIPT_JOURNAL_MAX_BYTES.
+# Relative paths are resolved against the backend directory
+TRANSCRIPT_BACKEND=local
+TRANSCRIPT_LOCAL_PATH=data/transcripts.sqlite
+TRANSCRIPT_BATCH_MESSAGES=200
+TRANSCRIPT_FLUSH_INTERVAL=2
+TRANSCRIPT_MAX_BUFFER_MESSAGES=50000
+TRANSCRIPT_JOURNAL_DIR=data/transcript-journal
+TRANSCRIPT_JOURNAL_MAX_BYTES=67108864
+
+# Chat images and files are stored once per content hash in ATTACHMENT_STORE_DIR (relative to
+# the backend directory) and histories hold only the hash. Past ATTACHMENT_MAX_BYTES, attachments no history references and none
+# used in the last ATTACHMENT_EVICT_AFTER seconds are deleted, least recently used first
+ATTACHMENT_STORE_ENABLED=True
+ATTACHMENT_STORE_DIR=data/attachments
+ATTACHMENT_MAX_BYTES=1073741824
+ATTACHMENT_EVICT_AFTER=3600
 """
     
     with open(path, "w") as f:
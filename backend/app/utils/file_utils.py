@@ -2,7 +2,8 @@
 import os
 import base64
 import io
-from typing import Optional, Tuple
+import mmap
+from typing import Optional, Tuple, BinaryIO, Union
 try:
     import docx
 except ImportError:
@@ -53,17 +54,24 @@ def extract_text_from_docx(docx_content: str) -> str:
     except Exception as e:
         return f"Error extracting text from DOCX: {str(e)}"
 
-def process_file_content(file_content: str, file_type: str) -> Tuple[bool, str]:
+def process_file_content(file_content: Union[str, bytes, mmap.mmap], file_type: str) -> Tuple[bool, str]:
     """
     Process file content based on file type.
     
     Args:
-        file_content: Base64 encoded file content
+        file_content: Base64 encoded file content, or the file's bytes, such
+            as a memory-mapped attachment from the attachment store
         file_type: MIME type of the file
         
     Returns:
         Tuple of (success, text)
     """
+    if isinstance(file_content, mmap.mmap):
+        # Read in place: a memory map is file-like
+        return process_file_upload(file_content, file_type)
+    if isinstance(file_content, (bytes, bytearray)):
+        return process_file_upload(io.BytesIO(file_content), file_type)
+    
     if file_type.startswith('application/vnd.openxmlformats-officedocument.wordprocessingml.document'):
         # DOCX file
         text = extract_text_from_docx(file_content)
@@ -85,3 +93,29 @@ def process_file_content(file_content: str, file_type: str) -> Tuple[bool, str]:
             return (False, f"Error extracting text from text file: {str(e)}")
     
     return (False, f"Unsupported file type: {file_type}")
+
+def process_file_upload(file: BinaryIO, file_type: str) -> Tuple[bool, str]:
+    """
+    Process an uploaded file read from a file handle.
+    
+    Args:
+        file: Binary file handle holding the upload
+        file_type: MIME type of the file
+        
+    Returns:
+        Tuple of (success, text)
+    """
+    try:
+        file.seek(0)
+        if file_type.startswith('application/vnd.openxmlformats-officedocument.wordprocessingml.document'):
+            # DOCX file
+            doc = docx.Document(file)
+            text = "\n".join([paragraph.text for paragraph in doc.paragraphs if paragraph.text.strip()])
+            return (True, text)
+        elif file_type.startswith('text/'):
+            # Text file
+            return (True, file.read().decode('utf-8'))
+    except Exception as e:
+        return (False, f"Error extracting text from file: {str(e)}")
+    
+    return (False, f"Unsupported file type: {file_type}")
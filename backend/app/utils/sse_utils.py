@@ -0,0 +1,99 @@
+# app/utils/sse_utils.py
+import json
+from typing import Any, List, NamedTuple, Optional
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+class SSEEvent(NamedTuple):
+    """A decoded Server-Sent Event."""
+    event: str
+    data: Any
+
+class SSEDecoder:
+    """
+    Incremental Server-Sent Events decoder working on raw byte chunks.
+
+    Network chunks can split events (and UTF-8 sequences) anywhere, so
+    partial data is buffered as bytes until a blank line ends the event.
+    JSON payloads are decoded with orjson when it is installed.
+    """
+
+    def __init__(self):
+        self._buffer = b""
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        """
+        Feed a chunk of the stream and return the events it completes.
+
+        Args:
+            chunk: Raw bytes from the response body
+
+        Returns:
+            List of complete events, in stream order
+        """
+        buffer = self._buffer + chunk if self._buffer else chunk
+
+        held = b""
+        if b"\r" in buffer:
+            # A trailing CR may be the first half of a CRLF split across chunks
+            if buffer.endswith(b"\r"):
+                buffer, held = buffer[:-1], b"\r"
+            buffer = buffer.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+
+        events = []
+        start = 0
+        while True:
+            end = buffer.find(b"\n\n", start)
+            if end == -1:
+                break
+            event = self._parse_block(buffer[start:end])
+            if event is not None:
+                events.append(event)
+            start = end + 2
+
+        self._buffer = buffer[start:] + held
+        return events
+
+    def flush(self) -> List[SSEEvent]:
+        """
+        Decode whatever is left in the buffer at the end of the stream.
+
+        Returns:
+            The final event, if the stream did not end with a blank line
+        """
+        buffer, self._buffer = self._buffer.replace(b"\r", b"\n").strip(b"\n"), b""
+        if not buffer:
+            return []
+        event = self._parse_block(buffer)
+        return [event] if event is not None else []
+
+    def _parse_block(self, block: bytes) -> Optional[SSEEvent]:
+        event_type = None
+        data_lines = []
+        for line in block.split(b"\n"):
+            if line.startswith(b"data:"):
+                value = line[5:]
+                data_lines.append(value[1:] if value.startswith(b" ") else value)
+            elif line.startswith(b"event:"):
+                event_type = line[6:].strip().decode("utf-8")
+            # id:, retry: and ":" comment lines are not used by the Claude API
+
+        if not data_lines:
+            return None
+
+        data = data_lines[0] if len(data_lines) == 1 else b"\n".join(data_lines)
+        if data == b"[DONE]":
+            return SSEEvent(event_type or "done", None)
+
+        try:
+            payload = _json_loads(data)
+        except ValueError:
+            return None  # Skip malformed JSON
+
+        if event_type is None and isinstance(payload, dict):
+            event_type = payload.get("type", "message")
+        return SSEEvent(event_type or "message", payload)
@@ -0,0 +1,24 @@
+# app/utils/stats_utils.py
+from typing import Dict, Iterable, Sequence
+
+def percentiles(values: Iterable[float], points: Sequence[int] = (50, 95, 99)) -> Dict[str, float]:
+    """
+    Compute nearest-rank percentiles of a set of samples.
+
+    Args:
+        values: The samples
+        points: Percentiles to compute (0-100)
+
+    Returns:
+        Dictionary like {"p50": ..., "p95": ..., "max": ...}, zeros when empty
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return {**{f"p{point}": 0.0 for point in points}, "max": 0.0}
+
+    result = {}
+    for point in points:
+        rank = max(int(len(ordered) * point / 100 + 0.5) - 1, 0)
+        result[f"p{point}"] = round(ordered[min(rank, len(ordered) - 1)], 2)
+    result["max"] = round(ordered[-1], 2)
+    return result
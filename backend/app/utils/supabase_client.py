@@ -94,21 +94,27 @@ CREATE TABLE IF NOT EXISTS daily_metrics (
     UNIQUE(user_id, date)
 );
 
--- Chat transcripts table for journaling sessions
+-- Chat transcripts table for journaling sessions; the server writes each conversation
+-- as rows of consecutive messages keyed by transcript and position of the first message
 CREATE TABLE IF NOT EXISTS chat_transcripts (
     id UUID DEFAULT uuid_generate_v4() PRIMARY KEY,
     journal_entry_id UUID REFERENCES journal_entries(id) ON DELETE CASCADE,
     user_id UUID REFERENCES profiles(id) ON DELETE CASCADE,
+    transcript_id TEXT,
+    position INTEGER DEFAULT 0,
     messages JSONB NOT NULL DEFAULT '[]'::jsonb,
     session_duration INTEGER, -- in minutes
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
+ALTER TABLE chat_transcripts ADD COLUMN IF NOT EXISTS transcript_id TEXT;
+ALTER TABLE chat_transcripts ADD COLUMN IF NOT EXISTS position INTEGER DEFAULT 0;
 
 -- Indexes for performance
 CREATE INDEX idx_journal_entries_user_id ON journal_entries(user_id);
 CREATE INDEX idx_journal_entries_entry_date ON journal_entries(entry_date);
 CREATE INDEX idx_daily_metrics_user_id ON daily_metrics(user_id);
 CREATE INDEX idx_daily_metrics_date ON daily_metrics(date);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_chat_transcripts_position ON chat_transcripts(transcript_id, position);
 
 -- Row Level Security (RLS) policies
 ALTER TABLE profiles ENABLE ROW LEVEL SECURITY;
@@ -0,0 +1,3 @@
+# benchmarks/__init__.py
+# Offline performance benchmarks for the NeonChat backend.
+# Run from the backend directory, e.g. `python -m benchmarks.bench_connection_pool`
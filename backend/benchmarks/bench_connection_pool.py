@@ -0,0 +1,76 @@
+# benchmarks/bench_connection_pool.py
+"""
+Time-to-first-token with and without the pooled ApiService client.
+
+Runs sequential chat turns against the local stub server. "unpooled" leaves the
+service un-started, so every turn builds its own AsyncClient (the old behaviour);
+"pooled" calls startup() first so turns share one warmed-up connection pool.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_connection_pool --turns 200
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+from app.services.api_service import ApiService
+from .stub_server import StubServer
+
+async def run_turns(service: ApiService, turns: int) -> List[float]:
+    """Run chat turns and return time-to-first-token samples in milliseconds."""
+    samples = []
+    for _ in range(turns):
+        start = time.perf_counter()
+        first_token = None
+        stream = service.execute_claude_call_streaming([], "Hello")
+        try:
+            async for chunk in stream:
+                if first_token is None and chunk.get("type") == "text_chunk":
+                    first_token = time.perf_counter()
+                if chunk.get("done"):
+                    break
+        finally:
+            await stream.aclose()
+        if first_token is not None:
+            samples.append((first_token - start) * 1000)
+    return samples
+
+def summarize(label: str, samples: List[float]) -> None:
+    ordered = sorted(samples)
+    p95 = ordered[int(len(ordered) * 0.95) - 1] if ordered else 0.0
+    print(f"{label:>9}: n={len(samples)} mean={statistics.mean(samples):.3f}ms "
+          f"p50={statistics.median(samples):.3f}ms p95={p95:.3f}ms")
+
+def make_service(base_url: str) -> ApiService:
+    service = ApiService()
+    service.anthropic_api_key = "stub-key"
+    service.base_url = base_url
+    return service
+
+async def main(turns: int) -> None:
+    server = StubServer()
+    await server.start()
+    try:
+        unpooled = make_service(server.base_url)
+        summarize("unpooled", await run_turns(unpooled, turns))
+        unpooled_connections = server.connections_opened
+
+        pooled = make_service(server.base_url)
+        await pooled.startup()
+        try:
+            summarize("pooled", await run_turns(pooled, turns))
+        finally:
+            await pooled.shutdown()
+
+        print(f"connections opened: unpooled={unpooled_connections} "
+              f"pooled={server.connections_opened - unpooled_connections}")
+    finally:
+        await server.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--turns", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.turns))
@@ -0,0 +1,150 @@
+# benchmarks/bench_history_memory.py
+"""
+Message history memory under many sessions, with and without budgets.
+
+Simulates a large number of sessions (100k by default) in MessageService:
+every session gets a few opening turns, a small share of them with a
+base64 attachment inlined as chat history does, then a stream of turns
+goes to sessions picked with a skewed (Zipf-like) popularity, so a hot set
+stays in memory and the long tail is evicted and read back. Each turn reads
+the history as a handler does and appends a user and an assistant message.
+
+Each memory budget runs in a fresh process so RSS is comparable; 0 means
+unbounded (every history stays in memory, the behaviour before budgets). At the end every sampled
+session's history is checked against the number of messages it was sent.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_history_memory --sessions 100000 --budgets 0,64,16
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_one(args: argparse.Namespace) -> Dict[str, Any]:
+    """Run the workload in this process with the budget from the environment."""
+    from app.services.message_service import message_service
+    from app.utils.stats_utils import percentiles
+
+    rng = random.Random(args.seed)
+    filler = "the neon grid journal today feeling calm focus wellbeing sleep energy reflect ".split()
+    attachment = "data:text/plain;base64," + "QUJD" * (args.attachment_kb * 256)
+    counts = [0] * args.sessions
+    # A pool of texts, so generating them does not dominate the timings; each message
+    # gets a unique suffix so histories do not share string objects as real ones would not
+    questions = [" ".join(rng.choice(filler) for _ in range(30)) for _ in range(500)]
+    answers = [" ".join(rng.choice(filler) for _ in range(120)) for _ in range(500)]
+
+    def turn(index: int) -> None:
+        client_id = f"session-{index}"
+        message_service.get_message_history(client_id)
+        if rng.random() < args.attachment_rate:
+            message_service.add_message(client_id, message_service.create_user_message(attachment, "file"), mirror=False)
+        else:
+            message_service.add_message(client_id, message_service.create_user_message(f"{rng.choice(questions)} #{counts[index]}"), mirror=False)
+        message_service.add_message(client_id, message_service.create_assistant_message(f"{rng.choice(answers)} #{counts[index]}"), mirror=False)
+        counts[index] += 2
+
+    baseline = rss_mb()
+    started = time.perf_counter()
+    for index in range(args.sessions):
+        for _ in range(args.opening_turns):
+            turn(index)
+    load_seconds = time.perf_counter() - started
+    after_load = rss_mb()
+
+    # Skewed popularity: a few sessions are hot, most are rarely revisited
+    weights = [1.0 / (rank + 1) ** args.skew for rank in range(args.sessions)]
+    picks = rng.choices(range(args.sessions), weights=weights, k=args.turns)
+    turn_times = []
+    started = time.perf_counter()
+    for index in picks:
+        turn_started = time.perf_counter()
+        turn(index)
+        turn_times.append((time.perf_counter() - turn_started) * 1000)
+    turns_seconds = time.perf_counter() - started
+
+    mismatches = 0
+    for index in rng.sample(range(args.sessions), min(args.verify, args.sessions)):
+        if len(message_service.get_message_history(f"session-{index}")) != counts[index]:
+            mismatches += 1
+
+    stats = message_service.get_history_stats()
+    message_service.close()
+    return {
+        "budget_mb": message_service.memory_budget / (1024 * 1024),
+        "rss_baseline_mb": round(baseline, 1),
+        "rss_after_load_mb": round(after_load, 1),
+        "rss_end_mb": round(rss_mb(), 1),
+        "load_sessions_per_s": round(args.sessions / load_seconds),
+        "turns_per_s": round(args.turns / turns_seconds),
+        "turn_ms": percentiles(turn_times),
+        "resident_mb": round(stats["resident_bytes"] / (1024 * 1024), 1),
+        "disk_mb": round(stats["disk_bytes"] / (1024 * 1024), 1),
+        "evictions": stats["evictions"],
+        "partial_spills": stats["partial_spills"],
+        "reloads": stats["reloads"],
+        "reload_ms": stats["reload_ms"],
+        "mismatches": mismatches
+    }
+
+def main(args: argparse.Namespace) -> None:
+    print(f"{args.sessions} sessions x {args.opening_turns} opening turns, then {args.turns} skewed turns "
+          f"({args.attachment_rate:.0%} with a {args.attachment_kb} KB attachment)")
+    for budget in args.budgets.split(","):
+        env = {
+            **os.environ,
+            "HISTORY_MEMORY_BUDGET_BYTES": str(int(float(budget) * 1024 * 1024)),
+            # The unbounded baseline has no per-client budget either
+            "HISTORY_CLIENT_BUDGET_BYTES": str(args.client_budget_kb * 1024 if float(budget) else 0),
+            "HISTORY_SPILL_DIR": args.spill_dir or tempfile.gettempdir()
+        }
+        child = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_history_memory", "--child", *sys.argv[1:]],
+            env=env, capture_output=True, text=True
+        )
+        if child.returncode != 0:
+            print(child.stderr)
+            raise SystemExit(f"Run with budget {budget} MB failed")
+        result = json.loads(child.stdout.strip().splitlines()[-1])
+        label = "unbounded" if not float(budget) else f"{budget} MB"
+        print(f"budget={label:>9}: rss after load={result['rss_after_load_mb']}MB end={result['rss_end_mb']}MB "
+              f"resident={result['resident_mb']}MB disk={result['disk_mb']}MB "
+              f"load={result['load_sessions_per_s']} sessions/s turns={result['turns_per_s']}/s "
+              f"turn p50/p99={result['turn_ms']['p50']}/{result['turn_ms']['p99']}ms")
+        print(f"{'':>17}evictions={result['evictions']} partial_spills={result['partial_spills']} "
+              f"reloads={result['reloads']} reload p50/p95/p99={result['reload_ms']['p50']}/"
+              f"{result['reload_ms']['p95']}/{result['reload_ms']['p99']}ms mismatches={result['mismatches']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sessions", type=int, default=100000)
+    parser.add_argument("--opening-turns", type=int, default=2)
+    parser.add_argument("--turns", type=int, default=50000, help="Turns after the opening ones")
+    parser.add_argument("--skew", type=float, default=0.8, help="Zipf exponent of session popularity")
+    parser.add_argument("--attachment-rate", type=float, default=0.01)
+    parser.add_argument("--attachment-kb", type=int, default=32)
+    parser.add_argument("--budgets", default="0,64,16", help="Comma-separated global budgets in MB, 0 for unbounded")
+    parser.add_argument("--client-budget-kb", type=int, default=256)
+    parser.add_argument("--spill-dir", default="")
+    parser.add_argument("--verify", type=int, default=2000, help="Sessions whose history is checked at the end")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parsed = parser.parse_args()
+    if parsed.child:
+        print(json.dumps(run_one(parsed)))
+    else:
+        main(parsed)
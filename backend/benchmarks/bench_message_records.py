@@ -0,0 +1,107 @@
+# benchmarks/bench_message_records.py
+"""
+Memory per history message and allocations per chat turn.
+
+Builds one long conversation (1,000 turns by default) two ways and
+measures it with tracemalloc:
+
+  dicts    messages as plain dicts with an ISO timestamp string, and the
+           handler path copying the history each turn (history[:-1], then
+           the pinned/turn lists of the context window), as before
+           MessageRecord and HistoryView.
+  records  MessageService as it is: slotted MessageRecords, history views
+           and no copies when the whole history fits the context window.
+
+Message texts are generated before measuring, so "bytes per message" is
+the cost of holding a message beyond its text. "Per-turn allocations" is
+the peak of memory allocated while handling the last turn (add the user
+message, get the history, fit it to the context window, add the reply),
+and how much of it the turn keeps.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_message_records --turns 1000
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Tuple
+
+from app.services.context_service import context_service
+from app.services.message_service import MessageService
+
+MODEL = "claude-3-7-sonnet-20250219"
+
+def build_texts(turns: int, seed: int) -> List[Tuple[str, str]]:
+    rng = random.Random(seed)
+    words = "the neon grid journal today feeling calm focus wellbeing sleep energy reflect".split()
+    return [
+        (" ".join(rng.choice(words) for _ in range(30)), " ".join(rng.choice(words) for _ in range(120)))
+        for _ in range(turns)
+    ]
+
+def dict_turn(history: List[Dict[str, Any]], question: str, answer: str) -> None:
+    history.append({'role': 'user', 'content': question, 'type': 'text', 'timestamp': datetime.now().isoformat()})
+    previous = history[:-1]
+    # fit_history also split every history into pinned and turn lists and copied them into its result
+    turns = [msg for msg in previous if not context_service.is_pinned(msg)]
+    fitted, _ = context_service.fit_history(previous, history[-1])
+    fitted = list(fitted)
+    history.append({
+        'role': 'assistant', 'content': answer, 'model': MODEL, 'type': 'text',
+        'timestamp': datetime.now().isoformat()
+    })
+
+def record_turn(service: MessageService, question: str, answer: str) -> None:
+    service.add_message("bench", service.create_user_message(question), mirror=False)
+    history = service.get_message_history("bench")
+    context_service.fit_history(history[:-1], history[-1])
+    service.add_message("bench", service.create_assistant_message(answer, model=MODEL), mirror=False)
+
+def measure(name: str, turn: Callable[[str, str], None], texts: List[Tuple[str, str]]) -> Dict[str, float]:
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    started = time.perf_counter()
+    for question, answer in texts[:-1]:
+        turn(question, answer)
+    elapsed = time.perf_counter() - started
+    held, _ = tracemalloc.get_traced_memory()
+
+    # The last turn on its own: peak allocated while it ran, and what it kept
+    tracemalloc.reset_peak()
+    turn(*texts[-1])
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    messages = (len(texts) - 1) * 2
+    return {
+        "bytes_per_message": (held - before) / messages,
+        "turn_peak_bytes": peak - held,
+        "turn_kept_bytes": after - held,
+        "turn_us": elapsed / (len(texts) - 1) * 1e6
+    }
+
+def main(args: argparse.Namespace) -> None:
+    texts = build_texts(args.turns, args.seed)
+    history: List[Dict[str, Any]] = []
+    service = MessageService()
+    results = {
+        "dicts": measure("dicts", lambda question, answer: dict_turn(history, question, answer), texts),
+        "records": measure("records", lambda question, answer: record_turn(service, question, answer), texts)
+    }
+    assert len(service.get_message_history("bench")) == len(history) == args.turns * 2
+    service.close()
+
+    print(f"{args.turns}-turn conversation ({args.turns * 2} messages), texts excluded:")
+    for name, result in results.items():
+        print(f"  {name:>8}: {result['bytes_per_message']:7.1f} B/message  "
+              f"last turn allocated {result['turn_peak_bytes'] / 1024:8.1f} KB peak, "
+              f"kept {result['turn_kept_bytes'] / 1024:6.1f} KB  "
+              f"({result['turn_us']:.0f}us/turn under tracemalloc)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--turns", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    main(parser.parse_args())
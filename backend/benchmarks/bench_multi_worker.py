@@ -0,0 +1,205 @@
+# benchmarks/bench_multi_worker.py
+"""
+Concurrent WebSocket sessions across uvicorn workers sharing session state.
+
+For each worker count, starts `uvicorn main:app --workers N` with the redis
+state backend pointed at the local RESP stand-in and the Claude API pointed
+at the streaming stub, then runs sessions-per-worker x N concurrent chat
+sessions for a fixed time (weak scaling: the load grows with the workers).
+Linear scaling shows as requests/s growing with N at flat latency, i.e. an
+efficiency near 1.0.
+
+Some requests are interrupted mid-stream: the client disconnects and
+resumes with its session token on whichever worker the kernel picks, and
+the response must still arrive complete and in order. Those checks run on
+any machine; the throughput numbers need at least one core per worker
+plus one for this load generator.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_multi_worker --workers 1,2,4 --sessions-per-worker 25
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+import websockets
+
+from app.utils.stats_utils import percentiles
+from .loadgen import admin_get, admin_token
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port: int, timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port}")
+
+class Results:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.requests = 0
+        self.resumes = 0
+        self.resumes_ok = 0
+        self.errors = 0
+
+async def run_session(url: str, deadline: float, resume_rate: float, rng: random.Random, results: Results) -> None:
+    """Send requests back to back until the deadline, sometimes reconnecting mid-stream."""
+    try:
+        ws = await websockets.connect(url)
+        hello = json.loads(await ws.recv())
+        token = hello["session_token"]
+        turn = 0
+        while time.monotonic() < deadline:
+            turn += 1
+            request_id = f"t{turn}"
+            started = time.perf_counter()
+            await ws.send(json.dumps({"type": "text", "content": f"turn {turn}", "request_id": request_id}))
+            interrupt_after = rng.randint(2, 6) if rng.random() < resume_rate else None
+            text, last_seq, chunks = "", 0, 0
+            while True:
+                frame = json.loads(await asyncio.wait_for(ws.recv(), 30))
+                last_seq = frame.get("seq", last_seq)
+                if frame.get("request_id") != request_id:
+                    continue
+                if frame["type"] == "text_chunk":
+                    text += frame["content"]
+                    chunks += 1
+                    if chunks == interrupt_after:
+                        # Drop the connection and resume, likely on another worker
+                        await ws.close()
+                        ws = await websockets.connect(f"{url}?session={token}&last_seq={last_seq}")
+                        hello = json.loads(await ws.recv())
+                        results.resumes += 1
+                        if not hello.get("resumed"):
+                            # The response is lost with the old session
+                            token = hello["session_token"]
+                            results.errors += 1
+                            break
+                        interrupt_after = -1
+                elif frame.get("done"):
+                    if interrupt_after == -1 and frame["type"] == "text" and frame["content"] == text:
+                        results.resumes_ok += 1
+                    break
+            results.requests += 1
+            results.latencies.append((time.perf_counter() - started) * 1000)
+        await ws.close()
+    except Exception as e:
+        results.errors += 1
+        print(f"  session error: {type(e).__name__}: {e}")
+
+def collect_worker_metrics(port: int, workers: int) -> Dict[str, Dict[str, Any]]:
+    """Poll the metrics endpoint until every worker has answered once (or give up)."""
+    seen: Dict[str, Dict[str, Any]] = {}
+    http_url = f"http://127.0.0.1:{port}"
+    # Mock auth tokens are signed, so one sign-in works on every worker
+    token = admin_token(http_url)
+    for _ in range(workers * 20):
+        sessions = admin_get(http_url, "/api/admin/ws/metrics", token)["sessions"]
+        seen[sessions["worker"]] = sessions
+        if len(seen) == workers:
+            break
+    return seen
+
+def run_workers(args: argparse.Namespace, workers: int, redis_url: str, stub_url: str) -> Dict[str, float]:
+    port = free_port()
+    env = {
+        **os.environ,
+        "ANTHROPIC_API_KEY": "bench",
+        "ANTHROPIC_BASE_URL": stub_url,
+        "STATE_BACKEND": "redis",
+        "REDIS_URL": redis_url,
+        "STATE_KEY_PREFIX": f"bench{workers}"
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for_port(port)
+        time.sleep(1.0 + 0.5 * workers)  # Let every worker finish starting up
+        sessions = args.sessions_per_worker * workers
+        results = Results()
+
+        async def run_all() -> None:
+            deadline = time.monotonic() + args.duration
+            rng = random.Random(args.seed)
+            await asyncio.gather(*(
+                run_session(f"ws://127.0.0.1:{port}/ws", deadline, args.resume_rate, random.Random(rng.random()), results)
+                for _ in range(sessions)
+            ))
+        started = time.perf_counter()
+        asyncio.run(run_all())
+        elapsed = time.perf_counter() - started
+
+        per_worker = collect_worker_metrics(port, workers)
+        latency = percentiles(results.latencies)
+        throughput = results.requests / elapsed
+        print(f"workers={workers} sessions={sessions} requests={results.requests} "
+              f"req/s={throughput:.1f} p50={latency['p50']}ms p95={latency['p95']}ms "
+              f"resumes={results.resumes_ok}/{results.resumes} errors={results.errors}")
+        for worker, metrics in sorted(per_worker.items()):
+            print(f"    worker {worker}: connected={metrics['connected']} adopted={metrics['adopted']} "
+                  f"handed_over={metrics['handed_over']} backend={metrics['state_backend']['backend']} "
+                  f"backend_errors={metrics['state_backend'].get('errors', 0)}")
+        return {"workers": workers, "throughput": throughput, "p95": latency["p95"]}
+    finally:
+        server.terminate()
+        server.wait()
+
+def main(args: argparse.Namespace) -> None:
+    resp_port, stub_port = free_port(), free_port()
+    helpers = [
+        subprocess.Popen([sys.executable, "-m", "benchmarks.resp_server", "--port", str(resp_port)],
+                         stdout=subprocess.DEVNULL),
+        subprocess.Popen([sys.executable, "-m", "benchmarks.stub_server", "--port", str(stub_port),
+                          "--tokens", str(args.tokens), "--tps", str(args.tps), "--ttft", str(args.ttft)],
+                         stdout=subprocess.DEVNULL)
+    ]
+    try:
+        wait_for_port(resp_port)
+        wait_for_port(stub_port)
+        counts = [int(count) for count in args.workers.split(",")]
+        if max(counts) + 1 > (os.cpu_count() or 1):
+            print(f"NOTE: {os.cpu_count()} CPU(s) for up to {max(counts)} workers plus the load generator; "
+                  "throughput cannot scale past the core count.")
+
+        rows = [run_workers(args, count, f"redis://127.0.0.1:{resp_port}/0", f"http://127.0.0.1:{stub_port}")
+                for count in counts]
+        base = rows[0]
+        print("\nscaling (weak, sessions grow with workers):")
+        for row in rows:
+            efficiency = row["throughput"] / (base["throughput"] * row["workers"] / base["workers"])
+            print(f"  workers={row['workers']}: req/s={row['throughput']:.1f} "
+                  f"speedup={row['throughput'] / base['throughput']:.2f}x efficiency={efficiency:.2f} p95={row['p95']}ms")
+    finally:
+        for helper in helpers:
+            helper.terminate()
+            helper.wait()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--workers", default="1,2,4", help="Comma-separated worker counts")
+    parser.add_argument("--sessions-per-worker", type=int, default=25)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of load per worker count")
+    parser.add_argument("--resume-rate", type=float, default=0.1, help="Fraction of requests interrupted and resumed")
+    parser.add_argument("--tokens", type=int, default=40, help="Text deltas per response")
+    parser.add_argument("--tps", type=float, default=200.0, help="Stub tokens per second, 0 for unthrottled")
+    parser.add_argument("--ttft", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=1)
+    main(parser.parse_args())
@@ -0,0 +1,105 @@
+# benchmarks/bench_request_build.py
+"""
+Time to build the Messages API request body as a conversation grows.
+
+Each turn first fits the history to the token budget with fit_history, as
+the chat handlers do. "rebuild" is what execute_claude_call_streaming did
+on every turn: format every kept message for the API, mark the prompt-cache
+breakpoints and serialize the whole payload as httpx does for json=.
+"cached" splices the body from the fragments MessageService keeps encoded,
+so only the newest messages are serialized. Both build the request for the
+same turns and the bodies are checked to decode to the same JSON. Pass a
+lower --budget to time conversations that have been trimmed.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_request_build --turns 10,100,1000
+    python -m benchmarks.bench_request_build --turns 1000 --budget 20000
+"""
+import argparse
+import json
+import random
+import time
+from typing import Any, Dict, List
+
+from app.services.api_service import api_service
+from app.services.context_service import context_service
+from app.services.message_service import MessageService
+from app.utils.stats_utils import percentiles
+
+MODEL = "claude-3-7-sonnet-20250219"
+
+def rebuild(history: Any, user_input: str) -> bytes:
+    history, _ = context_service.fit_history(history, user_input)
+    system = [msg.get('content') for msg in history if msg.get('role') == 'system']
+    messages = [
+        {"role": msg.get('role'), "content": msg.get('content')}
+        for msg in history
+        if msg.get('role') in ['user', 'assistant'] and 'content' in msg
+    ]
+    messages.append({"role": "user", "content": user_input})
+    payload = {"model": MODEL, "messages": messages, "max_tokens": 4096, "temperature": 0.7, "stream": True}
+    if system:
+        payload["system"] = "\n\n".join(system)
+    api_service._mark_cache_breakpoints(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), allow_nan=False).encode("utf-8")
+
+def cached(service: MessageService, history: Any, user_input: str) -> bytes:
+    history, _ = context_service.fit_history(history, user_input)
+    encoded = service.encode_history("bench", history, api_service._with_cache_control)
+    assert encoded is not None, "history not served from the encoded cache"
+    payload = {
+        "model": MODEL, "messages": [{"role": "user", "content": user_input}],
+        "max_tokens": 4096, "temperature": 0.7, "stream": True
+    }
+    system = [msg.get('content') for msg in history.head]
+    if system:
+        payload["system"] = "\n\n".join(system)
+    api_service._mark_system_prompt(payload)
+    return service.splice_request(payload, encoded)
+
+def run(turns: int, measured: int, rng: random.Random) -> Dict[str, Dict[str, float]]:
+    words = "the neon grid journal today feeling calm focus wellbeing sleep energy reflect".split()
+    service = MessageService()
+    times: Dict[str, List[float]] = {"rebuild": [], "cached": []}
+    for turn in range(turns):
+        question = " ".join(rng.choice(words) for _ in range(30))
+        service.add_message("bench", service.create_user_message(question), mirror=False)
+        history = service.get_message_history("bench")[:-1]
+
+        started = time.perf_counter()
+        expected = rebuild(history, question)
+        rebuild_time = time.perf_counter() - started
+        started = time.perf_counter()
+        body = cached(service, history, question)
+        cached_time = time.perf_counter() - started
+
+        # Every turn builds on the cache, as on a live server; the last ones are timed
+        if turn >= turns - measured:
+            times["rebuild"].append(rebuild_time * 1e6)
+            times["cached"].append(cached_time * 1e6)
+            assert json.loads(body) == json.loads(expected)
+        answer = " ".join(rng.choice(words) for _ in range(120))
+        service.add_message("bench", service.create_assistant_message(answer, model=MODEL), mirror=False)
+    service.close()
+    return {name: percentiles(values) for name, values in times.items()}
+
+def main(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    if args.budget:
+        context_service.token_budget = args.budget
+    print(f"Request body build time per turn (us), prompt-cache breakpoints on, "
+          f"budget {context_service.token_budget} tokens:")
+    for turns in (int(value) for value in args.turns.split(",")):
+        result = run(turns, min(args.measured, turns), rng)
+        rebuild_p50, cached_p50 = result["rebuild"]["p50"], result["cached"]["p50"]
+        print(f"  {turns:>5} turns: rebuild p50={rebuild_p50:9.1f} p99={result['rebuild']['p99']:9.1f}  "
+              f"cached p50={cached_p50:7.1f} p99={result['cached']['p99']:7.1f}  "
+              f"({rebuild_p50 / max(cached_p50, 0.01):.1f}x)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--turns", default="10,100,1000", help="Comma-separated conversation lengths")
+    parser.add_argument("--measured", type=int, default=10, help="Turns timed at the end of each conversation")
+    parser.add_argument("--budget", type=int, default=0, help="Prompt token budget (default: CONTEXT_TOKEN_BUDGET)")
+    parser.add_argument("--seed", type=int, default=1)
+    main(parser.parse_args())
@@ -0,0 +1,63 @@
+# benchmarks/bench_scheduler.py
+"""
+Fairness and throttling behaviour of the outbound LLM scheduler.
+
+One heavy user fires a burst of concurrent requests while several light users
+send one request each, against a stub that throttles the first requests with
+429 + retry-after. Light users should finish long before the heavy burst does.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_scheduler --in-flight 4 --heavy 40 --light 8
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+from app.services.api_service import ApiService
+from app.services.scheduler_service import llm_scheduler
+from .stub_server import StubServer
+
+async def timed_call(service: ApiService, client_id: str) -> float:
+    start = time.perf_counter()
+    response = await service.execute_claude_call([], "Hello", client_id)
+    if response.get("type") == "error":
+        raise RuntimeError(response["content"])
+    return (time.perf_counter() - start) * 1000
+
+def describe(label: str, samples: List[float]) -> None:
+    print(f"{label:>6}: n={len(samples)} p50={statistics.median(samples):.1f}ms max={max(samples):.1f}ms")
+
+async def main(in_flight: int, heavy: int, light: int, throttle: int) -> None:
+    server = StubServer(tokens=10, tokens_per_second=200, throttle_first=throttle, retry_after=0.2)
+    await server.start()
+
+    service = ApiService()
+    service.anthropic_api_key = "stub-key"
+    service.base_url = server.base_url
+    await service.startup()
+
+    llm_scheduler.max_in_flight = in_flight
+    llm_scheduler.backoff_base = 0.05
+    try:
+        heavy_calls = [timed_call(service, "heavy-user") for _ in range(heavy)]
+        light_calls = [timed_call(service, f"light-user-{i}") for i in range(light)]
+        results = await asyncio.gather(*heavy_calls, *light_calls)
+
+        describe("heavy", results[:heavy])
+        describe("light", results[heavy:])
+        print(f"stub: requests={server.requests} throttled={server.throttled}")
+        print(f"scheduler: {llm_scheduler.get_metrics()}")
+    finally:
+        await service.shutdown()
+        await server.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--in-flight", type=int, default=4)
+    parser.add_argument("--heavy", type=int, default=40)
+    parser.add_argument("--light", type=int, default=8)
+    parser.add_argument("--throttle", type=int, default=3, help="Number of initial requests answered with 429")
+    args = parser.parse_args()
+    asyncio.run(main(args.in_flight, args.heavy, args.light, args.throttle))
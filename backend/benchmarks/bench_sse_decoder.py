@@ -0,0 +1,86 @@
+# benchmarks/bench_sse_decoder.py
+"""
+Replay a recorded Claude stream through the old and new SSE parsing loops.
+
+"lines" is the previous loop: response.aiter_lines() and json.loads on every
+"data:" line. "bytes" is SSEDecoder over response.aiter_bytes(). Both run on an
+httpx.Response fed from the same pre-split byte chunks, so network time is
+excluded and only parsing cost is measured.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_sse_decoder --deltas 20000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import AsyncIterator, List
+
+import httpx
+
+from app.utils.sse_utils import SSEDecoder
+from .stub_server import build_stream
+
+def record_stream(deltas: int, seed: int = 7) -> List[bytes]:
+    """Build a stream of text deltas, split into network-sized chunks."""
+    rng = random.Random(seed)
+    words = ["the", "journal", "neon", "grid", "feeling", "today", "and", "💡", "résumé", "wellbeing"]
+    body = b"".join(build_stream([rng.choice(words) + " " for _ in range(deltas)]))
+
+    chunks = []
+    position = 0
+    while position < len(body):
+        size = rng.randint(256, 4096)
+        chunks.append(body[position:position + size])
+        position += size
+    return chunks
+
+def replay(chunks: List[bytes]) -> httpx.Response:
+    async def body() -> AsyncIterator[bytes]:
+        for chunk in chunks:
+            yield chunk
+    return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=body())
+
+async def parse_lines(chunks: List[bytes]) -> int:
+    events = 0
+    async for line in replay(chunks).aiter_lines():
+        if line.startswith('data: '):
+            try:
+                chunk = json.loads(line[6:])
+            except json.JSONDecodeError:
+                continue
+            events += 1
+            if chunk.get('type') == 'content_block_delta':
+                chunk.get('delta', {}).get('text', '')
+    return events
+
+async def parse_bytes(chunks: List[bytes]) -> int:
+    events = 0
+    decoder = SSEDecoder()
+    async for raw in replay(chunks).aiter_bytes():
+        for event in decoder.feed(raw):
+            events += 1
+            if event.event == 'content_block_delta':
+                event.data.get('delta', {}).get('text', '')
+    return events + len(decoder.flush())
+
+async def main(deltas: int, rounds: int) -> None:
+    chunks = record_stream(deltas)
+    print(f"stream: {deltas} deltas, {sum(len(c) for c in chunks)} bytes in {len(chunks)} chunks")
+
+    for label, parser in (("lines", parse_lines), ("bytes", parse_bytes)):
+        best = None
+        for _ in range(rounds):
+            start = time.perf_counter()
+            events = await parser(chunks)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"{label:>5}: {events} events, best {best * 1000:.1f}ms, {events / best:,.0f} events/sec")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--deltas", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.deltas, args.rounds))
@@ -0,0 +1,109 @@
+# benchmarks/bench_stream_frames.py
+"""
+WebSocket frames and CPU per token for streamed text turns.
+
+Runs handle_text_message for many concurrent clients against a synthetic
+upstream that yields text deltas at a fixed rate. The fake WebSocket JSON-encodes
+every frame like Starlette does and writes it, with a WebSocket frame header, to
+a local TCP connection so each frame costs a real transport write. "per-delta" uses a flush
+interval of 0 (one frame per upstream delta, the old behaviour); "coalesced"
+uses the given interval.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_stream_frames --clients 200 --tokens 300 --tps 100
+"""
+import argparse
+import asyncio
+import json
+import struct
+import time
+from typing import Any, Dict, Optional
+
+from app.api.ws.text_handler import handle_text_message
+from app.services.api_service import api_service
+from app.services.message_service import message_service
+
+class CountingWebSocket:
+    """Stand-in for a WebSocket that encodes, writes and counts frames."""
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.frames = 0
+        self.bytes = 0
+
+    async def send_json(self, data: Any) -> None:
+        payload = json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        if len(payload) < 126:
+            header = struct.pack("!BB", 0x81, len(payload))
+        else:
+            header = struct.pack("!BBH", 0x81, 126, len(payload))
+        self.writer.write(header + payload)
+        self.frames += 1
+        self.bytes += len(header) + len(payload)
+
+async def discard(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    while await reader.read(65536):
+        pass
+    writer.close()
+
+def make_upstream(tokens: int, tokens_per_second: float):
+    """Build a replacement for execute_claude_call_streaming emitting paced deltas."""
+    interval = 1.0 / tokens_per_second if tokens_per_second > 0 else 0.0
+
+    async def stream(message_history, user_input, client_id: Optional[str] = None, **kwargs):
+        for index in range(tokens):
+            yield {"role": "assistant", "content": f"tok{index} ", "type": "text_chunk", "done": False}
+            await asyncio.sleep(interval)
+        yield {"role": "assistant", "content": "", "model": "stub", "type": "text", "done": True}
+
+    return stream
+
+async def run(label: str, clients: int, flush_interval_ms: float, port: int) -> Dict[str, float]:
+    sockets = []
+    for _ in range(clients):
+        _, writer = await asyncio.open_connection("127.0.0.1", port)
+        sockets.append(CountingWebSocket(writer))
+    data = {"content": "Hello", "flush_interval_ms": flush_interval_ms}
+
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    await asyncio.gather(*(
+        handle_text_message(ws, f"{label}-{i}", data) for i, ws in enumerate(sockets)
+    ))
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+    for i, ws in enumerate(sockets):
+        ws.writer.close()
+        await ws.writer.wait_closed()
+        message_service.clear_message_history(f"{label}-{i}")
+    await asyncio.sleep(0.1)  # Let the discard handlers see EOF
+    return {
+        "frames": sum(ws.frames for ws in sockets),
+        "bytes": sum(ws.bytes for ws in sockets),
+        "wall": wall,
+        "cpu": cpu
+    }
+
+async def main(args: argparse.Namespace) -> None:
+    api_service.execute_claude_call_streaming = make_upstream(args.tokens, args.tps)
+    total_tokens = args.clients * args.tokens
+    server = await asyncio.start_server(discard, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    try:
+        for label, interval in (("per-delta", 0.0), ("coalesced", args.flush_interval_ms)):
+            result = await run(label, args.clients, interval, port)
+            print(f"{label:>9}: frames={result['frames']} "
+                  f"frames/s={result['frames'] / result['wall']:.0f} "
+                  f"bytes={result['bytes']} "
+                  f"cpu/token={result['cpu'] / total_tokens * 1e6:.2f}us "
+                  f"wall={result['wall']:.2f}s")
+    finally:
+        server.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--tokens", type=int, default=300, help="Text deltas per turn")
+    parser.add_argument("--tps", type=float, default=100.0, help="Deltas per second per turn")
+    parser.add_argument("--flush-interval-ms", type=float, default=30.0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,125 @@
+# benchmarks/bench_uploads.py
+"""
+Peak server RSS while clients upload large files concurrently.
+
+Starts the app under uvicorn in a subprocess and uploads one file per
+client, either the old way (one JSON frame carrying a base64 data URL) or
+with the chunked upload protocol over MessagePack frames. The upload is an
+application/octet-stream file, so the handler rejects its type without
+calling Claude and the numbers cover only receiving the upload. Peak RSS
+is read from /proc (VmHWM), so this runs on Linux only.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_uploads --clients 4 --size-mb 50
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict
+
+import msgpack
+import websockets
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def memory_kb(pid: int) -> Dict[str, int]:
+    values = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in ("VmRSS", "VmHWM"):
+                values[name] = int(rest.split()[0])
+    return values
+
+async def upload_legacy(url: str, payload: bytes) -> None:
+    async with websockets.connect(url, max_size=None) as ws:
+        await ws.recv()  # client_id
+        await ws.send(json.dumps({
+            "type": "file",
+            "content": "data:application/octet-stream;base64," + base64.b64encode(payload).decode("ascii"),
+            "filename": "blob.bin",
+            "filetype": "application/octet-stream",
+            "filesize": len(payload)
+        }))
+        await ws.recv()
+
+async def upload_chunked(url: str, payload: bytes, chunk_bytes: int) -> None:
+    async with websockets.connect(url, max_size=None, subprotocols=["neonchat.msgpack"]) as ws:
+        await ws.recv()  # client_id
+        await ws.send(msgpack.packb({
+            "type": "upload_start", "filename": "blob.bin",
+            "filetype": "application/octet-stream", "size": len(payload)
+        }))
+        upload_id = msgpack.unpackb(await ws.recv())["upload_id"]
+        view = memoryview(payload)
+        for offset in range(0, len(payload), chunk_bytes):
+            await ws.send(msgpack.packb({
+                "type": "upload_chunk", "upload_id": upload_id,
+                "offset": offset, "data": bytes(view[offset:offset + chunk_bytes])
+            }))
+        await ws.send(msgpack.packb({"type": "upload_commit", "upload_id": upload_id, "content": "Summarize"}))
+        await ws.recv()
+
+def run_mode(mode: str, clients: int, size_mb: int, chunk_kb: int) -> None:
+    port = free_port()
+    size = size_mb * 1024 * 1024
+    env = {
+        **os.environ,
+        "ANTHROPIC_API_KEY": "bench",
+        "WS_MAX_FRAME_BYTES": str(size * 2),
+        "UPLOAD_MAX_BYTES": str(size * 2),
+        "WS_MAX_CONCURRENT_REQUESTS": str(clients)
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+         "--ws-max-size", str(size * 3), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        url = f"ws://127.0.0.1:{port}/ws"
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        baseline = memory_kb(server.pid)["VmRSS"]
+
+        payloads = [os.urandom(size) for _ in range(clients)]
+        started = time.perf_counter()
+        if mode == "legacy":
+            uploads = [upload_legacy(url, payload) for payload in payloads]
+        else:
+            uploads = [upload_chunked(url, payload, chunk_kb * 1024) for payload in payloads]
+
+        async def run_all() -> None:
+            await asyncio.gather(*uploads)
+        asyncio.run(run_all())
+        elapsed = time.perf_counter() - started
+
+        memory = memory_kb(server.pid)
+        print(f"{mode:>8}: clients={clients} size={size_mb}MB "
+              f"baseline={baseline / 1024:.0f}MB peak={memory['VmHWM'] / 1024:.0f}MB "
+              f"growth={(memory['VmHWM'] - baseline) / 1024:.0f}MB time={elapsed:.2f}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--size-mb", type=int, default=50)
+    parser.add_argument("--chunk-kb", type=int, default=256)
+    parser.add_argument("--mode", choices=["legacy", "chunked", "both"], default="both")
+    args = parser.parse_args()
+    for mode in (["legacy", "chunked"] if args.mode == "both" else [args.mode]):
+        run_mode(mode, args.clients, args.size_mb, args.chunk_kb)
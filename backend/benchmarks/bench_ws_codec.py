@@ -0,0 +1,77 @@
+# benchmarks/bench_ws_codec.py
+"""
+Encode/decode CPU per WebSocket frame for each codec.
+
+"stdlib" is what Starlette's send_json/receive_json do (json.dumps with
+compact separators, json.loads). "json" is the JsonCodec (orjson when
+installed) and "msgpack" the MessagePack codec. Frames cover the chat path
+(streamed text_chunk and the final response) and the upload path (an image
+message carrying a base64 data URL).
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_ws_codec --upload-kb 2048
+"""
+import argparse
+import base64
+import json
+import os
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from app.api.ws.codec import JsonCodec, MsgpackCodec, decode_message, msgpack
+
+def build_frames(upload_kb: int) -> Dict[str, Dict[str, Any]]:
+    image = base64.b64encode(os.urandom(upload_kb * 1024)).decode("ascii")
+    return {
+        "text_chunk": {
+            "role": "assistant", "content": "the neon grid ", "type": "text_chunk",
+            "done": False, "request_id": "a1b2c3d4e5f6"
+        },
+        "final": {
+            "role": "assistant", "content": "word " * 400, "model": "claude-3-7-sonnet-20250219",
+            "type": "text", "done": True, "request_id": "a1b2c3d4e5f6",
+            "context": {"budget_tokens": 100000, "prompt_tokens": 5210, "dropped_messages": 0}
+        },
+        "upload": {
+            "type": "image", "content": "What is in this picture?",
+            "image_data": f"data:image/png;base64,{image}", "request_id": "a1b2c3d4e5f6"
+        }
+    }
+
+def codecs() -> List[Tuple[str, Callable[[Dict[str, Any]], Any], Callable[[Any], Dict[str, Any]]]]:
+    max_bytes = 1 << 40
+    result = [
+        ("stdlib", lambda data: json.dumps(data, separators=(",", ":"), ensure_ascii=False), json.loads),
+        ("json", JsonCodec().encode,
+         lambda text: decode_message({"type": "websocket.receive", "text": text}, max_bytes))
+    ]
+    if msgpack is not None:
+        result.append(("msgpack", MsgpackCodec().encode,
+                       lambda raw: decode_message({"type": "websocket.receive", "bytes": raw}, max_bytes)))
+    return result
+
+def measure(func: Callable[[Any], Any], arg: Any, iterations: int) -> float:
+    """Return CPU microseconds per call."""
+    start = time.process_time()
+    for _ in range(iterations):
+        func(arg)
+    return (time.process_time() - start) / iterations * 1e6
+
+def main(args: argparse.Namespace) -> None:
+    frames = build_frames(args.upload_kb)
+    for frame_name, frame in frames.items():
+        iterations = args.upload_iterations if frame_name == "upload" else args.iterations
+        print(f"{frame_name}:")
+        for codec_name, encode, decode in codecs():
+            encoded = encode(frame)
+            assert decode(encoded) == frame
+            print(f"  {codec_name:>8}: size={len(encoded):>9} "
+                  f"encode={measure(encode, frame, iterations):9.2f}us "
+                  f"decode={measure(decode, encoded, iterations):9.2f}us")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--upload-iterations", type=int, default=50)
+    parser.add_argument("--upload-kb", type=int, default=2048, help="Raw size of the uploaded image")
+    main(parser.parse_args())
@@ -0,0 +1,517 @@
+# benchmarks/loadgen.py
+"""
+WebSocket load generator for the /ws chat endpoint.
+
+Opens many concurrent clients, each running a scripted schedule of text,
+file and image messages with think times, and reports connect latency,
+time to first chunk, chunk inter-arrival gaps and jitter, full-turn latency
+(p50/p95/p99) and server RSS per connection.
+
+By default it starts the Claude API stub and the app under uvicorn itself,
+so the upstream LLM is local and server memory can be read from /proc
+(Linux). Pass --url (and optionally --server-pid) to load a running server.
+Shed counts come from the admin API, read as the mock auth test user unless
+--admin-token gives a bearer token for the server.
+Results are written as JSON with --output; --compare prints the change
+against an earlier result file, so builds can be compared.
+
+Scenarios are built in (see SCENARIOS) or loaded from a JSON file:
+    {"repeat": 2, "steps": [
+        {"type": "text", "content": "Hello", "think": 1.0},
+        {"type": "file", "size_kb": 16, "think": 2.0},
+        {"type": "image", "size_kb": 64, "upload": true, "think": 2.0}]}
+Files and images use the chunked upload protocol unless "upload" is false,
+in which case they are sent as one frame carrying a base64 data URL.
+
+Usage (from the backend directory):
+    python -m benchmarks.loadgen --clients 2000 --ramp 200 --scenario chat --output run.json
+    python -m benchmarks.loadgen --clients 500 --scenario mixed --compare run.json
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+import uuid
+from typing import Any, Dict, List, Optional
+
+import websockets
+
+from app.utils.stats_utils import percentiles
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    "chat": {"repeat": 3, "steps": [
+        {"type": "text", "content": "How can I keep a steady sleep schedule?", "think": 2.0}
+    ]},
+    "mixed": {"repeat": 1, "steps": [
+        {"type": "text", "content": "Summarize my week in one paragraph.", "think": 1.0},
+        {"type": "file", "size_kb": 16, "think": 2.0},
+        {"type": "text", "content": "What stands out in that file?", "think": 1.0},
+        {"type": "image", "size_kb": 64, "think": 2.0}
+    ]},
+    "idle": {"repeat": 1, "steps": [
+        {"type": "idle", "think": 10.0}
+    ]}
+}
+
+# Summary metrics compared by --compare; lower is better for all of them
+COMPARED = ("connect_ms", "ttfc_ms", "turn_ms", "chunk_gap_ms", "chunk_jitter_ms")
+
+def dumps(data: Dict[str, Any]) -> str:
+    return orjson.dumps(data).decode("utf-8") if orjson is not None else json.dumps(data)
+
+def loads(raw: Any) -> Dict[str, Any]:
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port: int, timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port}")
+
+def rss_kb(pid: Optional[int]) -> Dict[str, int]:
+    """Current and peak RSS of a process, empty if it cannot be read."""
+    values: Dict[str, int] = {}
+    if pid is None:
+        return values
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                name, _, rest = line.partition(":")
+                if name in ("VmRSS", "VmHWM"):
+                    values[name] = int(rest.split()[0])
+    except OSError:
+        pass
+    return values
+
+def admin_token(http_url: str) -> str:
+    """Sign in as the mock auth service's test user, for the admin API of a server without Supabase."""
+    form = urllib.parse.urlencode({"username": "test@example.com", "password": "password"}).encode()
+    with urllib.request.urlopen(f"{http_url}/api/auth/token", data=form, timeout=5) as response:
+        return json.load(response)["access_token"]
+
+def admin_get(http_url: str, path: str, token: str) -> Any:
+    """GET an admin API endpoint with a bearer token."""
+    request = urllib.request.Request(f"{http_url}{path}", headers={"Authorization": f"Bearer {token}"})
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return json.load(response)
+
+def fetch_admission_metrics(url: str, token: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """The server's admission metrics (shed counts), None if it does not serve them."""
+    http_url = url.replace("ws://", "http://", 1).replace("wss://", "https://", 1).split("/ws")[0]
+    try:
+        return admin_get(http_url, "/api/admin/admission/metrics", token or admin_token(http_url))
+    except (OSError, ValueError, KeyError):
+        return None
+
+def raise_fd_limit() -> int:
+    """Raise the open file limit to the hard limit; thousands of sockets need it."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY and soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        return hard
+    return soft
+
+def git_revision() -> Dict[str, Any]:
+    try:
+        sha = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, timeout=5).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    capture_output=True, text=True, timeout=5).stdout.strip())
+        return {"commit": sha or None, "dirty": dirty}
+    except (OSError, subprocess.SubprocessError):
+        return {"commit": None, "dirty": None}
+
+class Stats:
+    """Samples collected across all clients."""
+
+    def __init__(self):
+        self.connect_ms: List[float] = []
+        self.ttfc_ms: Dict[str, List[float]] = {}
+        self.turn_ms: Dict[str, List[float]] = {}
+        self.chunk_gap_ms: List[float] = []
+        self.chunk_jitter_ms: List[float] = []
+        self.counts = {
+            "connected": 0, "connect_failed": 0, "connect_busy": 0, "turns": 0, "turn_errors": 0,
+            "turn_timeouts": 0, "turns_shed": 0, "disconnects": 0, "frames": 0
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        every_ttfc = [value for values in self.ttfc_ms.values() for value in values]
+        every_turn = [value for values in self.turn_ms.values() for value in values]
+        return {
+            "connect_ms": percentiles(self.connect_ms),
+            "ttfc_ms": percentiles(every_ttfc),
+            "turn_ms": percentiles(every_turn),
+            "chunk_gap_ms": percentiles(self.chunk_gap_ms),
+            "chunk_jitter_ms": percentiles(self.chunk_jitter_ms),
+            "by_type": {
+                kind: {"ttfc_ms": percentiles(self.ttfc_ms.get(kind, [])), "turn_ms": percentiles(values)}
+                for kind, values in self.turn_ms.items()
+            },
+            "counts": dict(self.counts)
+        }
+
+class Turn:
+    """Timing of one request, filled in by the client's reader."""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.sent = time.perf_counter()
+        self.first: Optional[float] = None
+        self.last_chunk: Optional[float] = None
+        self.gaps: List[float] = []
+        self.done_at: Optional[float] = None
+        self.error = False
+        self.busy = False
+        self.done = asyncio.Event()
+
+    def on_frame(self, frame: Dict[str, Any], now: float) -> None:
+        if self.first is None:
+            self.first = now
+        if frame.get("type") == "text_chunk":
+            if self.last_chunk is not None:
+                self.gaps.append((now - self.last_chunk) * 1000)
+            self.last_chunk = now
+        elif frame.get("done") or frame.get("type") in ("error", "busy", "text"):
+            self.error = frame.get("type") == "error"
+            self.busy = frame.get("type") == "busy"
+            self.done_at = now
+            self.done.set()
+
+class LoadClient:
+    """One simulated user running the scenario on its own connection."""
+
+    def __init__(self, name: str, url: str, scenario: Dict[str, Any], stats: Stats, rng: random.Random,
+                 turn_timeout: float):
+        self.name = name
+        self.url = url
+        self.scenario = scenario
+        self.stats = stats
+        self.rng = rng
+        self.turn_timeout = turn_timeout
+        self.ws = None
+        self.turns: Dict[str, Turn] = {}
+        self.control: Dict[str, asyncio.Future] = {}
+
+    async def run(self) -> None:
+        started = time.perf_counter()
+        try:
+            self.ws = await websockets.connect(self.url, max_size=None, open_timeout=30)
+            hello = loads(await asyncio.wait_for(self.ws.recv(), 30))
+            if hello.get("type") == "busy":
+                # Turned away by admission control
+                self.stats.counts["connect_busy"] += 1
+                await self.ws.close()
+                return
+            if hello.get("type") != "client_id":
+                raise ConnectionError(f"Expected client_id, got {hello.get('type')}")
+        except Exception:
+            self.stats.counts["connect_failed"] += 1
+            return
+        self.stats.connect_ms.append((time.perf_counter() - started) * 1000)
+        self.stats.counts["connected"] += 1
+
+        reader = asyncio.create_task(self._read())
+        try:
+            for _ in range(self.scenario.get("repeat", 1)):
+                for step in self.scenario["steps"]:
+                    await asyncio.sleep(step.get("think", 0) * self.rng.uniform(0.5, 1.5))
+                    if step["type"] != "idle":
+                        await self._turn(step)
+        except websockets.ConnectionClosed:
+            self.stats.counts["disconnects"] += 1
+        finally:
+            reader.cancel()
+            await self.ws.close()
+
+    async def _turn(self, step: Dict[str, Any]) -> None:
+        request_id = uuid.uuid4().hex[:12]
+        turn = Turn(step["type"])
+        self.turns[request_id] = turn
+        if step["type"] == "text":
+            # Name the user so clients do not all send identical prompts
+            content = f"{step.get('content', 'Hello')} ({self.name})"
+            await self.ws.send(dumps({"type": "text", "content": content, "request_id": request_id}))
+        elif step.get("upload", True):
+            await self._upload(step, request_id)
+        else:
+            await self.ws.send(dumps(self._inline_attachment(step, request_id)))
+
+        try:
+            await asyncio.wait_for(turn.done.wait(), self.turn_timeout)
+        except asyncio.TimeoutError:
+            self.stats.counts["turn_timeouts"] += 1
+            return
+        finally:
+            self.turns.pop(request_id, None)
+
+        self.stats.counts["turns"] += 1
+        if turn.busy:
+            self.stats.counts["turns_shed"] += 1
+            return
+        if turn.error:
+            self.stats.counts["turn_errors"] += 1
+            return
+        self.stats.turn_ms.setdefault(turn.kind, []).append((turn.done_at - turn.sent) * 1000)
+        self.stats.ttfc_ms.setdefault(turn.kind, []).append((turn.first - turn.sent) * 1000)
+        self.stats.chunk_gap_ms.extend(turn.gaps)
+        if len(turn.gaps) >= 2:
+            self.stats.chunk_jitter_ms.append(statistics.pstdev(turn.gaps))
+
+    async def _upload(self, step: Dict[str, Any], request_id: str) -> None:
+        payload = self._payload(step)
+        kind = step["type"]
+        upload_id = uuid.uuid4().hex[:12]
+        ready = asyncio.get_running_loop().create_future()
+        self.control[upload_id] = ready
+        await self.ws.send(dumps({
+            "type": "upload_start", "upload_id": upload_id, "kind": kind,
+            "filename": "load.png" if kind == "image" else "load.txt",
+            "filetype": "image/png" if kind == "image" else "text/plain",
+            "size": len(payload), "request_id": request_id
+        }))
+        frame = await asyncio.wait_for(ready, self.turn_timeout)
+        if frame.get("type") != "upload_ready":
+            # Refused; a busy frame carrying the request_id has already ended the turn
+            turn = self.turns[request_id]
+            if not turn.done.is_set():
+                turn.on_frame({"type": "error"}, time.perf_counter())
+            return
+        chunk = frame.get("chunk_bytes", 256 * 1024)
+        for offset in range(0, len(payload), chunk):
+            await self.ws.send(dumps({
+                "type": "upload_chunk", "upload_id": upload_id, "offset": offset,
+                "data": base64.b64encode(payload[offset:offset + chunk]).decode("ascii")
+            }))
+        await self.ws.send(dumps({
+            "type": "upload_commit", "upload_id": upload_id, "request_id": request_id,
+            "content": f"What is in this attachment? ({self.name})"
+        }))
+
+    def _inline_attachment(self, step: Dict[str, Any], request_id: str) -> Dict[str, Any]:
+        payload = self._payload(step)
+        filetype = "image/png" if step["type"] == "image" else "text/plain"
+        return {
+            "type": step["type"], "request_id": request_id,
+            "content": f"data:{filetype};base64,{base64.b64encode(payload).decode('ascii')}",
+            "filename": "load.png" if step["type"] == "image" else "load.txt",
+            "filetype": filetype, "filesize": len(payload)
+        }
+
+    def _payload(self, step: Dict[str, Any]) -> bytes:
+        size = int(step.get("size_kb", 16) * 1024)
+        if step["type"] == "image":
+            return b"\x89PNG\r\n\x1a\n" + os.urandom(max(0, size - 8))
+        line = f"{self.name}: today I felt calm and focused; slept seven hours.\n".encode("utf-8")
+        return (line * (size // len(line) + 1))[:size]
+
+    async def _read(self) -> None:
+        try:
+            async for raw in self.ws:
+                now = time.perf_counter()
+                frame = loads(raw)
+                self.stats.counts["frames"] += 1
+                kind = frame.get("type")
+                if kind == "ping":
+                    await self.ws.send(dumps({"type": "pong", "ts": frame.get("ts")}))
+                    continue
+                upload_id = frame.get("upload_id")
+                if upload_id in self.control and kind in ("upload_ready", "error", "busy"):
+                    self.control.pop(upload_id).set_result(frame)
+                    if kind == "upload_ready":
+                        continue
+                turn = self.turns.get(frame.get("request_id"))
+                if turn is not None:
+                    turn.on_frame(frame, now)
+        except websockets.ConnectionClosed:
+            pass
+
+def load_scenario(name: str) -> Dict[str, Any]:
+    if name in SCENARIOS:
+        return SCENARIOS[name]
+    with open(name) as f:
+        return json.load(f)
+
+async def run_load(args: argparse.Namespace, url: str, server_pid: Optional[int]) -> Dict[str, Any]:
+    scenario = load_scenario(args.scenario)
+    stats = Stats()
+    rng = random.Random(args.seed)
+    baseline = rss_kb(server_pid)
+    cpu_start = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+
+    clients = [LoadClient(f"user {index}", url, scenario, stats, random.Random(rng.random()), args.turn_timeout)
+               for index in range(args.clients)]
+    tasks = []
+    for index, client in enumerate(clients):
+        tasks.append(asyncio.create_task(client.run()))
+        if args.ramp > 0 and index % max(1, int(args.ramp / 20)) == 0:
+            # Open about ramp connections per second, in small batches
+            await asyncio.sleep(max(1, int(args.ramp / 20)) / args.ramp)
+
+    # Memory with every client connected, before most turns have finished
+    peak_connected = 0
+    sample_rss: Dict[str, int] = {}
+    while not all(task.done() for task in tasks):
+        live = stats.counts["connected"] - sum(1 for task in tasks if task.done())
+        if live >= peak_connected:
+            peak_connected = live
+            sample_rss = rss_kb(server_pid) or sample_rss
+        await asyncio.wait(tasks, timeout=0.5)
+
+    elapsed = time.perf_counter() - started
+    cpu_end = resource.getrusage(resource.RUSAGE_SELF)
+    final = rss_kb(server_pid)
+    result = stats.summary()
+    result["duration_s"] = round(elapsed, 2)
+    result["turns_per_second"] = round(stats.counts["turns"] / elapsed, 2) if elapsed else 0.0
+    result["client_cpu_s"] = round((cpu_end.ru_utime + cpu_end.ru_stime) - (cpu_start.ru_utime + cpu_start.ru_stime), 2)
+    admission = await asyncio.get_running_loop().run_in_executor(None, fetch_admission_metrics, url, args.admin_token)
+    if admission is not None:
+        result["server_admission"] = {key: admission[key] for key in ("shed", "shed_reasons", "admitted")}
+    if baseline:
+        connected_rss = sample_rss.get("VmRSS", baseline["VmRSS"])
+        result["server_memory"] = {
+            "baseline_rss_kb": baseline["VmRSS"],
+            "connected_rss_kb": connected_rss,
+            "peak_rss_kb": final.get("VmHWM", 0),
+            "peak_connections": peak_connected,
+            "rss_per_connection_kb": round((connected_rss - baseline["VmRSS"]) / max(1, peak_connected), 1)
+        }
+    return result
+
+def print_report(result: Dict[str, Any]) -> None:
+    counts = result["counts"]
+    print(f"connected={counts['connected']} failed={counts['connect_failed']} busy={counts['connect_busy']} "
+          f"turns={counts['turns']} errors={counts['turn_errors']} timeouts={counts['turn_timeouts']} "
+          f"shed={counts['turns_shed']} "
+          f"duration={result['duration_s']}s turns/s={result['turns_per_second']} client_cpu={result['client_cpu_s']}s")
+    for name in COMPARED:
+        values = result[name]
+        print(f"  {name:>16}: p50={values['p50']:>9} p95={values['p95']:>9} p99={values['p99']:>9} max={values['max']:>9}")
+    for kind, values in result["by_type"].items():
+        print(f"  {kind:>16}: ttfc p95={values['ttfc_ms']['p95']}ms turn p95={values['turn_ms']['p95']}ms")
+    admission = result.get("server_admission")
+    if admission:
+        print(f"  server shed: {admission['shed']} reasons={admission['shed_reasons']}")
+    memory = result.get("server_memory")
+    if memory:
+        print(f"  server rss: baseline={memory['baseline_rss_kb'] // 1024}MB connected={memory['connected_rss_kb'] // 1024}MB "
+              f"peak={memory['peak_rss_kb'] // 1024}MB per connection={memory['rss_per_connection_kb']}KB "
+              f"({memory['peak_connections']} connections)")
+
+def print_comparison(result: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    print(f"\nvs {baseline.get('build', {}).get('commit') or 'baseline'}:")
+    for name in COMPARED:
+        for point in ("p50", "p95", "p99"):
+            old = baseline["results"][name][point]
+            new = result[name][point]
+            change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+            print(f"  {name:>16} {point}: {old:>9} -> {new:>9} ({change})")
+    old_memory = baseline["results"].get("server_memory", {}).get("rss_per_connection_kb")
+    new_memory = result.get("server_memory", {}).get("rss_per_connection_kb")
+    if old_memory and new_memory:
+        print(f"  rss per connection: {old_memory}KB -> {new_memory}KB")
+
+def start_servers(args: argparse.Namespace) -> List[subprocess.Popen]:
+    stub_port, app_port = free_port(), free_port()
+    stub = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.stub_server", "--port", str(stub_port), "--tokens", str(args.stub_tokens),
+         "--tps", str(args.stub_tps), "--ttft", str(args.stub_ttft)],
+        stdout=subprocess.DEVNULL
+    )
+    env = {
+        **os.environ,
+        "ANTHROPIC_API_KEY": "loadgen",
+        "ANTHROPIC_BASE_URL": f"http://127.0.0.1:{stub_port}",
+        **dict(item.split("=", 1) for item in args.server_env)
+    }
+    app = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(app_port), "--log-level", "warning",
+         "--backlog", "4096"],
+        env=env, stdout=subprocess.DEVNULL if not args.server_log else None, stderr=subprocess.STDOUT
+    )
+    wait_for_port(stub_port)
+    wait_for_port(app_port)
+    time.sleep(1.0)
+    args.url = f"ws://127.0.0.1:{app_port}/ws"
+    args.server_pid = app.pid
+    return [app, stub]
+
+def main(args: argparse.Namespace) -> None:
+    fd_limit = raise_fd_limit()
+    if fd_limit < args.clients + 100:
+        print(f"WARNING: open file limit {fd_limit} is below {args.clients} clients; connections will fail.")
+
+    servers = [] if args.url else start_servers(args)
+    try:
+        result = asyncio.run(run_load(args, args.url, args.server_pid))
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+
+    report = {
+        "tool": "neonchat-loadgen",
+        "version": 1,
+        "build": git_revision(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {
+            "clients": args.clients, "ramp": args.ramp, "scenario": args.scenario,
+            "external_server": not servers, "server_env": args.server_env, "stub_tokens": args.stub_tokens,
+            "stub_tps": args.stub_tps, "stub_ttft": args.stub_ttft, "seed": args.seed
+        },
+        "results": result
+    }
+    print_report(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(result, json.load(f))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--clients", type=int, default=200, help="Concurrent WebSocket clients")
+    parser.add_argument("--ramp", type=float, default=100.0, help="New connections per second, 0 for all at once")
+    parser.add_argument("--scenario", default="chat", help=f"Built-in scenario ({', '.join(SCENARIOS)}) or a JSON file")
+    parser.add_argument("--turn-timeout", type=float, default=60.0)
+    parser.add_argument("--url", default=None, help="Load a running server instead of starting one")
+    parser.add_argument("--server-pid", type=int, default=None, help="PID of the running server, for RSS")
+    parser.add_argument("--admin-token", default=None,
+                        help="Bearer token for the server's admin API (default: sign in as the mock auth test user)")
+    parser.add_argument("--stub-tokens", type=int, default=60, help="Text deltas per stub response")
+    parser.add_argument("--stub-tps", type=float, default=80.0, help="Stub tokens per second")
+    parser.add_argument("--stub-ttft", type=float, default=0.3, help="Stub time to first token in seconds")
+    parser.add_argument("--server-env", action="append", default=[], metavar="NAME=VALUE",
+                        help="Environment for the started app, e.g. LLM_MAX_IN_FLIGHT=256 (repeatable)")
+    parser.add_argument("--server-log", action="store_true", help="Show the app's output")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None, help="Write machine-readable results to this JSON file")
+    parser.add_argument("--compare", default=None, help="Earlier --output file to compare against")
+    main(parser.parse_args())
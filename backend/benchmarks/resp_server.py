@@ -0,0 +1,254 @@
+# benchmarks/resp_server.py
+"""
+Local Redis-protocol stand-in for offline multi-worker tests.
+
+Speaks RESP2 and implements the commands the redis state backend uses
+(strings with expiry, lists, pub/sub, plus PING, AUTH, SELECT, FLUSHALL and
+DBSIZE). Everything is in memory in one process; expiry is checked when a
+key is read. It is not Redis: there is no persistence and no other command.
+
+Point the backend at it with REDIS_URL, e.g.:
+    python -m benchmarks.resp_server --port 6390
+    STATE_BACKEND=redis REDIS_URL=redis://127.0.0.1:6390 uvicorn main:app --workers 4
+"""
+import argparse
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Set
+
+class RespError(Exception):
+    """An error reply."""
+
+async def read_reply(reader: asyncio.StreamReader) -> Any:
+    """
+    Read one RESP2 value, such as a command.
+
+    Returns:
+        bytes, int, None, a list of values, or a RespError for error values
+
+    Raises:
+        ConnectionError: If the connection closed
+    """
+    line = await reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("Connection closed by the client")
+    prefix, body = line[:1], line[1:-2]
+    if prefix == b"+":
+        return body
+    if prefix == b"-":
+        return RespError(body.decode("utf-8", "replace"))
+    if prefix == b":":
+        return int(body)
+    if prefix == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        return (await reader.readexactly(length + 2))[:-2]
+    if prefix == b"*":
+        count = int(body)
+        if count < 0:
+            return None
+        return [await read_reply(reader) for _ in range(count)]
+    raise ConnectionError(f"Unexpected data from the client: {line[:40]!r}")
+
+def encode_reply(value: Any) -> bytes:
+    """
+    Encode a reply: int, bytes or str (bulk), None (nil), list, or RespError.
+
+    Returns:
+        The encoded reply
+    """
+    if isinstance(value, RespError):
+        return b"-%s\r\n" % str(value).encode("utf-8")
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, bool):
+        return b":%d\r\n" % int(value)
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    return b"*%d\r\n" % len(value) + b"".join(encode_reply(item) for item in value)
+
+OK = object()
+
+class RespServer:
+    """In-memory server for the subset of Redis commands the state backend uses."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        """
+        Args:
+            host: Interface to listen on
+            port: Port to listen on, 0 for an ephemeral port
+        """
+        self.host = host
+        self.port = port
+        self.data: Dict[bytes, Any] = {}
+        self.expires: Dict[bytes, float] = {}
+        self.channels: Dict[bytes, Set[asyncio.StreamWriter]] = {}
+        self.commands = 0
+        self.published = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Dict[asyncio.StreamWriter, asyncio.Task] = {}
+
+    @property
+    def url(self) -> str:
+        return f"redis://{self.host}:{self.port}/0"
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "commands": self.commands,
+            "published": self.published,
+            "keys": len(self.data),
+            "channels": len(self.channels),
+            "connections": len(self._connections)
+        }
+
+    async def start(self) -> None:
+        """Start listening. If port is 0 an ephemeral port is chosen."""
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        """Stop listening and close client connections."""
+        if self._server is not None:
+            self._server.close()
+            handlers = list(self._connections.values())
+            for writer in list(self._connections):
+                writer.close()
+            await asyncio.gather(*handlers, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._connections[writer] = asyncio.current_task()
+        subscribed: Set[bytes] = set()
+        try:
+            while True:
+                command = await read_reply(reader)
+                if not isinstance(command, list) or not command:
+                    writer.write(encode_reply(RespError("ERR Protocol error")))
+                    continue
+                self.commands += 1
+                name = command[0].upper()
+                args = command[1:]
+                if name in (b"SUBSCRIBE", b"UNSUBSCRIBE"):
+                    self._subscription(writer, subscribed, name, args)
+                else:
+                    reply = self._execute(name, args)
+                    writer.write(b"+OK\r\n" if reply is OK else encode_reply(reply))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for channel in subscribed:
+                self._unsubscribe(writer, channel)
+            self._connections.pop(writer, None)
+            writer.close()
+
+    def _subscription(self, writer: asyncio.StreamWriter, subscribed: Set[bytes], name: bytes, channels: List[bytes]) -> None:
+        for channel in channels or list(subscribed):
+            if name == b"SUBSCRIBE":
+                subscribed.add(channel)
+                self.channels.setdefault(channel, set()).add(writer)
+            else:
+                subscribed.discard(channel)
+                self._unsubscribe(writer, channel)
+            writer.write(encode_reply([name.lower(), channel, len(subscribed)]))
+
+    def _unsubscribe(self, writer: asyncio.StreamWriter, channel: bytes) -> None:
+        subscribers = self.channels.get(channel)
+        if subscribers is not None:
+            subscribers.discard(writer)
+            if not subscribers:
+                del self.channels[channel]
+
+    def _get(self, key: bytes) -> Any:
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return self.data.get(key)
+
+    def _execute(self, name: bytes, args: List[bytes]) -> Any:
+        try:
+            if name == b"PING":
+                return args[0] if args else OK
+            if name in (b"AUTH", b"SELECT"):
+                return OK
+            if name == b"GET":
+                value = self._get(args[0])
+                return value if value is None or isinstance(value, bytes) else RespError("WRONGTYPE")
+            if name == b"SET":
+                self.data[args[0]] = args[1]
+                self.expires.pop(args[0], None)
+                options = [arg.upper() for arg in args[2:]]
+                for unit, scale in ((b"EX", 1.0), (b"PX", 0.001)):
+                    if unit in options:
+                        self.expires[args[0]] = time.monotonic() + int(args[2 + options.index(unit) + 1]) * scale
+                return OK
+            if name == b"DEL":
+                removed = 0
+                for key in args:
+                    removed += self._get(key) is not None
+                    self.data.pop(key, None)
+                    self.expires.pop(key, None)
+                return removed
+            if name in (b"EXPIRE", b"PEXPIRE"):
+                if self._get(args[0]) is None:
+                    return 0
+                scale = 1.0 if name == b"EXPIRE" else 0.001
+                self.expires[args[0]] = time.monotonic() + int(args[1]) * scale
+                return 1
+            if name == b"PERSIST":
+                return int(self.expires.pop(args[0], None) is not None)
+            if name == b"RPUSH":
+                items = self._get(args[0])
+                if items is None:
+                    items = self.data[args[0]] = []
+                items.extend(args[1:])
+                return len(items)
+            if name == b"LRANGE":
+                items = self._get(args[0]) or []
+                start, stop = int(args[1]), int(args[2])
+                stop = len(items) if stop == -1 else stop + 1
+                return items[start:stop]
+            if name == b"LLEN":
+                return len(self._get(args[0]) or [])
+            if name == b"PUBLISH":
+                self.published += 1
+                subscribers = self.channels.get(args[0], ())
+                message = encode_reply([b"message", args[0], args[1]])
+                for subscriber in subscribers:
+                    subscriber.write(message)
+                return len(subscribers)
+            if name == b"DBSIZE":
+                return len(self.data)
+            if name == b"FLUSHALL":
+                self.data.clear()
+                self.expires.clear()
+                return OK
+        except (IndexError, ValueError):
+            return RespError(f"ERR wrong arguments for '{name.decode().lower()}' command")
+        return RespError(f"ERR unknown command '{name.decode().lower()}'")
+
+async def serve(args: argparse.Namespace) -> None:
+    server = RespServer(host=args.host, port=args.port)
+    await server.start()
+    print(f"RESP stand-in listening on {server.url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+        print(f"RESP stand-in stats: {server.get_stats()}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Redis-protocol stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,320 @@
+# benchmarks/stub_server.py
+"""
+Local Anthropic-compatible streaming stub for offline load and latency tests.
+
+Serves POST /v1/messages as a Server-Sent Events stream over HTTP/1.1 with
+keep-alive, using the same event sequence as the Messages API. Time to first
+token, tokens per second, errors and throttling are configurable, and a seed
+makes injected failures repeatable.
+
+Point the backend at it with ANTHROPIC_BASE_URL, e.g.:
+    python -m benchmarks.stub_server --port 8089 --ttft 0.4 --tps 80
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8089 ANTHROPIC_API_KEY=stub python main.py
+"""
+import argparse
+import asyncio
+import json
+import random
+from typing import Any, Dict, List, Optional
+
+WORDS = [
+    "the", "neon", "grid", "journal", "today", "feeling", "and", "a", "calm",
+    "focus", "of", "wellbeing", "to", "sleep", "energy", "reflect", "on", "your"
+]
+
+def sse_event(event: str, data: dict) -> bytes:
+    """
+    Encode a single SSE event.
+
+    Args:
+        event: The event name
+        data: The JSON payload
+
+    Returns:
+        The encoded event bytes
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+def build_stream(
+    text_chunks: List[str],
+    model: str = "claude-3-7-sonnet-20250219",
+    input_tokens: int = 25
+) -> List[bytes]:
+    """
+    Build the event sequence of a successful Messages API stream.
+
+    Args:
+        text_chunks: The text deltas to emit
+        model: Model name to report
+        input_tokens: Prompt size to report in usage
+
+    Returns:
+        List of encoded SSE events
+    """
+    events = [
+        sse_event("message_start", {
+            "type": "message_start",
+            "message": {
+                "id": "msg_stub", "type": "message", "role": "assistant", "model": model,
+                "content": [], "stop_reason": None,
+                "usage": {"input_tokens": input_tokens, "output_tokens": 1}
+            }
+        }),
+        sse_event("content_block_start", {
+            "type": "content_block_start", "index": 0,
+            "content_block": {"type": "text", "text": ""}
+        }),
+        sse_event("ping", {"type": "ping"})
+    ]
+    for text in text_chunks:
+        events.append(sse_event("content_block_delta", {
+            "type": "content_block_delta", "index": 0,
+            "delta": {"type": "text_delta", "text": text}
+        }))
+    events.append(sse_event("content_block_stop", {"type": "content_block_stop", "index": 0}))
+    events.append(sse_event("message_delta", {
+        "type": "message_delta",
+        "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+        "usage": {"output_tokens": len(text_chunks)}
+    }))
+    events.append(sse_event("message_stop", {"type": "message_stop"}))
+    return events
+
+class StubServer:
+    """Keep-alive HTTP/1.1 server emitting Claude-style SSE streams."""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        tokens: int = 20,
+        tokens_per_second: float = 0.0,
+        ttft: float = 0.0,
+        throttle_first: int = 0,
+        throttle_rate: float = 0.0,
+        overload_rate: float = 0.0,
+        error_rate: float = 0.0,
+        stream_error_rate: float = 0.0,
+        retry_after: float = 1.0,
+        seed: Optional[int] = None
+    ):
+        """
+        Args:
+            host: Interface to listen on
+            port: Port to listen on, 0 for an ephemeral port
+            tokens: Text deltas per response
+            tokens_per_second: Delta rate, 0 to send as fast as possible
+            ttft: Delay before the first text delta, in seconds
+            throttle_first: Answer this many initial requests with 429
+            throttle_rate: Probability of a 429 response
+            overload_rate: Probability of a 529 overloaded response
+            error_rate: Probability of a 500 response
+            stream_error_rate: Probability of an error event halfway through a stream
+            retry_after: retry-after value sent with 429/529 responses
+            seed: Random seed for repeatable failure injection
+        """
+        self.host = host
+        self.port = port
+        self.tokens = tokens
+        self.tokens_per_second = tokens_per_second
+        self.ttft = ttft
+        self.throttle_first = throttle_first
+        self.throttle_rate = throttle_rate
+        self.overload_rate = overload_rate
+        self.error_rate = error_rate
+        self.stream_error_rate = stream_error_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+
+        self.connections_opened = 0
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Dict[asyncio.StreamWriter, asyncio.Task] = {}
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "connections_opened": self.connections_opened,
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "errors": self.errors
+        }
+
+    async def start(self) -> None:
+        """Start listening. If port is 0 an ephemeral port is chosen."""
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        """Stop listening and close open keep-alive connections."""
+        if self._server is not None:
+            self._server.close()
+            handlers = list(self._connections.values())
+            for writer in list(self._connections):
+                writer.close()
+            # Closed transports end each handler's read loop
+            await asyncio.gather(*handlers, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections_opened += 1
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode("latin-1").split("\r\n")
+                method, path, _ = lines[0].split(" ", 2)
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", "0"))
+                body = await reader.readexactly(length) if length else b""
+
+                if method == "POST" and path.startswith("/v1/messages"):
+                    self.requests += 1
+                    await self._handle_messages(writer, body)
+                else:
+                    writer.write(b"HTTP/1.1 404 Not Found\r\ncontent-length: 0\r\n\r\n")
+                    await writer.drain()
+
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    async def _handle_messages(self, writer: asyncio.StreamWriter, body: bytes) -> None:
+        roll = self._random.random()
+        if self.throttled < self.throttle_first or roll < self.throttle_rate:
+            self.throttled += 1
+            await self._send_error(writer, 429, "Too Many Requests", "rate_limit_error", retry=True)
+            return
+        roll -= self.throttle_rate
+        if roll < self.overload_rate:
+            self.throttled += 1
+            await self._send_error(writer, 529, "Overloaded", "overloaded_error", retry=True)
+            return
+        roll -= self.overload_rate
+        if roll < self.error_rate:
+            self.errors += 1
+            await self._send_error(writer, 500, "Internal Server Error", "api_error")
+            return
+
+        try:
+            request = json.loads(body) if body else {}
+        except ValueError:
+            request = {}
+        await self._send_stream(writer, request)
+
+    async def _send_stream(self, writer: asyncio.StreamWriter, request: Dict[str, Any]) -> None:
+        prompt_chars = len(json.dumps(request.get("messages", [])))
+        tokens = min(self.tokens, int(request.get("max_tokens", self.tokens)))
+        text_chunks = [self._random.choice(WORDS) + " " for _ in range(tokens)]
+        events = build_stream(text_chunks, request.get("model", "claude-3-7-sonnet-20250219"), prompt_chars // 4)
+
+        fail_at = None
+        if self._random.random() < self.stream_error_rate:
+            self.errors += 1
+            fail_at = 3 + tokens // 2
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"content-type: text/event-stream\r\n"
+            b"transfer-encoding: chunked\r\n\r\n"
+        )
+        interval = 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+        for index, event in enumerate(events):
+            if index == fail_at:
+                event = sse_event("error", {
+                    "type": "error",
+                    "error": {"type": "overloaded_error", "message": "Stub stream error"}
+                })
+            self._write_chunk(writer, event)
+
+            if index == 2 and self.ttft:
+                # After message_start, content_block_start and ping
+                await writer.drain()
+                await asyncio.sleep(self.ttft)
+            elif index > 2 and interval:
+                await writer.drain()
+                await asyncio.sleep(interval)
+
+            if index == fail_at:
+                break
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    def _write_chunk(self, writer: asyncio.StreamWriter, data: bytes) -> None:
+        writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    async def _send_error(
+        self,
+        writer: asyncio.StreamWriter,
+        status: int,
+        reason: str,
+        error_type: str,
+        retry: bool = False
+    ) -> None:
+        body = json.dumps({
+            "type": "error",
+            "error": {"type": error_type, "message": f"Stub {reason.lower()}"}
+        }).encode("utf-8")
+        head = f"HTTP/1.1 {status} {reason}\r\ncontent-type: application/json\r\n"
+        if retry:
+            head += f"retry-after: {self.retry_after}\r\n"
+        head += f"content-length: {len(body)}\r\n\r\n"
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+async def serve(args: argparse.Namespace) -> None:
+    server = StubServer(
+        host=args.host,
+        port=args.port,
+        tokens=args.tokens,
+        tokens_per_second=args.tps,
+        ttft=args.ttft,
+        throttle_rate=args.throttle_rate,
+        throttle_first=args.throttle_first,
+        overload_rate=args.overload_rate,
+        error_rate=args.error_rate,
+        stream_error_rate=args.stream_error_rate,
+        retry_after=args.retry_after,
+        seed=args.seed
+    )
+    await server.start()
+    print(f"Stub Claude API listening on {server.base_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+        print(f"Stub stats: {server.get_stats()}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Anthropic-compatible streaming stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--tokens", type=int, default=200, help="Text deltas per response")
+    parser.add_argument("--tps", type=float, default=80.0, help="Tokens per second, 0 for unthrottled")
+    parser.add_argument("--ttft", type=float, default=0.4, help="Time to first token in seconds")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Probability of a 429")
+    parser.add_argument("--throttle-first", type=int, default=0, help="Answer this many initial requests with 429")
+    parser.add_argument("--overload-rate", type=float, default=0.0, help="Probability of a 529")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probability of a 500")
+    parser.add_argument("--stream-error-rate", type=float, default=0.0, help="Probability of a mid-stream error event")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=None)
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
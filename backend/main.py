@@ -2,6 +2,7 @@
 import uvicorn
 import os
 from app import create_app
+from app.utils.config_utils import get_config
 
 # Create the FastAPI application using our app factory
 app = create_app()
@@ -19,5 +20,8 @@ if __name__ == "__main__":
         "main:app",
         host=host,
         port=port,
-        reload=debug
+        reload=debug,
+        # Hard cap at the protocol level; frames between WS_MAX_FRAME_BYTES and
+        # this get an error frame instead of a dropped connection
+        ws_max_size=get_config()["websocket"]["max_frame_bytes"] + 1024 * 1024
     )
@@ -345,9 +345,11 @@ document.addEventListener('DOMContentLoaded', () => {
         console.log(`app.js: Attempting to connect to WebSocket at ${wsUrl}`);
         
         window.chatSocket = new WebSocket(wsUrl);
+        let reconnectAttempts = 0;
         
         window.chatSocket.onopen = function(e) {
             console.log("app.js: WebSocket connection established");
+            reconnectAttempts = 0;
         };
         
         // Track streaming state
@@ -359,9 +361,30 @@ document.addEventListener('DOMContentLoaded', () => {
                 const message = JSON.parse(event.data);
                 console.log("app.js: Received message:", message);
                 
+                if (typeof message.seq === 'number') {
+                    // Last response frame received, for resuming after a reconnect
+                    window.chatLastSeq = message.seq;
+                }
+                
                 if (message.type === 'client_id') {
                     console.log(`app.js: Client ID received: ${message.content}`);
                     window.clientId = message.content;
+                    window.chatSessionToken = message.session_token;
+                } else if (message.type === 'resync') {
+                    console.warn(`app.js: Part of the response was lost while reconnecting: ${message.content}`);
+                } else if (message.type === 'busy') {
+                    // The server shed this message or connection; it says when to try again
+                    console.warn(`app.js: Server busy (${message.reason}), retry after ${message.retry_after}s`);
+                    window.chatRetryAfter = message.retry_after;
+                    window.hideTypingIndicator();
+                    window.displayMessage(message);
+                } else if (message.type === 'reconnect') {
+                    // The server is restarting; the close that follows resumes the session elsewhere
+                    console.log(`app.js: Server restarting, reconnecting in ${message.retry_after}s`);
+                    window.chatRetryAfter = message.retry_after;
+                } else if (message.type === 'ping') {
+                    // Answer the server heartbeat so the connection is not reaped
+                    window.chatSocket.send(JSON.stringify({ type: 'pong', ts: message.ts }));
                 } else if (message.type === 'indicator') {
                     if (message.content === 'typing') {
                         window.showTypingIndicator();
@@ -495,6 +518,28 @@ document.addEventListener('DOMContentLoaded', () => {
             } else {
                 console.error('app.js: WebSocket connection died');
             }
+            
+            // Resume the session unless the server closed it on purpose (idle, or resumed in another tab);
+            // a connection turned away as busy (1013) or by a restarting server (1012) is retried
+            // after the delay the server gave
+            const busy = event.code === 1013 || event.code === 1012;
+            if ((window.chatSessionToken || busy) && event.code !== 1000 && event.code !== 4000 && reconnectAttempts < 5) {
+                const closed = event.target;
+                reconnectAttempts += 1;
+                const delay = busy && window.chatRetryAfter ? window.chatRetryAfter * 1000 : 1000 * reconnectAttempts;
+                setTimeout(function() {
+                    const resumeUrl = window.chatSessionToken
+                        ? `${wsUrl}?session=${encodeURIComponent(window.chatSessionToken)}&last_seq=${window.chatLastSeq || 0}`
+                        : wsUrl;
+                    console.log(`app.js: Resuming WebSocket session (attempt ${reconnectAttempts})`);
+                    const socket = new WebSocket(resumeUrl);
+                    socket.onopen = closed.onopen;
+                    socket.onmessage = closed.onmessage;
+                    socket.onclose = closed.onclose;
+                    socket.onerror = closed.onerror;
+                    window.chatSocket = socket;
+                }, delay);
+            }
         };
         
         window.chatSocket.onerror = function(error) {